@@ -0,0 +1,221 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+
+from mysqlapi.api import compression
+from mysqlapi.api.backup import dump
+from mysqlapi.api.management.commands import s3
+
+# binary logs shipped before they were kept per server, all of them from
+# the backup server.
+LEGACY_INDEX_KEY = "binlog/index.json"
+MAGIC = "\xfebin"
+
+
+def binlog_enabled(server):
+    server.open()
+    try:
+        cursor = server.cursor()
+        cursor.execute("SELECT @@log_bin")
+        return bool(int(cursor.fetchone()[0]))
+    finally:
+        server.close()
+
+
+def list_binlogs(server):
+    server.open()
+    try:
+        cursor = server.cursor()
+        cursor.execute("SHOW BINARY LOGS")
+        return [(row[0], int(row[1])) for row in cursor.fetchall()]
+    finally:
+        server.close()
+
+
+def flush_binlogs(server):
+    server.open()
+    try:
+        server.cursor().execute("FLUSH BINARY LOGS")
+    finally:
+        server.close()
+
+
+# binary log names, such as mysql-bin.000123, are the same on every
+# server, so the logs and their index are kept under the server name
+# (host:port).
+def object_key(server, name):
+    return "binlog/%s/%s.gz" % (server, name)
+
+
+def index_key(server):
+    return "binlog/%s/index.json" % server
+
+
+def read_index(bucket, server):
+    key = bucket.get_key(index_key(server))
+    if key is None and server == dump.address(dump.default_server()):
+        key = bucket.get_key(LEGACY_INDEX_KEY)
+    if key is None:
+        return []
+    return json.loads(key.get_contents_as_string())
+
+
+def store_index(bucket, server, entries):
+    data = json.dumps(entries, indent=2, sort_keys=True)
+    bucket.new_key(index_key(server)).set_contents_from_string(data)
+
+
+def fetch_command(server, name, directory):
+    return ["mysqlbinlog",
+            "--read-from-remote-server",
+            "--raw",
+            "--result-file=%s/" % directory,
+            "-h", server.hostname,
+            "-P", str(server.port),
+            "-u", server.username,
+            name]
+
+
+def started_at(path):
+    """
+    Returns the time the binary log was opened, which is the timestamp of
+    its first event.
+    """
+    with open(path, "rb") as f:
+        header = f.read(8)
+    if len(header) < 8 or header[:4] != MAGIC:
+        raise ValueError("%s is not a binary log" % path)
+    return struct.unpack("<I", header[4:])[0]
+
+
+def read_file(path, chunk_size=1024 * 1024):
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+
+def sequence(name):
+    """
+    Returns the base name and the number of a binary log name, e.g.
+    ("mysql-bin", 123) for mysql-bin.000123.
+    """
+    base, _, number = name.rpartition(".")
+    return base, int(number)
+
+
+def covering(index, binlog, until=None):
+    """
+    Returns the index entries needed to roll forward from the `binlog`
+    coordinates of a backup up to the `until` timestamp, failing when one
+    of them was not shipped, or when no log opened after `until` was
+    shipped yet.
+    """
+    base, first = sequence(binlog["file"])
+    entries = []
+    for entry in index:
+        entry_base, number = sequence(entry["name"])
+        if entry_base == base and number >= first:
+            entries.append((number, entry))
+    entries.sort(key=lambda e: e[0])
+    if not entries or entries[0][0] != first:
+        raise KeyError("Binary log %s was not shipped" % binlog["file"])
+    covered = [entries[0][1]]
+    previous = first
+    for number, entry in entries[1:]:
+        # a log missing before one opened after `until` may still hold
+        # events before it.
+        if number != previous + 1:
+            raise KeyError("Binary logs between %s and %s were not shipped" %
+                           (covered[-1]["name"], entry["name"]))
+        if until is not None and entry["started_at"] > until:
+            break
+        covered.append(entry)
+        previous = number
+    else:
+        # only a log opened after `until` proves the last one covered holds
+        # every event up to it.
+        if until is not None:
+            raise KeyError("Binary logs up to %s were not shipped yet, the "
+                           "last one is %s" % (until, covered[-1]["name"]))
+    return covered
+
+
+class BinlogShipper(object):
+    """
+    Copies the closed binary logs of a server to storage, compressed, and
+    keeps an index of them with the time each one was opened.
+    """
+
+    def __init__(self, server, bucket, flush=False):
+        self.server = server
+        self.bucket = bucket
+        self.flush = flush
+        self.name = dump.address(server)
+        self._stopped = threading.Event()
+
+    def ship_one(self, name, directory):
+        cmd = fetch_command(self.server, name, directory)
+        subprocess.check_call(cmd, env=dump.command_env(self.server))
+        path = os.path.join(directory, name)
+        try:
+            stream = dump.ChecksumStream(read_file(path))
+            codec = compression.compressor("gzip")
+            key = object_key(self.name, name)
+            upload = s3.upload_stream(
+                self.bucket, key, compression.CompressedStream(stream, codec))
+            return {"name": name,
+                    "key": key,
+                    "codec": "gzip",
+                    "size": stream.size,
+                    "stored_size": upload.size,
+                    "sha256": stream.checksum,
+                    "started_at": started_at(path)}
+        finally:
+            os.remove(path)
+
+    def ship(self):
+        if self.flush:
+            flush_binlogs(self.server)
+        index = read_index(self.bucket, self.name)
+        shipped = set(e["name"] for e in index)
+        # the last binary log is still being written.
+        closed = [name for name, size in list_binlogs(self.server)[:-1]
+                  if name not in shipped]
+        if not closed:
+            return []
+        directory = tempfile.mkdtemp()
+        entries = []
+        try:
+            for name in closed:
+                entry = self.ship_one(name, directory)
+                entries.append(entry)
+                index.append(entry)
+                store_index(self.bucket, self.name, index)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return entries
+
+    def follow(self, interval):
+        while not self._stopped.is_set():
+            try:
+                self.ship()
+            except Exception:
+                sys.stderr.write("Failed to ship binary logs\n")
+                traceback.print_exc(file=sys.stderr)
+            self._stopped.wait(interval)
+
+    def close(self):
+        self._stopped.set()
@@ -0,0 +1,170 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from mysqlapi.api.backup.manifest import Manifest
+from mysqlapi.api.models import Backup, BackupDatabase
+
+
+def to_datetime(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def database_checksum(entries):
+    """
+    Returns a checksum of the objects of one database in a backup.
+    """
+    sha = hashlib.sha256()
+    for entry in sorted(entries, key=lambda e: e["key"]):
+        sha.update("%s %s\n" % (entry["key"], entry.get("sha256", "")))
+    return sha.hexdigest()
+
+
+@transaction.atomic
+def record(manifest):
+    """
+    Adds a finished backup to the catalog.
+    """
+    started_at = to_datetime(manifest.started_at)
+    backup, created = Backup.objects.get_or_create(
+        backup_id=manifest.id,
+        defaults={"server": manifest.server, "started_at": started_at})
+    if not created:
+        backup.databases.all().delete()
+    backup.server = manifest.server
+    backup.started_at = started_at
+    backup.finished_at = to_datetime(manifest.finished_at)
+    backup.size = manifest.size()
+    backup.stored_size = stored_size(manifest.entries)
+    backup.failed = len(manifest.errors)
+    backup.save()
+    for name in manifest.databases():
+        entries = manifest.entries_for(name)
+        BackupDatabase.objects.create(
+            backup=backup,
+            name=name,
+            server=manifest.server,
+            started_at=started_at,
+            size=sum(e["size"] for e in entries),
+            stored_size=stored_size(entries),
+            sha256=database_checksum(entries),
+            object_count=len(entries))
+    return backup
+
+
+def latest(database=None, before=None, server=None, databases=()):
+    """
+    Returns the latest finished Backup, optionally the latest one of
+    `server` holding `database`, or every database in `databases`, started
+    at or before `before`.
+    """
+    if database:
+        query = BackupDatabase.objects.filter(
+            name=database, backup__finished_at__isnull=False)
+        if server:
+            query = query.filter(server=server)
+        if before:
+            query = query.filter(started_at__lte=before)
+        found = query.select_related("backup").order_by("-started_at")[:1]
+        return found[0].backup if found else None
+    query = Backup.objects.filter(finished_at__isnull=False)
+    for name in databases:
+        query = query.filter(databases__name=name)
+    if server:
+        query = query.filter(server=server)
+    if before:
+        query = query.filter(started_at__lte=before)
+    found = query.order_by("-started_at")[:1]
+    return found[0] if found else None
+
+
+def expired(days=None, keep=None, now=None):
+    """
+    Returns the backups older than `days`, always leaving the latest
+    `keep` finished backups of each server.
+    """
+    if days is None:
+        days = settings.BACKUP_RETENTION_DAYS
+    if keep is None:
+        keep = settings.BACKUP_RETENTION_KEEP
+    now = now or timezone.now()
+    cutoff = now - datetime.timedelta(days=days)
+    old = []
+    servers = Backup.objects.values_list("server", flat=True).distinct()
+    for server in servers:
+        kept = Backup.objects.filter(
+            server=server, finished_at__isnull=False).order_by(
+            "-started_at").values_list("pk", flat=True)[:keep]
+        query = Backup.objects.filter(server=server, started_at__lt=cutoff)
+        old.extend(query.exclude(pk__in=list(kept)).order_by("started_at"))
+    return old
+
+
+def stored_size(entries):
+    # objects reused from an earlier backup take no new space.
+    return sum(e.get("stored_size", e["size"]) for e in entries
+               if "reused_from" not in e)
+
+
+def delete(bucket, backup, referenced=()):
+    """
+    Deletes a backup from storage and from the catalog, keeping the
+    objects in `referenced`, which later backups reuse. Deduplicated
+    chunks are left for the garbage collector.
+    """
+    from mysqlapi.api.management.commands import s3
+
+    manifest = s3.get_manifest(bucket, backup.backup_id)
+    if manifest is not None:
+        names = [e["key"] for e in manifest.entries
+                 if "chunks" not in e and e["key"] not in referenced]
+        names.append(manifest.key)
+        for i in xrange(0, len(names), 1000):
+            bucket.delete_keys(names[i:i + 1000])
+    backup.delete()
+
+
+def prune(bucket, days=None, keep=None, dry_run=False):
+    from mysqlapi.api.management.commands import s3
+
+    backups = expired(days, keep)
+    if dry_run or not backups:
+        return backups
+    referenced = set()
+    kept = Backup.objects.exclude(pk__in=[b.pk for b in backups])
+    oldest = min(b.started_at for b in backups)
+    for backup in kept.filter(started_at__gt=oldest):
+        manifest = s3.get_manifest(bucket, backup.backup_id)
+        if manifest is not None:
+            referenced.update(e["key"] for e in manifest.entries
+                              if "reused_from" in e)
+    for backup in backups:
+        delete(bucket, backup, referenced)
+    return backups
+
+
+def sync(bucket):
+    """
+    Adds to the catalog the backups found in the bucket that it does not
+    know about, such as the ones taken before it existed.
+    """
+    known = set(Backup.objects.values_list("backup_id", flat=True))
+    added = []
+    for key in bucket.list():
+        if not key.name.endswith("/manifest.json"):
+            continue
+        if key.name.split("/", 1)[0] in known:
+            continue
+        manifest = Manifest.from_json(key.get_contents_as_string())
+        if manifest.finished_at:
+            added.append(record(manifest))
+    return added
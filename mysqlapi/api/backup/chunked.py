@@ -0,0 +1,302 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import Queue
+import threading
+import time
+
+import MySQLdb.cursors
+
+from mysqlapi.api import database
+from mysqlapi.api.backup import dedup, dump
+
+INTEGER_TYPES = ("tinyint", "smallint", "mediumint", "int", "bigint")
+STATEMENT_SIZE = 1024 * 1024
+HEADER = "/*!40101 SET NAMES binary*/;\n"
+
+
+def quote_name(name):
+    return "`%s`" % name.replace("`", "``")
+
+
+class Snapshot(object):
+    """
+    A set of connections that all see the same consistent snapshot, taken
+    mydumper-style: the server is briefly locked with FLUSH TABLES WITH
+    READ LOCK while every connection starts its transaction.
+    """
+
+    def __init__(self, server, size):
+        self.server = server
+        self.size = size
+        self.connections = []
+        self.binlog = None
+
+    def _connect(self):
+        return database.connect(self.server.hostname, self.server.port,
+                                self.server.username, self.server.password,
+                                "")
+
+    def open(self):
+        lock = self._connect()
+        try:
+            cursor = lock.cursor()
+            cursor.execute("FLUSH TABLES WITH READ LOCK")
+            cursor.execute("SHOW MASTER STATUS")
+            row = cursor.fetchone()
+            if row:
+                self.binlog = {"file": row[0], "position": int(row[1])}
+            for i in xrange(self.size):
+                conn = self._connect()
+                self.connections.append(conn)
+                cursor = conn.cursor()
+                cursor.execute("SET NAMES binary")
+                cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL "
+                               "REPEATABLE READ")
+                cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+            lock.cursor().execute("UNLOCK TABLES")
+        except Exception:
+            self.close()
+            raise
+        finally:
+            lock.close()
+
+    def close(self):
+        for conn in self.connections:
+            try:
+                conn.close()
+            except MySQLdb.Error:
+                pass
+        self.connections = []
+
+
+class Chunk(object):
+
+    def __init__(self, table, column=None, lower=None, upper=None,
+                 last=True):
+        self.table = table
+        self.column = column
+        self.lower = lower
+        self.upper = upper
+        self.last = last
+
+    def query(self, database):
+        sql = "SELECT * FROM %s.%s" % (quote_name(database),
+                                       quote_name(self.table))
+        if self.column is None:
+            return sql, ()
+        op = "<=" if self.last else "<"
+        column = quote_name(self.column)
+        sql += " WHERE %s >= %%s AND %s %s %%s" % (column, column, op)
+        return sql, (self.lower, self.upper)
+
+
+def split(table, column, lower, upper, rows, chunk_rows):
+    if column is None or lower is None or rows <= chunk_rows:
+        return [Chunk(table)]
+    count = (rows + chunk_rows - 1) // chunk_rows
+    step = max(1, (upper - lower + count) // count)
+    chunks = []
+    start = lower
+    while start <= upper:
+        end = start + step
+        last = end > upper
+        chunks.append(Chunk(table, column, start, upper if last else end,
+                            last))
+        start = end
+    return chunks
+
+
+def tables(conn, db):
+    cursor = conn.cursor()
+    cursor.execute("SELECT TABLE_NAME, TABLE_TYPE, TABLE_ROWS "
+                   "FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s "
+                   "ORDER BY TABLE_NAME", (db,))
+    return cursor.fetchall()
+
+
+def primary_key(conn, db, table):
+    cursor = conn.cursor()
+    cursor.execute("SELECT COLUMN_NAME, DATA_TYPE "
+                   "FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s "
+                   "AND TABLE_NAME = %s AND COLUMN_KEY = 'PRI'", (db, table))
+    rows = cursor.fetchall()
+    if len(rows) == 1 and rows[0][1].lower() in INTEGER_TYPES:
+        return rows[0][0]
+    return None
+
+
+def plan(conn, db, chunk_rows):
+    chunks = []
+    for name, kind, rows in tables(conn, db):
+        if kind != "BASE TABLE":
+            continue
+        column = primary_key(conn, db, name)
+        lower = upper = None
+        if column is not None and (rows or 0) > chunk_rows:
+            cursor = conn.cursor()
+            column_name = quote_name(column)
+            cursor.execute("SELECT MIN(%s), MAX(%s) FROM %s.%s" % (
+                column_name, column_name, quote_name(db), quote_name(name)))
+            lower, upper = cursor.fetchone()
+        chunks.extend(split(name, column, lower, upper, rows or 0,
+                            chunk_rows))
+    return chunks
+
+
+def inserts(conn, db, chunk):
+    """
+    Yields the rows of a chunk as batched INSERT statements.
+    """
+    yield HEADER
+    cursor = conn.cursor(MySQLdb.cursors.SSCursor)
+    cursor.execute(*chunk.query(db))
+    prefix = "INSERT INTO %s VALUES " % quote_name(chunk.table)
+    batch, size = [], 0
+    try:
+        for row in cursor:
+            values = "(%s)" % ",".join(conn.literal(v) for v in row)
+            batch.append(values)
+            size += len(values)
+            if size >= STATEMENT_SIZE:
+                yield prefix + ",".join(batch) + ";\n"
+                batch, size = [], 0
+        if batch:
+            yield prefix + ",".join(batch) + ";\n"
+    finally:
+        cursor.close()
+
+
+class ChunkedDump(object):
+    """
+    Dumps one database as per-table schema objects plus primary-key range
+    chunks, read in parallel from connections sharing a snapshot.
+    """
+
+    def __init__(self, server, db, bucket, prefix, workers, chunk_rows,
+                 reuse=None, codec=None, throttle=None, unchanged=None):
+        self.server = server
+        self.db = db
+        self.bucket = bucket
+        self.prefix = prefix
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        # chunk entries of a previous backup, by table, for the tables
+        # that did not change since.
+        self.reuse = reuse or {}
+        # returns the tables still unchanged once the snapshot is open.
+        self.unchanged = unchanged
+        self.codec = codec
+        self.throttle = throttle
+        self.entries = []
+        self.binlog = None
+        self._errors = []
+        self._lock = threading.Lock()
+
+    def key(self, name):
+        return "%s/%s/%s" % (self.prefix, self.db, name)
+
+    def _store(self, name, chunks, **extra):
+        start = time.time()
+        key = self.key(name)
+        if self.throttle is not None:
+            chunks = self.throttle.wrap(chunks)
+        stream = dump.ChecksumStream(chunks)
+        stored = dedup.store(self.bucket, key, stream, self.codec)
+        entry = {"database": self.db,
+                 "key": key,
+                 "size": stream.size,
+                 "sha256": stream.checksum,
+                 "seconds": time.time() - start}
+        entry.update(stored)
+        entry.update(extra)
+        with self._lock:
+            self.entries.append(entry)
+
+    def _schema(self, conn):
+        cursor = conn.cursor()
+        cursor.execute("SHOW CREATE DATABASE IF NOT EXISTS %s" %
+                       quote_name(self.db))
+        self._store("schema-create.sql", [cursor.fetchone()[1] + ";\n"],
+                    kind="database")
+        views = []
+        for name, kind, rows in tables(conn, self.db):
+            show = "TABLE" if kind == "BASE TABLE" else "VIEW"
+            cursor.execute("SHOW CREATE %s %s.%s" % (
+                show, quote_name(self.db), quote_name(name)))
+            ddl = "%sDROP %s IF EXISTS %s;\n%s;\n" % (
+                HEADER, show, quote_name(name), cursor.fetchone()[1])
+            if show == "VIEW":
+                views.append((name, ddl))
+            else:
+                self._store("%s-schema.sql" % name, [ddl], kind="schema",
+                            table=name)
+        for name, ddl in views:
+            self._store("%s-view.sql" % name, [ddl], kind="view", table=name)
+
+    def _objects(self):
+        # triggers and routines, which are not part of the table schemas.
+        cmd = ["mysqldump",
+               "-h", self.server.hostname,
+               "-P", str(self.server.port),
+               "-u", self.server.username,
+               "--no-create-info", "--no-data", "--skip-opt",
+               "--triggers", "--routines", self.db]
+        stream = database.CommandStream(cmd,
+                                        env=dump.command_env(self.server))
+        self._store("objects.sql", stream, kind="objects")
+
+    def _worker(self, conn, queue):
+        while True:
+            try:
+                n, chunk = queue.get_nowait()
+            except Queue.Empty:
+                return
+            if self._errors:
+                continue
+            try:
+                self._store("%s.%05d.sql" % (chunk.table, n),
+                            inserts(conn, self.db, chunk),
+                            kind="chunk", table=chunk.table,
+                            range=[chunk.lower, chunk.upper])
+            except Exception as exc:
+                self._errors.append(exc)
+
+    def run(self):
+        snapshot = Snapshot(self.server, self.workers)
+        snapshot.open()
+        try:
+            self.binlog = snapshot.binlog
+            if self.reuse and self.unchanged is not None:
+                # a table written to after it was found unchanged, but
+                # before the snapshot, is in neither the previous backup
+                # nor the binary logs after the snapshot, so it is dumped.
+                unchanged = self.unchanged()
+                for table in list(self.reuse):
+                    if table not in unchanged:
+                        del self.reuse[table]
+            conn = snapshot.connections[0]
+            self._schema(conn)
+            queue = Queue.Queue()
+            numbers = {}
+            for chunk in plan(conn, self.db, self.chunk_rows):
+                if chunk.table in self.reuse:
+                    continue
+                n = numbers[chunk.table] = numbers.get(chunk.table, 0) + 1
+                queue.put((n, chunk))
+            threads = []
+            for conn in snapshot.connections:
+                t = threading.Thread(target=self._worker, args=(conn, queue))
+                t.start()
+                threads.append(t)
+            for t in threads:
+                t.join()
+        finally:
+            snapshot.close()
+        if self._errors:
+            raise self._errors[0]
+        self._objects()
+        for entries in self.reuse.values():
+            self.entries.extend(entries)
+        return self.entries
@@ -0,0 +1,229 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import calendar
+import hashlib
+import Queue
+import re
+import threading
+import time
+import zlib
+
+from django.conf import settings
+
+from mysqlapi.api import compression
+from mysqlapi.api.management.commands import s3
+
+CHUNK_PREFIX = "chunks/"
+# row and statement separators of mysqldump output.
+SEPARATORS = re.compile(r"\n|\),\(")
+
+
+class ContentChunker(object):
+    """
+    Splits a stream in content-defined chunks, so that a change in a dump
+    only changes the chunks around it.
+
+    Boundaries are chosen among the row and statement separators of the
+    dump: a boundary is placed after a segment when the crc32 of the
+    segment falls below a threshold proportional to its length, which
+    gives chunks of `avg_size` bytes on average while keeping the hashing
+    in C.
+    """
+
+    def __init__(self, avg_size=1024 * 1024, min_size=None, max_size=None):
+        self.avg_size = avg_size
+        self.min_size = min_size or avg_size // 4
+        self.max_size = max_size or avg_size * 4
+
+    def _is_boundary(self, segment):
+        limit = len(segment) * (1 << 32) // self.avg_size
+        return (zlib.crc32(segment) & 0xffffffff) < limit
+
+    def split(self, stream):
+        buf = ""
+        # offset of the first segment not yet checked for a boundary.
+        scanned = 0
+        for data in stream:
+            buf += data
+            while True:
+                cut = None
+                for match in SEPARATORS.finditer(buf, scanned):
+                    end = match.end()
+                    if end > self.max_size:
+                        break
+                    segment = buf[scanned:end]
+                    scanned = end
+                    if end >= self.min_size and self._is_boundary(segment):
+                        cut = end
+                        break
+                if cut is None and len(buf) >= self.max_size:
+                    cut = self.max_size
+                if cut is None:
+                    break
+                yield buf[:cut]
+                buf = buf[cut:]
+                scanned = 0
+        if buf:
+            yield buf
+
+
+def chunk_key(digest):
+    return "%s%s/%s" % (CHUNK_PREFIX, digest[:2], digest)
+
+
+class ChunkStore(object):
+    """
+    Stores chunks gzipped under their sha256, uploading only the chunks
+    the bucket does not have yet, with up to `concurrency` uploads at once.
+    Chunks already stored are copied onto themselves instead, which
+    renews their modification time so that `collect` does not delete them
+    while the backup reusing them is still running.
+    """
+
+    def __init__(self, bucket, concurrency=None):
+        self.bucket = bucket
+        self.concurrency = concurrency or settings.S3_UPLOAD_CONCURRENCY
+        self.stored_size = 0
+        self.new_chunks = 0
+        self.reused_chunks = 0
+        self._known = set()
+        self._errors = []
+        self._lock = threading.Lock()
+
+    def _upload(self, digest, data):
+        key = chunk_key(digest)
+        if self.bucket.get_key(key) is not None:
+            # S3 only copies an object onto itself when its metadata
+            # changes.
+            self.bucket.copy_key(key, self.bucket.name, key,
+                                 metadata={"reused-at": str(int(time.time()))})
+            with self._lock:
+                self.reused_chunks += 1
+            return
+        codec = compression.compressor("gzip")
+        stored = codec.compress(data) + codec.flush()
+        self.bucket.new_key(key).set_contents_from_string(stored)
+        with self._lock:
+            self.stored_size += len(stored)
+            self.new_chunks += 1
+
+    def _worker(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            if self._errors:
+                continue
+            try:
+                self._upload(*item)
+            except Exception as exc:
+                self._errors.append(exc)
+
+    def put(self, chunks):
+        """
+        Stores every chunk of an iterable, returning their digests.
+        """
+        digests = []
+        queue = Queue.Queue(maxsize=self.concurrency)
+        workers = []
+        for i in xrange(self.concurrency):
+            t = threading.Thread(target=self._worker, args=(queue,))
+            t.daemon = True
+            t.start()
+            workers.append(t)
+        try:
+            for data in chunks:
+                if self._errors:
+                    break
+                digest = hashlib.sha256(data).hexdigest()
+                digests.append(digest)
+                if digest not in self._known:
+                    self._known.add(digest)
+                    queue.put((digest, data))
+        finally:
+            for t in workers:
+                queue.put(None)
+            for t in workers:
+                t.join()
+        if self._errors:
+            raise self._errors[0]
+        return digests
+
+
+def store(bucket, key, chunks, codec=None):
+    """
+    Stores a backup object, either as a plain object under `key`,
+    compressed with `codec` (a CodecOptions) when given, or, when
+    deduplication is enabled, as a list of shared chunks. Returns the
+    fields to add to its manifest entry.
+    """
+    if not settings.BACKUP_DEDUP:
+        if codec is None:
+            upload = s3.upload_stream(bucket, key, chunks)
+            return {"stored_size": upload.size}
+        compressor = compression.ParallelCompressor(
+            codec.name, codec.level, codec.threads)
+        key = "%s.%s" % (key, compression.EXTENSIONS[codec.name])
+        upload = s3.upload_stream(bucket, key, compressor.compress(chunks))
+        return {"key": key,
+                "codec": codec.name,
+                "stored_size": upload.size,
+                "compress_seconds": compressor.seconds}
+    # chunks are always gzipped, as they are shared by backups that may
+    # use different codecs.
+    chunker = ContentChunker(settings.BACKUP_DEDUP_CHUNK_SIZE)
+    chunk_store = ChunkStore(bucket)
+    digests = chunk_store.put(chunker.split(chunks))
+    return {"chunks": digests, "stored_size": chunk_store.stored_size}
+
+
+def read(bucket, digests):
+    """
+    Yields the content of a deduplicated object, checking each chunk.
+    """
+    for digest in digests:
+        key = bucket.get_key(chunk_key(digest))
+        if key is None:
+            raise KeyError("Chunk %s not found" % digest)
+        data = compression.decompressor("gzip").decompress(
+            key.get_contents_as_string())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError("Chunk %s is corrupted" % digest)
+        yield data
+
+
+def modified_at(key):
+    # boto lists keys with an ISO 8601 last_modified, in UTC.
+    return calendar.timegm(time.strptime(key.last_modified[:19],
+                                         "%Y-%m-%dT%H:%M:%S"))
+
+
+def collect(bucket, grace=None, dry_run=False):
+    """
+    Deletes the chunks no manifest references. Chunks newer than `grace`
+    seconds are kept, as they may belong to a backup still running.
+    Returns the names of the deleted chunks.
+    """
+    from mysqlapi.api.backup.manifest import Manifest
+
+    if grace is None:
+        grace = settings.BACKUP_DEDUP_GC_GRACE
+    referenced = set()
+    stored = []
+    for key in bucket.list():
+        if key.name.endswith("/manifest.json"):
+            manifest = Manifest.from_json(key.get_contents_as_string())
+            for entry in manifest.entries:
+                referenced.update(entry.get("chunks", ()))
+        elif key.name.startswith(CHUNK_PREFIX):
+            stored.append(key)
+    deadline = time.time() - grace
+    garbage = [key.name for key in stored
+               if key.name.rsplit("/", 1)[-1] not in referenced and
+               modified_at(key) < deadline]
+    if not dry_run:
+        for i in xrange(0, len(garbage), 1000):
+            bucket.delete_keys(garbage[i:i + 1000])
+    return garbage
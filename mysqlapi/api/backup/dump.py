@@ -0,0 +1,147 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import hashlib
+import os
+import re
+import time
+
+from django.conf import settings
+
+from mysqlapi.api.database import CommandStream, Connection
+
+SYSTEM_SCHEMAS = ("performance_schema", "sys")
+MASTER_DATA_RE = re.compile(r"CHANGE MASTER TO MASTER_LOG_FILE='([^']+)', "
+                            r"MASTER_LOG_POS=(\d+)")
+
+
+def default_server():
+    return Connection(hostname=settings.BACKUP_HOST,
+                      port=settings.BACKUP_PORT,
+                      username=settings.BACKUP_USER,
+                      password=settings.BACKUP_PASSWORD)
+
+
+def address(server):
+    return "%s:%s" % (server.hostname, server.port)
+
+
+def server_for(name):
+    """
+    Returns a connection to the server named `name` (host:port) in backups:
+    the backup server, or the server of an instance, with the credentials
+    it is administered with. Returns None for unknown servers.
+    """
+    from mysqlapi.api.models import Instance
+
+    server = default_server()
+    if address(server) == name:
+        return server
+    instances = Instance.objects.filter(state="running").select_related(
+        "provisioned")
+    for instance in instances:
+        server = instance.db_manager().conn
+        if address(server) == name:
+            return server
+    return None
+
+
+def list_databases(server):
+    server.open()
+    try:
+        cursor = server.cursor()
+        cursor.execute("SHOW DATABASES")
+        names = [row[0] for row in cursor.fetchall()]
+    finally:
+        server.close()
+    skip = set(settings.RESERVED_NAMES) | set(SYSTEM_SCHEMAS)
+    return [name for name in names if name not in skip]
+
+
+def database_size(server, database):
+    server.open()
+    try:
+        cursor = server.cursor()
+        cursor.execute("SELECT SUM(DATA_LENGTH) "
+                       "FROM information_schema.TABLES "
+                       "WHERE TABLE_SCHEMA = %s", (database,))
+        size = cursor.fetchone()[0]
+    finally:
+        server.close()
+    return int(size or 0)
+
+
+def command_env(server):
+    env = dict(os.environ)
+    if server.password:
+        env["MYSQL_PWD"] = server.password
+    return env
+
+
+def dump_command(server, database):
+    cmd = ["mysqldump",
+           "-h", server.hostname,
+           "-P", str(server.port),
+           "-u", server.username,
+           "--quick",
+           "--single-transaction"]
+    if settings.BACKUP_BINLOG:
+        # writes the binlog coordinates of the snapshot as a comment.
+        cmd.append("--master-data=2")
+    return cmd + ["--databases", database]
+
+
+def dump(server, database):
+    return CommandStream(dump_command(server, database),
+                         env=command_env(server))
+
+
+class ChecksumStream(object):
+    """
+    Passes chunks through while recording their size, sha256 and the time
+    spent producing them.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.size = 0
+        self.seconds = 0
+        self._sha = hashlib.sha256()
+
+    @property
+    def checksum(self):
+        return self._sha.hexdigest()
+
+    def __iter__(self):
+        start = time.time()
+        try:
+            for chunk in self.chunks:
+                self.size += len(chunk)
+                self._sha.update(chunk)
+                yield chunk
+        finally:
+            self.seconds = time.time() - start
+
+
+class BinlogPositionStream(object):
+    """
+    Passes the chunks of a dump made with --master-data through, picking
+    the binlog coordinates of its snapshot from the dump header.
+    """
+
+    def __init__(self, chunks, limit=64 * 1024):
+        self.chunks = chunks
+        self.limit = limit
+        self.binlog = None
+
+    def __iter__(self):
+        head = ""
+        for chunk in self.chunks:
+            if self.binlog is None and len(head) < self.limit:
+                head += chunk
+                match = MASTER_DATA_RE.search(head)
+                if match:
+                    self.binlog = {"file": match.group(1),
+                                   "position": int(match.group(2))}
+            yield chunk
@@ -0,0 +1,134 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import hashlib
+import re
+
+import MySQLdb
+
+from django.conf import settings
+
+from mysqlapi.api.backup.chunked import quote_name
+
+AUTO_INCREMENT_RE = re.compile(r" AUTO_INCREMENT=\d+")
+# key of the fingerprint of views, triggers and routines.
+OBJECTS = ""
+
+
+def status(cursor, db):
+    """
+    Fingerprints tables from information_schema. Tables without an update
+    time (InnoDB before 5.7, or after a restart) get no fingerprint and
+    are always dumped.
+
+    Update times have a resolution of one second, so a write made after
+    the dump's snapshot, in the second the fingerprint was taken, would
+    leave the next fingerprint unchanged. Tables updated in the last
+    second get no fingerprint either.
+    """
+    try:
+        # MySQL 8 caches the statistics for a day by default.
+        cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+    except MySQLdb.Error:
+        pass
+    cursor.execute("SELECT TABLE_NAME, CREATE_TIME, UPDATE_TIME, "
+                   "TABLE_ROWS, DATA_LENGTH, "
+                   "UPDATE_TIME >= NOW() - INTERVAL 1 SECOND "
+                   "FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s "
+                   "AND TABLE_TYPE = 'BASE TABLE'", (db,))
+    result = {}
+    for name, created, updated, rows, length, recent in cursor.fetchall():
+        if updated is None or recent:
+            result[name] = None
+        else:
+            result[name] = "%s/%s/%s/%s" % (created, updated, rows, length)
+    return result
+
+
+def checksum(cursor, db):
+    """
+    Fingerprints tables with CHECKSUM TABLE, which reads every row.
+    """
+    cursor.execute("SELECT TABLE_NAME FROM information_schema.TABLES "
+                   "WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE'",
+                   (db,))
+    result = {}
+    for (name,) in cursor.fetchall():
+        cursor.execute("CHECKSUM TABLE %s.%s" % (quote_name(db),
+                                                 quote_name(name)))
+        value = cursor.fetchone()[1]
+        result[name] = None if value is None else str(value)
+    return result
+
+
+STRATEGIES = {
+    "status": status,
+    "checksum": checksum,
+}
+
+
+def definitions(cursor, db, names):
+    result = {}
+    for name in names:
+        cursor.execute("SHOW CREATE TABLE %s.%s" % (quote_name(db),
+                                                    quote_name(name)))
+        ddl = AUTO_INCREMENT_RE.sub("", cursor.fetchone()[1])
+        result[name] = hashlib.sha1(ddl).hexdigest()
+    sha = hashlib.sha1()
+    for query in ("SELECT TABLE_NAME, VIEW_DEFINITION "
+                  "FROM information_schema.VIEWS WHERE TABLE_SCHEMA = %s",
+                  "SELECT TRIGGER_NAME, ACTION_STATEMENT "
+                  "FROM information_schema.TRIGGERS "
+                  "WHERE TRIGGER_SCHEMA = %s",
+                  "SELECT ROUTINE_NAME, LAST_ALTERED "
+                  "FROM information_schema.ROUTINES "
+                  "WHERE ROUTINE_SCHEMA = %s"):
+        cursor.execute(query, (db,))
+        for row in sorted(cursor.fetchall()):
+            sha.update("%s\n" % "\t".join(unicode(v) for v in row))
+    result[OBJECTS] = sha.hexdigest()
+    return result
+
+
+def take(server, db, strategy=None):
+    """
+    Returns the fingerprint of each table of a database, None for the
+    tables that cannot be fingerprinted, plus one for its other objects.
+    Table definitions are part of the fingerprints.
+    """
+    strategy = strategy or settings.BACKUP_FINGERPRINT
+    server.open()
+    try:
+        cursor = server.cursor()
+        result = STRATEGIES[strategy](cursor, db)
+        ddl = definitions(cursor, db, sorted(result))
+    finally:
+        server.close()
+    for name, value in result.items():
+        if value is not None:
+            result[name] = "%s:%s:%s" % (strategy, value, ddl[name])
+    result[OBJECTS] = ddl[OBJECTS]
+    return result
+
+
+def unchanged_tables(previous, current):
+    """
+    Returns the tables whose fingerprint did not change.
+    """
+    previous = previous or {}
+    return set(name for name, value in current.items()
+               if name != OBJECTS and value is not None and
+               previous.get(name) == value)
+
+
+def unchanged(previous, current):
+    """
+    Tells whether a whole database is unchanged.
+    """
+    if not previous or set(previous) != set(current):
+        return False
+    if previous.get(OBJECTS) != current.get(OBJECTS):
+        return False
+    tables = set(current) - set([OBJECTS])
+    return unchanged_tables(previous, current) == tables
@@ -0,0 +1,213 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import Queue
+import re
+import threading
+import time
+
+from mysqlapi.api import database
+from mysqlapi.api.backup.chunked import quote_name
+from mysqlapi.api.backup.restore import read_entry
+
+INDEX_RE = re.compile(r"^\s+((UNIQUE |FULLTEXT |SPATIAL )?KEY .*?),?$")
+AUTO_INCREMENT_RE = re.compile(r"^\s+`([^`]+)` .* AUTO_INCREMENT\b")
+# first column of a key definition.
+KEY_COLUMN_RE = re.compile(r"^\s+(PRIMARY |UNIQUE )?KEY [^(]*\(`([^`]+)`")
+
+
+def statements(chunks):
+    """
+    Splits the content of a chunk object in statements, one per line.
+    """
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    if pending.strip():
+        yield pending
+
+
+def split_indexes(ddl):
+    """
+    Removes the secondary indexes from a CREATE TABLE statement, returning
+    the new statement and the index definitions, so they can be built
+    after the data is loaded. Tables with foreign keys are left alone, and
+    an AUTO_INCREMENT column keeps the first index starting with it, as
+    InnoDB refuses to create the table otherwise.
+    """
+    if "FOREIGN KEY" in ddl:
+        return ddl, []
+    lines = ddl.split("\n")
+    auto_increment = set()
+    for line in lines:
+        match = AUTO_INCREMENT_RE.match(line)
+        if match:
+            auto_increment.add(match.group(1))
+    kept, indexes = [], []
+    for line in lines:
+        match = INDEX_RE.match(line)
+        column = KEY_COLUMN_RE.match(line)
+        if column and column.group(2) in auto_increment:
+            auto_increment.discard(column.group(2))
+            kept.append(line)
+        elif match:
+            indexes.append(match.group(1))
+        else:
+            kept.append(line)
+    if indexes:
+        for i in xrange(len(kept) - 1, 0, -1):
+            if kept[i].startswith(")"):
+                kept[i - 1] = kept[i - 1].rstrip(",")
+                break
+    return "\n".join(kept), indexes
+
+
+class TableLoad(object):
+
+    def __init__(self, name, chunks):
+        self.name = name
+        self.remaining = chunks
+        self.indexes = []
+        self.size = 0
+        self.started = None
+        self.finished = None
+
+    def throughput(self):
+        elapsed = max((self.finished or time.time()) - self.started, 0.001)
+        return self.size / elapsed
+
+
+class ParallelLoader(object):
+    """
+    Restores a chunked database using several connections: tables are
+    created without their secondary indexes, chunks are loaded in parallel
+    with unique and foreign key checks disabled, and the indexes of each
+    table are built once its last chunk is in.
+    """
+
+    def __init__(self, restorer, db, entries):
+        self.restorer = restorer
+        self.db = db
+        self.entries = entries
+        self.tables = {}
+        self._errors = []
+        self._lock = threading.Lock()
+
+    def _connect(self, db=""):
+        server = self.restorer.server
+        conn = database.connect(server.hostname, server.port,
+                                server.username, server.password, db)
+        cursor = conn.cursor()
+        cursor.execute("SET NAMES binary")
+        cursor.execute("SET SESSION unique_checks = 0")
+        cursor.execute("SET SESSION foreign_key_checks = 0")
+        return conn
+
+    def _execute(self, conn, entry):
+        size = 0
+        cursor = conn.cursor()
+        chunks = read_entry(self.restorer.bucket, entry)
+        for statement in statements(chunks):
+            size += len(statement) + 1
+            cursor.execute(statement)
+        conn.commit()
+        return size
+
+    def _by_kind(self, *kinds):
+        return [e for e in self.entries if e.get("kind") in kinds]
+
+    def _schemas(self):
+        conn = self._connect()
+        try:
+            for entry in self._by_kind("database"):
+                self._execute(conn, entry)
+            conn.select_db(self.db)
+            cursor = conn.cursor()
+            for entry in self._by_kind("schema"):
+                content = "".join(read_entry(self.restorer.bucket, entry))
+                table = self.tables[entry["table"]]
+                for statement in content.split(";\n"):
+                    if statement.startswith("CREATE TABLE"):
+                        statement, table.indexes = split_indexes(statement)
+                    if statement.strip():
+                        cursor.execute(statement)
+            # tables without rows get their indexes right away.
+            for table in self.tables.values():
+                if table.remaining == 0:
+                    table.started = time.time()
+                    self._build_indexes(conn, table)
+        finally:
+            conn.close()
+
+    def _build_indexes(self, conn, table):
+        if table.indexes:
+            adds = ", ".join("ADD %s" % index for index in table.indexes)
+            conn.cursor().execute("ALTER TABLE %s %s" % (
+                quote_name(table.name), adds))
+        table.finished = time.time()
+        out = self.restorer.out
+        if out:
+            out.write("%s.%s: %d bytes in %.1fs (%.1f MB/s)\n" % (
+                self.db, table.name, table.size,
+                table.finished - table.started,
+                table.throughput() / 1024 / 1024))
+
+    def _worker(self, queue):
+        conn = self._connect(self.db)
+        try:
+            while True:
+                try:
+                    entry = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                if self._errors:
+                    continue
+                table = self.tables[entry["table"]]
+                try:
+                    with self._lock:
+                        if table.started is None:
+                            table.started = time.time()
+                    size = self._execute(conn, entry)
+                    with self._lock:
+                        table.size += size
+                        table.remaining -= 1
+                        done = table.remaining == 0
+                    if done:
+                        self._build_indexes(conn, table)
+                except Exception as exc:
+                    self._errors.append(exc)
+        finally:
+            conn.close()
+
+    def run(self):
+        chunks = self._by_kind("chunk")
+        for entry in self._by_kind("schema", "chunk"):
+            name = entry["table"]
+            if name not in self.tables:
+                self.tables[name] = TableLoad(name, 0)
+            if entry["kind"] == "chunk":
+                self.tables[name].remaining += 1
+        self._schemas()
+        # biggest chunks first, so the slowest tables start early.
+        queue = Queue.Queue()
+        for entry in sorted(chunks, key=lambda e: -e["size"]):
+            queue.put(entry)
+        threads = []
+        for i in xrange(min(self.restorer.threads, len(chunks))):
+            t = threading.Thread(target=self._worker, args=(queue,))
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        if self._errors:
+            raise self._errors[0]
+        rest = self._by_kind("view", "objects")
+        if rest:
+            self.restorer.load(self.db, rest)
+        return self.tables
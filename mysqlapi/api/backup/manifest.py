@@ -0,0 +1,67 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import json
+import time
+
+
+class Manifest(object):
+    """
+    Describes a backup: which objects were stored for which databases,
+    along with their sizes, checksums and timings.
+    """
+
+    def __init__(self, backup_id, server, started_at=None, finished_at=None,
+                 entries=None, errors=None, metadata=None):
+        self.id = backup_id
+        self.server = server
+        self.started_at = started_at or time.time()
+        self.finished_at = finished_at
+        self.entries = entries or []
+        self.errors = errors or {}
+        self.metadata = metadata or {}
+
+    @property
+    def key(self):
+        return key_for(self.id)
+
+    def add(self, **entry):
+        self.entries.append(entry)
+
+    def databases(self):
+        return sorted(set(e["database"] for e in self.entries))
+
+    def entries_for(self, database):
+        return [e for e in self.entries if e["database"] == database]
+
+    def size(self):
+        return sum(e["size"] for e in self.entries)
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    def to_json(self):
+        return json.dumps({
+            "id": self.id,
+            "server": self.server,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "entries": self.entries,
+            "errors": self.errors,
+            "metadata": self.metadata,
+        }, indent=2, sort_keys=True)
+
+    @classmethod
+    def from_json(cls, data):
+        data = json.loads(data)
+        return cls(data["id"], data["server"],
+                   started_at=data["started_at"],
+                   finished_at=data["finished_at"],
+                   entries=data["entries"],
+                   errors=data["errors"],
+                   metadata=data.get("metadata"))
+
+
+def key_for(backup_id):
+    return "%s/manifest.json" % backup_id
@@ -0,0 +1,211 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from mysqlapi.api import compression
+from mysqlapi.api.backup import binlog, dedup, dump
+from mysqlapi.api.backup.chunked import quote_name
+from mysqlapi.api.database import CommandSink, CommandStream
+from mysqlapi.api.management.commands import s3
+
+# order in which the objects of a chunked database are loaded.
+KIND_ORDER = {"database": 0, "schema": 1, "chunk": 2, "view": 3,
+              "objects": 4}
+
+
+class RestoreError(Exception):
+    pass
+
+
+def restore_command(server):
+    return ["mysql",
+            "-h", server.hostname,
+            "-P", str(server.port),
+            "-u", server.username]
+
+
+def replay_command(database, position, files, until=None):
+    cmd = ["mysqlbinlog",
+           "--database=%s" % database,
+           "--start-position=%d" % position]
+    if until is not None:
+        cmd.append("--stop-datetime=%s" % time.strftime(
+            "%Y-%m-%d %H:%M:%S", time.localtime(until)))
+    return cmd + files
+
+
+def ordered(entries):
+    return sorted(entries, key=lambda e: (KIND_ORDER.get(e.get("kind"), 0),
+                                          e["key"]))
+
+
+def transferred_size(entry):
+    # deduplicated objects are tracked after decompression.
+    if "chunks" in entry:
+        return entry["size"]
+    return entry.get("stored_size", entry["size"])
+
+
+def _track(chunks, progress):
+    for chunk in chunks:
+        progress.update(len(chunk))
+        yield chunk
+
+
+def read_entry(bucket, entry, progress=None):
+    """
+    Yields the decompressed content of a backup object, checking it
+    against the checksum recorded in the manifest.
+    """
+    sha = hashlib.sha256()
+    if "chunks" in entry:
+        stream = dedup.read(bucket, entry["chunks"])
+        if progress:
+            stream = _track(stream, progress)
+    else:
+        chunks = s3.read_stream(bucket, entry["key"])
+        if progress:
+            chunks = _track(chunks, progress)
+        codec = compression.decompressor(entry.get("codec", "identity"))
+        stream = compression.DecompressedStream(chunks, codec)
+    for data in stream:
+        sha.update(data)
+        yield data
+    if entry.get("sha256") and sha.hexdigest() != entry["sha256"]:
+        raise RestoreError("Checksum mismatch for %s" % entry["key"])
+
+
+class Progress(object):
+
+    def __init__(self, database, total, out, interval=5):
+        self.database = database
+        self.total = total
+        self.done = 0
+        self.out = out
+        self.interval = interval
+        self.started = self._reported = time.time()
+
+    def update(self, size):
+        self.done += size
+        now = time.time()
+        if now - self._reported >= self.interval:
+            self._reported = now
+            self.report()
+
+    def report(self):
+        percent = 100
+        if self.total:
+            percent = min(100, 100 * self.done // self.total)
+        elapsed = max(time.time() - self.started, 0.001)
+        self.out.write("%s: %d%% (%d/%d bytes, %.1f MB/s)\n" % (
+            self.database, percent, self.done, self.total,
+            self.done / elapsed / 1024 / 1024))
+
+
+class Restorer(object):
+    """
+    Streams the objects of a backup from storage, through decompression,
+    into the stdin of the mysql client, one database at a time.
+    """
+
+    def __init__(self, server, bucket, manifest, out=None, threads=1,
+                 until=None):
+        self.server = server
+        self.bucket = bucket
+        self.manifest = manifest
+        self.out = out
+        self.threads = threads
+        self.until = until
+
+    def stream(self, database, entries, progress=None):
+        selected = False
+        for entry in ordered(entries):
+            if entry.get("kind") not in ("database", None) and not selected:
+                yield "USE %s;\n" % quote_name(database)
+                selected = True
+            for data in read_entry(self.bucket, entry, progress):
+                yield data
+
+    def load(self, database, entries, progress=None):
+        sink = CommandSink(restore_command(self.server),
+                           env=dump.command_env(self.server))
+        try:
+            for data in self.stream(database, entries, progress):
+                sink.write(data)
+        finally:
+            sink.close()
+
+    def replay(self, database):
+        """
+        Rolls a restored database forward by replaying the shipped binary
+        logs from the coordinates of its snapshot up to `until`.
+        """
+        snapshot = self.manifest.metadata.get("snapshots", {}).get(database)
+        if not snapshot:
+            raise RestoreError("Backup %s has no binlog coordinates for %s" %
+                               (self.manifest.id, database))
+        try:
+            # the logs of the server the backup was taken from.
+            index = binlog.read_index(self.bucket, self.manifest.server)
+            entries = binlog.covering(index, snapshot, self.until)
+        except KeyError as exc:
+            raise RestoreError(exc.args[0])
+        directory = tempfile.mkdtemp()
+        try:
+            files = []
+            for entry in entries:
+                path = os.path.join(directory, entry["name"])
+                with open(path, "wb") as f:
+                    for data in read_entry(self.bucket, entry):
+                        f.write(data)
+                files.append(path)
+            events = CommandStream(replay_command(
+                database, snapshot["position"], files, self.until))
+            sink = CommandSink(restore_command(self.server),
+                               env=dump.command_env(self.server))
+            try:
+                for data in events:
+                    sink.write(data)
+            finally:
+                events.close()
+                sink.close()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        if self.out:
+            self.out.write("%s: replayed %d binary logs\n" % (database,
+                                                              len(files)))
+
+    def restore_database(self, database):
+        entries = self.manifest.entries_for(database)
+        if not entries:
+            raise RestoreError("Database %s is not in backup %s" %
+                               (database, self.manifest.id))
+        chunked = any(e.get("kind") == "chunk" for e in entries)
+        if self.threads > 1 and chunked:
+            from mysqlapi.api.backup.loader import ParallelLoader
+            ParallelLoader(self, database, entries).run()
+        else:
+            progress = None
+            if self.out:
+                total = sum(transferred_size(e) for e in entries)
+                progress = Progress(database, total, self.out)
+            self.load(database, entries, progress)
+            if progress:
+                progress.report()
+        if self.until is not None:
+            self.replay(database)
+
+    def restore(self, databases=None):
+        if self.until is not None and self.manifest.started_at > self.until:
+            raise RestoreError("Backup %s was taken after the target time" %
+                               self.manifest.id)
+        databases = databases or self.manifest.databases()
+        for database in databases:
+            self.restore_database(database)
+        return databases
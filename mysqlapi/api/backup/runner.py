@@ -0,0 +1,229 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import Queue
+import threading
+import time
+
+from uuid import uuid4
+
+from django.conf import settings
+
+from mysqlapi.api import compression
+from mysqlapi.api.database import Connection
+from mysqlapi.api.backup import catalog, chunked, dedup, dump, fingerprint
+from mysqlapi.api.backup.manifest import Manifest
+from mysqlapi.api.management.commands import s3
+
+
+def codec_options(name=None, level=None, threads=None):
+    """
+    Returns the CodecOptions for a run, from settings unless given, or
+    None when backups are not compressed.
+    """
+    name = name or settings.BACKUP_CODEC
+    if name == "none":
+        return None
+    if name not in compression.available():
+        raise ValueError("Codec %s is not available." % name)
+    if level is None and settings.BACKUP_CODEC_LEVEL:
+        level = int(settings.BACKUP_CODEC_LEVEL)
+    threads = threads or settings.BACKUP_CODEC_THREADS
+    return compression.CodecOptions(name, level, threads)
+
+
+def capped(workers):
+    if settings.BACKUP_MAX_WORKERS:
+        return min(workers, settings.BACKUP_MAX_WORKERS)
+    return workers
+
+
+class BackupRunner(object):
+    """
+    Dumps each database of a server as its own object, running up to
+    `workers` dumps at once, and stores a manifest describing them.
+    Backups with `last` set also become the one the "lastkey" object points
+    to, which restores of backups taken before the catalog fall back to.
+    """
+
+    def __init__(self, server, bucket, workers=4, backup_id=None,
+                 codec=None, throttle=None, last=True):
+        self.server = server
+        self.bucket = bucket
+        self.workers = capped(workers)
+        self.codec = codec
+        self.throttle = throttle
+        self.last = last
+        self.manifest = Manifest(backup_id or uuid4().hex,
+                                 dump.address(server))
+        self._previous = {}
+        self._lock = threading.Lock()
+
+    def object_key(self, database):
+        return "%s/%s.sql" % (self.manifest.id, database)
+
+    def connect(self):
+        # a Connection holds a single pooled connection, so each worker
+        # queries the server on one of its own.
+        return Connection(self.server.hostname, self.server.port,
+                          self.server.username, self.server.password, "")
+
+    def is_large(self, database, server=None):
+        threshold = settings.BACKUP_CHUNK_THRESHOLD
+        return threshold and dump.database_size(server or self.server,
+                                                database) > threshold
+
+    def record_snapshot(self, database, binlog):
+        with self._lock:
+            snapshots = self.manifest.metadata.setdefault("snapshots", {})
+            snapshots[database] = binlog
+
+    def previous(self, database):
+        """
+        Returns the manifest of the latest backup of `database` from this
+        server, if any.
+        """
+        backup = catalog.latest(database=database, server=self.manifest.server)
+        if backup is None:
+            return None
+        with self._lock:
+            if backup.backup_id not in self._previous:
+                self._previous[backup.backup_id] = s3.get_manifest(
+                    self.bucket, backup.backup_id)
+            return self._previous[backup.backup_id]
+
+    def reused(self, previous, entries):
+        result = []
+        for entry in entries:
+            entry = dict(entry)
+            entry.setdefault("reused_from", previous.id)
+            result.append(entry)
+        return result
+
+    def backup_chunked(self, database, previous=None, old=None,
+                       fingerprints=None, server=None):
+        server = server or self.server
+        reuse = {}
+        if old is not None and fingerprints is not None:
+            for table in fingerprint.unchanged_tables(old, fingerprints):
+                entries = [e for e in previous.entries_for(database)
+                           if e.get("kind") == "chunk" and
+                           e.get("table") == table]
+                if entries:
+                    reuse[table] = self.reused(previous, entries)
+
+        def unchanged():
+            return fingerprint.unchanged_tables(
+                old, fingerprint.take(server, database))
+
+        job = chunked.ChunkedDump(self.server, database, self.bucket,
+                                  self.manifest.id,
+                                  workers=capped(
+                                      settings.BACKUP_CHUNK_WORKERS),
+                                  chunk_rows=settings.BACKUP_CHUNK_ROWS,
+                                  reuse=reuse, codec=self.codec,
+                                  throttle=self.throttle,
+                                  unchanged=unchanged)
+        entries = job.run()
+        self.record_snapshot(database, job.binlog)
+        return entries
+
+    def backup_database(self, database, server=None):
+        server = server or self.server
+        previous = fingerprints = old = None
+        if settings.BACKUP_FINGERPRINT != "none":
+            # taken before the dump, so a change racing with it shows in
+            # the next fingerprint. Status fingerprints can't tell changes
+            # in the second they are taken apart, see fingerprint.status.
+            fingerprints = fingerprint.take(server, database)
+            with self._lock:
+                self.manifest.metadata.setdefault(
+                    "fingerprints", {})[database] = fingerprints
+            previous = self.previous(database)
+            if previous is not None and database not in previous.errors:
+                old = previous.metadata.get("fingerprints", {}).get(database)
+            if fingerprint.unchanged(old, fingerprints):
+                snapshot = previous.metadata.get("snapshots", {}).get(
+                    database)
+                if snapshot:
+                    self.record_snapshot(database, snapshot)
+                return self.reused(previous, previous.entries_for(database))
+        if self.is_large(database, server):
+            return self.backup_chunked(database, previous, old, fingerprints,
+                                       server)
+        start = time.time()
+        chunks = dump.dump(self.server, database)
+        if self.throttle is not None:
+            chunks = self.throttle.wrap(chunks)
+        position = dump.BinlogPositionStream(chunks)
+        stream = dump.ChecksumStream(position)
+        key = self.object_key(database)
+        stored = dedup.store(self.bucket, key, stream, self.codec)
+        if position.binlog:
+            self.record_snapshot(database, position.binlog)
+        entry = {"database": database,
+                 "kind": "database",
+                 "key": key,
+                 "size": stream.size,
+                 "sha256": stream.checksum,
+                 "seconds": time.time() - start}
+        entry.update(stored)
+        return [entry]
+
+    def record_compression(self):
+        entries = [e for e in self.manifest.entries
+                   if "codec" in e and "reused_from" not in e]
+        size = sum(e["size"] for e in entries)
+        stored = sum(e["stored_size"] for e in entries)
+        seconds = sum(e["compress_seconds"] for e in entries)
+        self.manifest.metadata["compression"] = {
+            "codec": self.codec.name,
+            "level": self.codec.level,
+            "threads": self.codec.threads,
+            "size": size,
+            "stored_size": stored,
+            "ratio": float(size) / stored if stored else 0,
+            # bytes compressed per second of compression work, per thread.
+            "throughput": size / seconds if seconds else 0,
+        }
+
+    def _worker(self, queue):
+        server = self.connect()
+        while True:
+            try:
+                database = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                entries = self.backup_database(database, server)
+            except Exception as exc:
+                with self._lock:
+                    self.manifest.errors[database] = unicode(exc)
+                continue
+            with self._lock:
+                for entry in entries:
+                    self.manifest.add(**entry)
+
+    def run(self, databases=None):
+        if databases is None:
+            databases = dump.list_databases(self.server)
+        queue = Queue.Queue()
+        for database in databases:
+            queue.put(database)
+        threads = []
+        for i in xrange(min(self.workers, len(databases))):
+            t = threading.Thread(target=self._worker, args=(queue,))
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        self.manifest.entries.sort(key=lambda e: (e["database"], e["key"]))
+        if self.codec is not None:
+            self.record_compression()
+        if self.throttle is not None:
+            self.manifest.metadata["throttle"] = self.throttle.stats()
+        self.manifest.finish()
+        s3.store_manifest(self.bucket, self.manifest, last=self.last)
+        catalog.record(self.manifest)
+        return self.manifest
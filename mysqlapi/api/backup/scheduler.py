@@ -0,0 +1,192 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+import hashlib
+import random
+import sys
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from mysqlapi.api.backup import dump, throttle
+from mysqlapi.api.backup.runner import BackupRunner
+from mysqlapi.api.models import BackupSchedule, Instance
+
+DAY = datetime.timedelta(days=1)
+
+
+def window_start(day):
+    """
+    Returns the start of the backup window on the UTC day of `day`.
+    """
+    hours, minutes = [int(p) for p in settings.BACKUP_WINDOW_START.split(":")]
+    midnight = day.astimezone(timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    return midnight + datetime.timedelta(hours=hours, minutes=minutes)
+
+
+def offset(name, length):
+    """
+    Returns the fixed place of an instance in a window of `length`
+    seconds, so backups are spread over the window, and each instance is
+    backed up at about the same time every day.
+    """
+    return int(hashlib.md5(name).hexdigest()[:8], 16) % max(1, length)
+
+
+def next_run(name, after, rnd=random):
+    """
+    Returns the next time `name` should be backed up after `after`.
+    """
+    length = int(settings.BACKUP_WINDOW_HOURS * 60 * 60)
+    jitter = settings.BACKUP_JITTER
+    seconds = offset(name, length)
+    if jitter:
+        seconds += rnd.uniform(-jitter, jitter)
+        seconds = min(max(seconds, 0), length)
+    start = window_start(after) - DAY
+    while True:
+        at = start + datetime.timedelta(seconds=seconds)
+        if at > after:
+            return at
+        start += DAY
+
+
+def host_of(instance):
+    return dump.address(instance.db_manager().conn)
+
+
+class BackupScheduler(threading.Thread):
+    """
+    Backs up every running instance once a day, at a time of its own in
+    the backup window, running at most `concurrency` backups at once and
+    `per_host` on the same server. Schedules are kept in the database, so
+    a restart doesn't back everything up again.
+    """
+
+    def __init__(self, bucket, concurrency=None, per_host=None, tick=None,
+                 runner_options=None):
+        super(BackupScheduler, self).__init__()
+        self.bucket = bucket
+        self.concurrency = concurrency or settings.BACKUP_SCHEDULER_CONCURRENCY
+        self.per_host = per_host or settings.BACKUP_HOST_CONCURRENCY
+        self.tick_interval = tick or settings.BACKUP_SCHEDULER_TICK
+        self.runner_options = runner_options or {}
+        self.daemon = True
+        self.running = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def sync(self, now=None):
+        """
+        Schedules the instances that have no schedule yet.
+        """
+        now = now or timezone.now()
+        scheduled = set(BackupSchedule.objects.values_list("instance_id",
+                                                           flat=True))
+        created = []
+        for instance in Instance.objects.filter(state="running"):
+            if instance.pk not in scheduled:
+                created.append(BackupSchedule.objects.create(
+                    instance=instance,
+                    next_run_at=next_run(instance.name, now)))
+        return created
+
+    def due(self, now=None):
+        now = now or timezone.now()
+        return BackupSchedule.objects.filter(
+            next_run_at__lte=now, instance__state="running").select_related(
+            "instance").order_by("next_run_at")
+
+    def backup(self, schedule, host):
+        instance = schedule.instance
+        try:
+            server = instance.db_manager().conn
+            # backups of a single database must not become the latest
+            # backup of the backup server.
+            runner = BackupRunner(server, self.bucket, workers=1,
+                                  throttle=throttle.from_settings(server),
+                                  last=False, **self.runner_options)
+            manifest = runner.run([instance.database_name])
+            schedule.last_backup_id = manifest.id
+            if manifest.errors:
+                schedule.last_status = "failed"
+                schedule.last_error = manifest.errors.values()[0][:1000]
+            else:
+                schedule.last_status = "ok"
+                schedule.last_error = ""
+        except Exception as exc:
+            schedule.last_status = "failed"
+            schedule.last_error = unicode(exc)[:1000]
+        finally:
+            schedule.last_finished_at = timezone.now()
+            schedule.next_run_at = next_run(instance.name,
+                                            schedule.last_finished_at)
+            schedule.save()
+            with self._lock:
+                self.running[host] -= 1
+
+    def _backup_thread(self, schedule, host):
+        try:
+            self.backup(schedule, host)
+        finally:
+            # each thread has a database connection of its own.
+            connection.close()
+
+    def start_backup(self, schedule, host):
+        t = threading.Thread(target=self._backup_thread,
+                             args=(schedule, host))
+        t.daemon = True
+        t.start()
+        return t
+
+    def tick(self, now=None):
+        """
+        Starts the backups that are due, within the limits. Returns the
+        started schedules.
+        """
+        now = now or timezone.now()
+        self.sync(now)
+        started = []
+        for schedule in self.due(now):
+            host = host_of(schedule.instance)
+            with self._lock:
+                self._threads = [t for t in self._threads if t.is_alive()]
+                if len(self._threads) >= self.concurrency:
+                    break
+                if self.running.get(host, 0) >= self.per_host:
+                    continue
+                self.running[host] = self.running.get(host, 0) + 1
+                schedule.last_started_at = now
+                # keeps the next ticks from starting it again meanwhile.
+                schedule.next_run_at = next_run(schedule.instance.name, now)
+                schedule.save()
+                self._threads.append(self.start_backup(schedule, host))
+            started.append(schedule)
+        return started
+
+    def join_backups(self):
+        for t in list(self._threads):
+            t.join()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.tick()
+            except Exception:
+                sys.stderr.write("Failed to schedule backups\n")
+                traceback.print_exc(file=sys.stderr)
+            self._stopped.wait(self.tick_interval)
+
+    def close(self):
+        self._stopped.set()
+
+    def stop(self):
+        self.close()
+        self.join()
@@ -0,0 +1,142 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import threading
+import time
+
+from django.conf import settings
+
+from mysqlapi.api.database import Connection
+
+
+class TokenBucket(object):
+    """
+    Limits the rate of a resource shared by several threads to `rate`
+    units per second, allowing bursts of up to `burst` units.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = burst or rate
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.burst
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # the balance may go negative: callers then wait for their
+            # share in turn.
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            self.sleep(wait)
+        return wait
+
+
+class LoadMonitor(object):
+    """
+    Tells whether the server is too busy for a backup to go on, by its
+    number of running threads and, on replicas, its replication lag. The
+    server is checked at most once every `interval` seconds.
+    """
+
+    def __init__(self, server, max_threads_running=0, max_lag=0,
+                 interval=1, pause=5, clock=time.time, sleep=time.sleep):
+        # a connection of its own, as dump workers share theirs.
+        self.server = Connection(server.hostname, server.port,
+                                 server.username, server.password, "")
+        self.max_threads_running = max_threads_running
+        self.max_lag = max_lag
+        self.interval = interval
+        self.pause = pause
+        self.clock = clock
+        self.sleep = sleep
+        self.paused = 0
+        self._checked_at = None
+        self._reason = None
+        self._lock = threading.Lock()
+
+    def _check(self):
+        self.server.open()
+        try:
+            cursor = self.server.cursor()
+            if self.max_threads_running:
+                cursor.execute("SHOW GLOBAL STATUS LIKE 'Threads_running'")
+                running = int(cursor.fetchone()[1])
+                if running > self.max_threads_running:
+                    return "%d threads running" % running
+            if self.max_lag:
+                cursor.execute("SHOW SLAVE STATUS")
+                row = cursor.fetchone()
+                if row:
+                    names = [d[0] for d in cursor.description]
+                    lag = dict(zip(names, row)).get("Seconds_Behind_Master")
+                    if lag is not None and int(lag) > self.max_lag:
+                        return "replication %ss behind" % lag
+        finally:
+            self.server.close()
+        return None
+
+    def overloaded(self):
+        """
+        Returns why the server is overloaded, or None.
+        """
+        with self._lock:
+            now = self.clock()
+            if self._checked_at is None or \
+                    now - self._checked_at >= self.interval:
+                self._reason = self._check()
+                self._checked_at = now
+            return self._reason
+
+    def wait(self):
+        while self.overloaded():
+            with self._lock:
+                self.paused += self.pause
+            self.sleep(self.pause)
+
+
+class Throttle(object):
+    """
+    Slows the dump streams of a backup down to a shared bytes/sec cap,
+    and holds them while the server is overloaded.
+    """
+
+    def __init__(self, rate=0, monitor=None):
+        self.bucket = TokenBucket(rate) if rate else None
+        self.monitor = monitor
+
+    def wrap(self, chunks):
+        for chunk in chunks:
+            if self.monitor is not None:
+                self.monitor.wait()
+            if self.bucket is not None:
+                self.bucket.consume(len(chunk))
+            yield chunk
+
+    def stats(self):
+        return {"rate": self.bucket.rate if self.bucket else 0,
+                "paused": self.monitor.paused if self.monitor else 0}
+
+
+def from_settings(server, rate=None):
+    if rate is None:
+        rate = settings.BACKUP_RATE_LIMIT
+    monitor = None
+    if settings.BACKUP_MAX_THREADS_RUNNING or \
+            settings.BACKUP_MAX_REPLICATION_LAG:
+        monitor = LoadMonitor(
+            server,
+            max_threads_running=settings.BACKUP_MAX_THREADS_RUNNING,
+            max_lag=settings.BACKUP_MAX_REPLICATION_LAG,
+            pause=settings.BACKUP_THROTTLE_PAUSE)
+    if not rate and monitor is None:
+        return None
+    return Throttle(rate, monitor)
@@ -0,0 +1,350 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import collections
+import Queue
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# encodings HTTP clients understand, in order of preference.
+HTTP_ENCODINGS = ("zstd", "gzip")
+EXTENSIONS = {"gzip": "gz", "zstd": "zst", "lz4": "lz4"}
+
+# the codec, level and number of threads used to compress backups.
+CodecOptions = collections.namedtuple("CodecOptions",
+                                      ["name", "level", "threads"])
+
+
+class GzipCompressor(object):
+    name = "gzip"
+
+    def __init__(self, level=6):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+
+class ZstdCompressor(object):
+    name = "zstd"
+
+    def __init__(self, level=3):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+
+class Lz4Compressor(object):
+    name = "lz4"
+
+    def __init__(self, level=0):
+        self._obj = lz4_frame.LZ4FrameCompressor(compression_level=level)
+        self._started = False
+
+    def _begin(self):
+        if self._started:
+            return ""
+        self._started = True
+        return self._obj.begin()
+
+    def compress(self, data):
+        header = self._begin()
+        return header + self._obj.compress(data)
+
+    def flush(self):
+        header = self._begin()
+        return header + self._obj.flush()
+
+
+class GzipDecompressor(object):
+    """
+    Decompresses a stream of concatenated gzip members.
+    """
+
+    def __init__(self):
+        self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        out = []
+        while data:
+            out.append(self._obj.decompress(data))
+            data = self._obj.unused_data
+            if data:
+                self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return "".join(out)
+
+    def flush(self):
+        return self._obj.flush()
+
+
+class ZstdDecompressor(object):
+
+    def __init__(self):
+        self._dctx = zstandard.ZstdDecompressor()
+        self._obj = self._dctx.decompressobj()
+
+    def decompress(self, data):
+        out = []
+        while data:
+            out.append(self._obj.decompress(data))
+            data = getattr(self._obj, "unused_data", "")
+            if data:
+                self._obj = self._dctx.decompressobj()
+        return "".join(out)
+
+    def flush(self):
+        return ""
+
+
+class Lz4Decompressor(object):
+
+    def __init__(self):
+        self._obj = lz4_frame.LZ4FrameDecompressor()
+
+    def decompress(self, data):
+        out = []
+        while data:
+            out.append(self._obj.decompress(data))
+            data = self._obj.unused_data if self._obj.eof else ""
+            if self._obj.eof:
+                self._obj = lz4_frame.LZ4FrameDecompressor()
+        return "".join(out)
+
+    def flush(self):
+        return ""
+
+
+class IdentityDecompressor(object):
+
+    def decompress(self, data):
+        return data
+
+    def flush(self):
+        return ""
+
+
+CODECS = {
+    "gzip": GzipCompressor,
+    "zstd": ZstdCompressor,
+    "lz4": Lz4Compressor,
+}
+
+
+def available():
+    # preferred order when the client accepts several encodings equally.
+    names = ["gzip"]
+    if lz4_frame is not None:
+        names.insert(0, "lz4")
+    if zstandard is not None:
+        names.insert(0, "zstd")
+    return names
+
+
+def compressor(name, level=None):
+    if name not in available():
+        raise ValueError("Unsupported encoding: %s" % name)
+    if level is None:
+        return CODECS[name]()
+    return CODECS[name](level)
+
+
+DECOMPRESSORS = {
+    "gzip": GzipDecompressor,
+    "zstd": ZstdDecompressor,
+    "lz4": Lz4Decompressor,
+    "identity": IdentityDecompressor,
+}
+
+
+def decompressor(name):
+    if name != "identity" and name not in available():
+        raise ValueError("Unsupported encoding: %s" % name)
+    return DECOMPRESSORS[name]()
+
+
+def negotiate(accept_encoding):
+    accepted = {}
+    for item in accept_encoding.split(","):
+        parts = item.strip().split(";")
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    best, best_q = None, 0.0
+    for name in available():
+        if name not in HTTP_ENCODINGS:
+            continue
+        q = accepted.get(name, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class CompressedStream(object):
+
+    def __init__(self, chunks, codec):
+        self.chunks = chunks
+        self.codec = codec
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            data = self.codec.compress(chunk)
+            if data:
+                yield data
+        data = self.codec.flush()
+        if data:
+            yield data
+
+    def close(self):
+        if hasattr(self.chunks, "close"):
+            self.chunks.close()
+
+
+class DecompressedStream(object):
+
+    def __init__(self, chunks, codec):
+        self.chunks = chunks
+        self.codec = codec
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            data = self.codec.decompress(chunk)
+            if data:
+                yield data
+        data = self.codec.flush()
+        if data:
+            yield data
+
+
+def blocks(chunks, size):
+    buf, buffered = [], 0
+    for chunk in chunks:
+        buf.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            data = "".join(buf)
+            for i in xrange(0, len(data) - size + 1, size):
+                yield data[i:i + size]
+            rest = data[len(data) - len(data) % size:]
+            buf, buffered = [rest] if rest else [], len(rest)
+    if buf:
+        yield "".join(buf)
+
+
+class _Block(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ParallelCompressor(object):
+    """
+    Compresses a stream in independent blocks of `block_size` bytes on
+    `threads` threads, yielding the compressed blocks in order. Each block
+    is a complete gzip member, zstd frame or lz4 frame, and their
+    concatenation decompresses to the original stream. At most twice as
+    many blocks as threads are in memory at once.
+
+    Records the input and output sizes and the time spent compressing.
+    """
+
+    def __init__(self, name, level=None, threads=1, block_size=1024 * 1024):
+        compressor(name, level)
+        self.name = name
+        self.level = level
+        self.threads = max(1, threads)
+        self.block_size = block_size
+        self.size = 0
+        self.stored_size = 0
+        self.seconds = 0
+        self._lock = threading.Lock()
+
+    def ratio(self):
+        if not self.stored_size:
+            return 0
+        return float(self.size) / self.stored_size
+
+    def _compress(self, block):
+        start = time.time()
+        try:
+            codec = compressor(self.name, self.level)
+            block.result = codec.compress(block.data) + codec.flush()
+        except Exception as exc:
+            block.error = exc
+        with self._lock:
+            self.seconds += time.time() - start
+        block.done.set()
+
+    def _worker(self, queue):
+        while True:
+            block = queue.get()
+            if block is None:
+                return
+            self._compress(block)
+
+    def _collect(self, block):
+        block.done.wait()
+        if block.error is not None:
+            raise block.error
+        self.size += len(block.data)
+        self.stored_size += len(block.result)
+        return block.result
+
+    def compress(self, chunks):
+        if self.threads == 1:
+            for data in blocks(chunks, self.block_size):
+                block = _Block(data)
+                self._compress(block)
+                yield self._collect(block)
+            return
+        queue = Queue.Queue()
+        workers = []
+        for i in xrange(self.threads):
+            t = threading.Thread(target=self._worker, args=(queue,))
+            t.daemon = True
+            t.start()
+            workers.append(t)
+        pending = collections.deque()
+        try:
+            for data in blocks(chunks, self.block_size):
+                block = _Block(data)
+                pending.append(block)
+                queue.put(block)
+                while pending and (len(pending) >= 2 * self.threads or
+                                   pending[0].done.is_set()):
+                    yield self._collect(pending.popleft())
+            while pending:
+                yield self._collect(pending.popleft())
+        finally:
+            for t in workers:
+                queue.put(None)
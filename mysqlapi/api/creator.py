@@ -2,87 +2,394 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import collections
+import datetime
 import Queue
+import sys
 import threading
+import time
+import traceback
+import uuid
+
+from django.conf import settings
+from django.db import connection, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
 
 model_class = None
+job_class = None
+_pool = None
+
+
+def backoff(attempt):
+    """
+    Returns how long to wait before polling an instance for the
+    `attempt`th time: EC2_POLL_INTERVAL, doubling on each attempt up to
+    CREATOR_MAX_BACKOFF.
+    """
+    delay = settings.EC2_POLL_INTERVAL * 2 ** max(0, attempt - 1)
+    return min(delay, settings.CREATOR_MAX_BACKOFF)
+
+
+def get_many(ec2_client, instances):
+    """
+    Returns the instances that are running, updating their host and
+    state, with a single call when the client can describe many instances
+    at once.
+    """
+    if hasattr(ec2_client, "get_many"):
+        return ec2_client.get_many(instances)
+    return [instance for instance in instances if ec2_client.get(instance)]
+
+
+def fail(ec2_client, instance, reason):
+    ec2_client.unauthorize(instance)
+    ec2_client.terminate(instance)
+    instance.state = "error"
+    instance.reason = unicode(reason)
+    instance.save()
 
 
 class InstanceQueue(object):
+    """
+    Wakes up the poller when jobs are enqueued, and holds the jobs whose
+    instances are running until a creator takes them. Closing it stops
+    the polling, and finishing it, once nothing else will be made ready,
+    stops the creators.
+    """
 
     def __init__(self):
-        self._queue = Queue.Queue()
+        self._ready = collections.deque()
         self._closed = False
-        self._sem = threading.Semaphore()
+        self._finished = False
+        self._woken = False
+        self._cond = threading.Condition()
 
     @property
     def closed(self):
-        self._sem.acquire()
-        closed = self._closed
-        self._sem.release()
-        return closed
+        with self._cond:
+            return self._closed
 
     def close(self):
-        self._sem.acquire()
-        self._closed = True
-        self._sem.release()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def finished(self):
+        with self._cond:
+            return self._finished
+
+    def finish(self):
+        with self._cond:
+            self._closed = self._finished = True
+            self._cond.notify_all()
+
+    def wake(self):
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+    def wait(self, timeout):
+        """
+        Waits at most `timeout` seconds for new jobs.
+        """
+        with self._cond:
+            if not self._woken and not self._closed:
+                self._cond.wait(timeout)
+            self._woken = False
+
+    def put_ready(self, job):
+        with self._cond:
+            self._ready.append(job)
+            self._cond.notify_all()
+
+    def get_ready(self, timeout=None):
+        """
+        Returns the next job whose instance is running, or raises
+        Queue.Empty when none comes in time or the queue is finished.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                if self._ready:
+                    return self._ready.popleft()
+                if self._finished:
+                    raise Queue.Empty()
+                wait = None
+                if deadline is not None:
+                    wait = deadline - time.time()
+                    if wait <= 0:
+                        raise Queue.Empty()
+                self._cond.wait(wait)
+
+    def qsize(self):
+        with self._cond:
+            return len(self._ready)
+
+
+def claim(limit, lease, now=None):
+    """
+    Leases at most `limit` due jobs for `lease` seconds and returns them.
+    The lease is taken with a conditional UPDATE, so each job is claimed
+    by a single process however many poll at once, and a job whose
+    process died is claimed again once its lease expires.
+    """
+    now = now or timezone.now()
+    free = Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now)
+    due = job_class.objects.filter(free, state="pending",
+                                   run_after__lte=now)
+    ids = list(due.order_by("run_after").values_list("pk", flat=True)[:limit])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    expires_at = now + datetime.timedelta(seconds=lease)
+    job_class.objects.filter(free, pk__in=ids, state="pending").update(
+        lease_token=token, lease_expires_at=expires_at)
+    return list(job_class.objects.filter(lease_token=token).select_related(
+        "instance").order_by("run_after"))
+
+
+class InstancePoller(threading.Thread):
+    """
+    Claims the jobs due to be polled and resolves the state of their
+    instances with a single describe call, handing the running ones to
+    the creators and putting the others back with a backoff.
+    """
+
+    def __init__(self, ec2_client, batch_size=None, lease=None, interval=2):
+        super(InstancePoller, self).__init__(name="creator-poller")
+        self.ec2_client = ec2_client
+        self.batch_size = batch_size or settings.CREATOR_POLL_BATCH
+        self.lease = lease or settings.CREATOR_LEASE
+        self.interval = interval
+        self.daemon = True
+        self._stats_lock = threading.Lock()
+        self._stats = {"polls": 0, "requeued": 0, "expired": 0, "lost": 0}
+
+    @property
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self._stats[key] += n
 
-    def get(self, *args, **kwargs):
-        return self._queue.get(*args, **kwargs)
+    def retry(self, job):
+        """
+        Puts a job whose instance isn't ready back in the queue, after a
+        backoff, or gives up on it once it ran out of attempts or time.
+        Jobs whose lease expired meanwhile are left to the process that
+        claimed them again.
+        """
+        attempt = job.attempts + 1
+        elapsed = (timezone.now() - job.created_at).total_seconds()
+        reason = None
+        if attempt >= settings.CREATOR_MAX_ATTEMPTS:
+            reason = "The instance did not start after %d attempts." % attempt
+        elif elapsed >= settings.CREATOR_DEADLINE:
+            reason = "The instance did not start in %d seconds." % \
+                settings.CREATOR_DEADLINE
+        if reason:
+            if not job.extend(self.lease):
+                return "lost"
+            fail(self.ec2_client, job.instance, reason)
+            job.finish("failed", reason)
+            return "expired"
+        if not job.retry(backoff(attempt)):
+            return "lost"
+        return "requeued"
 
-    def put(self, *args, **kwargs):
-        self._queue.put(*args, **kwargs)
+    def poll(self, jobs):
+        self._count("polls")
+        try:
+            ready = get_many(self.ec2_client, [j.instance for j in jobs])
+        except Exception:
+            sys.stderr.write("Failed to get the state of %d instances\n" %
+                             len(jobs))
+            traceback.print_exc(file=sys.stderr)
+            ready = []
+        ready = set(id(instance) for instance in ready)
+        for job in jobs:
+            if id(job.instance) in ready:
+                if job.extend(self.lease):
+                    _instance_queue.put_ready(job)
+                else:
+                    self._count("lost")
+            else:
+                self._count(self.retry(job))
+
+    def poll_once(self):
+        try:
+            jobs = claim(self.batch_size, self.lease)
+        except Exception:
+            sys.stderr.write("Failed to claim provisioning jobs\n")
+            traceback.print_exc(file=sys.stderr)
+            return []
+        if jobs:
+            self.poll(jobs)
+        return jobs
+
+    def run(self):
+        try:
+            while True:
+                # polls once more after the queue is closed, so the jobs
+                # enqueued right before are handled.
+                closed = _instance_queue.closed
+                jobs = self.poll_once()
+                if closed:
+                    return
+                if not jobs:
+                    _instance_queue.wait(self.interval)
+        finally:
+            connection.close()
+            _instance_queue.finish()
 
 
 class DatabaseCreator(threading.Thread):
 
-    def __init__(self, manager_cls, ec2_client, user="root", password=""):
-        super(DatabaseCreator, self).__init__()
+    def __init__(self, manager_cls, ec2_client, user="root", password="",
+                 name=None):
+        super(DatabaseCreator, self).__init__(name=name)
         self.DatabaseManager = manager_cls
         self.ec2_client = ec2_client
         self.user = user
         self.password = password
         self.daemon = True
+        self._stats_lock = threading.Lock()
+        self._stats = {"created": 0, "failed": 0, "lost": 0,
+                       "busy_seconds": 0.0, "current": None}
+
+    @property
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["name"] = self.name
+        return stats
 
     def _error(self, exc, instance):
-        self.ec2_client.unauthorize(instance)
-        self.ec2_client.terminate(instance)
-        instance.state = "error"
-        instance.reason = unicode(exc)
-        instance.save()
+        fail(self.ec2_client, instance, exc)
+
+    def _fail(self, job, reason):
+        # the instance is only terminated while this worker still holds
+        # the job, as another one may have created its database since.
+        if not job.extend(settings.CREATOR_LEASE):
+            return "lost"
+        self._error(reason, job.instance)
+        job.finish("failed", reason)
+        return "failed"
+
+    def create(self, job):
+        """
+        Creates the database of a running instance and finishes its job,
+        returning "created" or "failed", or "lost" when the job's lease
+        expired while it waited, and another process may have claimed it.
+        """
+        # the lease may have expired while the job waited for a worker.
+        if not job.extend(settings.CREATOR_LEASE):
+            return "lost"
+        instance = job.instance
+        if not self.ec2_client.authorize(instance):
+            return self._fail(job,
+                              "Failed to authorize access to the instance.")
+        try:
+            db = self.DatabaseManager(instance.name,
+                                      host=instance.host,
+                                      user=self.user,
+                                      password=self.password)
+            db.create_database()
+            instance.save()
+        except Exception as exc:
+            return self._fail(job, exc)
+        if not job.finish():
+            return "lost"
+        return "created"
 
     def run(self):
-        while not _instance_queue.closed:
+        try:
+            self._run()
+        finally:
+            connection.close()
+
+    def _run(self):
+        while True:
             try:
-                instance = _instance_queue.get(timeout=2)
+                job = _instance_queue.get_ready(timeout=2)
             except Queue.Empty:
+                if _instance_queue.finished:
+                    return
                 continue
-            if not self.ec2_client.get(instance):
-                _instance_queue.put(instance)
-                continue
-            if not self.ec2_client.authorize(instance):
-                self._error("Failed to authorize access to the instance.",
-                            instance)
-                continue
-            try:
-                db = self.DatabaseManager(instance.name,
-                                          host=instance.host,
-                                          user=self.user,
-                                          password=self.password)
-                db.create_database()
-                instance.save()
-            except Exception as exc:
-                self._error(exc, instance)
+            with self._stats_lock:
+                self._stats["current"] = job.instance.name
+            start = time.time()
+            outcome = self.create(job)
+            with self._stats_lock:
+                self._stats[outcome] += 1
+                self._stats["busy_seconds"] += time.time() - start
+                self._stats["current"] = None
 
     def stop(self):
-        _instance_queue.close()
+        _instance_queue.finish()
         self.join()
 
+
+class CreatorPool(object):
+    """
+    Polls pending instances with an InstancePoller and creates their
+    databases with `size` DatabaseCreator workers, so a slow instance
+    doesn't hold back the ones queued after it.
+    """
+
+    def __init__(self, manager_cls, ec2_client, size, user="root",
+                 password=""):
+        self.poller = InstancePoller(ec2_client)
+        self.workers = [DatabaseCreator(manager_cls, ec2_client, user,
+                                        password, name="creator-%d" % i)
+                        for i in xrange(max(1, size))]
+
+    def start(self):
+        self.poller.start()
+        for worker in self.workers:
+            worker.start()
+
+    def close(self):
+        _instance_queue.close()
+
+    def stop(self):
+        self.close()
+        self.poller.join()
+        for worker in self.workers:
+            worker.join()
+
+    def stats(self):
+        workers = [w.stats for w in self.workers]
+        pending = job_class.objects.filter(state="pending")
+        totals = {"workers": workers, "ready": _instance_queue.qsize(),
+                  "queued": pending.count(),
+                  "delayed": pending.filter(
+                      run_after__gt=timezone.now()).count(),
+                  "busy": len([w for w in workers if w["current"]])}
+        for key in ("created", "failed", "lost"):
+            totals[key] = sum(w[key] for w in workers)
+        totals.update(self.poller.stats)
+        return totals
+
+
 _instance_queue = InstanceQueue()
 
 
 def build_queue():
-    for instance in model_class.objects.filter(state="pending", shared=False):
+    """
+    Adds a job for the pending EC2 instances that have none, e.g. the ones
+    created before jobs existed. Jobs themselves are kept in the
+    database, so they survive restarts.
+    """
+    jobs = job_class.objects.values_list("instance_id", flat=True)
+    # pool instances, which have no EC2 id, are pending while allocated.
+    instances = model_class.objects.filter(state="pending", shared=False,
+                                           ec2_id__isnull=False)
+    for instance in instances.exclude(pk__in=list(jobs)):
         enqueue(instance)
 
 
@@ -93,19 +400,34 @@ def reset_queue():
 
 
 def enqueue(instance):
-    _instance_queue.put(instance)
+    try:
+        job_class.objects.get_or_create(
+            instance=instance, defaults={"run_after": timezone.now()})
+    except IntegrityError:
+        # another process enqueued it first.
+        pass
+    _instance_queue.wake()
 
 
 def close_queue():
     _instance_queue.close()
 
 
-def set_model(cls):
-    global model_class
+def set_model(cls, job_cls):
+    global model_class, job_class
     model_class = cls
+    job_class = job_cls
+
+
+def start_creator(manager_class, ec2_client, workers=None):
+    global _pool
+    if workers is None:
+        workers = settings.CREATOR_WORKERS
+    _pool = CreatorPool(manager_class, ec2_client, workers)
+    _pool.start()
+    return _pool
 
 
-def start_creator(manager_class, ec2_client):
-    t = DatabaseCreator(manager_class, ec2_client)
-    t.start()
-    return t
+def creator_stats():
+    if _pool:
+        return _pool.stats()
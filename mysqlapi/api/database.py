@@ -4,9 +4,229 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import os
+import tempfile
+import threading
+import time
+
 import MySQLdb
 import subprocess
 
+from django.conf import settings
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def connect(hostname, port, username, password, database):
+    return MySQLdb.connect(host=hostname,
+                           port=int(port),
+                           user=username,
+                           passwd=password,
+                           db=database,
+                           connect_timeout=settings.DB_CONNECT_TIMEOUT)
+
+
+class ConnectionPool(object):
+    """
+    Keeps authenticated MySQL connections for one (host, port, user) so
+    short admin operations don't pay a TCP and auth handshake each time.
+    """
+
+    def __init__(self, hostname, port, username, password, database,
+                 max_size=10, idle_timeout=300, wait_timeout=10):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.database = database
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self._idle = []
+        self._size = 0
+        # retired pools are no longer handed out by get_pool, connections
+        # released to them are closed.
+        self.retired = False
+        self._cond = threading.Condition()
+        self._stats = {"created": 0, "reused": 0, "evicted": 0,
+                       "broken": 0, "waits": 0, "timeouts": 0}
+
+    def _connect(self):
+        return connect(self.hostname, self.port, self.username,
+                       self.password, self.database)
+
+    def _evict(self):
+        now = time.time()
+        alive = []
+        for conn, released_at in self._idle:
+            if now - released_at > self.idle_timeout:
+                self._close(conn)
+                self._size -= 1
+                self._stats["evicted"] += 1
+            else:
+                alive.append((conn, released_at))
+        self._idle = alive
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except MySQLdb.Error:
+            pass
+
+    def acquire(self):
+        deadline = time.time() + self.wait_timeout
+        while True:
+            with self._cond:
+                self._evict()
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout("Timed out waiting for a connection "
+                                          "to %s:%s" % (self.hostname,
+                                                        self.port))
+                    self._stats["waits"] += 1
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, _ = self._idle.pop()
+                else:
+                    conn = None
+                    self._size += 1
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._discarded()
+                    raise
+                with self._cond:
+                    self._stats["created"] += 1
+                return conn
+            try:
+                conn.ping()
+            except MySQLdb.Error:
+                self._close(conn)
+                with self._cond:
+                    self._stats["broken"] += 1
+                self._discarded()
+                continue
+            with self._cond:
+                self._stats["reused"] += 1
+            return conn
+
+    def release(self, conn):
+        if self.retired:
+            self.discard(conn)
+            return
+        # MySQLdb runs with autocommit off, so end the transaction left
+        # open, or the next user would see its snapshot.
+        try:
+            conn.rollback()
+        except MySQLdb.Error:
+            with self._cond:
+                self._stats["broken"] += 1
+            self.discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    def discard(self, conn):
+        self._close(conn)
+        self._discarded()
+
+    def _discarded(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def clear(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._close(conn)
+                self._size -= 1
+            self._idle = []
+            self._cond.notify_all()
+
+    def retire(self):
+        self.retired = True
+        self.clear()
+
+    def sweep(self):
+        """
+        Closes the connections idle for too long, and retires the pool
+        when it is left without connections. Returns whether it was.
+        """
+        with self._cond:
+            self._evict()
+            if self._size == 0:
+                self.retired = True
+            return self.retired
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+            stats["max_size"] = self.max_size
+        return stats
+
+
+# seconds between two sweeps of the pools, see get_pool.
+SWEEP_INTERVAL = 30
+_pools = {}
+_pools_lock = threading.Lock()
+_last_sweep = time.time()
+
+
+def _sweep_pools():
+    # pools are only used by get_pool, so idle connections of servers no
+    # longer used (terminated instances, dropped tenants) are closed here.
+    for key, pool in _pools.items():
+        if pool.sweep():
+            del _pools[key]
+
+
+def get_pool(hostname, port, username, password, database=""):
+    global _last_sweep
+    key = (hostname, str(port), username, database)
+    with _pools_lock:
+        now = time.time()
+        if now - _last_sweep >= SWEEP_INTERVAL:
+            _last_sweep = now
+            _sweep_pools()
+        pool = _pools.get(key)
+        if pool is None or pool.password != password:
+            if pool is not None:
+                pool.retire()
+            pool = ConnectionPool(hostname, port, username, password,
+                                  database,
+                                  max_size=settings.DB_POOL_MAX_SIZE,
+                                  idle_timeout=settings.DB_POOL_IDLE_TIMEOUT,
+                                  wait_timeout=settings.DB_POOL_WAIT_TIMEOUT)
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = _pools.items()
+    stats = {}
+    for (hostname, port, username, database), pool in pools:
+        name = "%s@%s:%s/%s" % (username, hostname, port, database)
+        stats[name] = pool.stats()
+    return stats
+
+
+def reset_pools():
+    with _pools_lock:
+        pools = _pools.values()
+        _pools.clear()
+    for pool in pools:
+        pool.retire()
+
 
 class Connection(object):
 
@@ -22,28 +242,122 @@ class Connection(object):
         self.database = database
         self.port = port
         self._connection = None
+        self._pool = None
 
     def open(self):
         if not self._connection:
-            self._connection = MySQLdb.connect(self.hostname,
-                                               self.username,
-                                               self.password,
-                                               self.database)
+            self._pool = get_pool(self.hostname,
+                                  self.port,
+                                  self.username,
+                                  self.password,
+                                  self.database)
+            self._connection = self._pool.acquire()
 
     def close(self):
         if self._connection:
-            self._connection.close()
+            self._pool.release(self._connection)
+            self._connection = None
+
+    def discard(self):
+        if self._connection:
+            self._pool.discard(self._connection)
             self._connection = None
 
     def cursor(self):
         return self._connection.cursor()
 
 
-def export():
-    dump_cmd = ["mysqldump",
-                "-u",
-                "root",
-                "--quick",
-                "--all-databases",
-                "--compact"]
-    return subprocess.check_output(dump_cmd, stderr=subprocess.STDOUT)
+class CommandStream(object):
+    """
+    Iterates over the stdout of a command as it is produced. Failures
+    before the first byte raise CalledProcessError from the constructor,
+    so callers can still report them before starting a response.
+    """
+
+    def __init__(self, cmd, chunk_size=64 * 1024, env=None):
+        self.cmd = cmd
+        self.chunk_size = chunk_size
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(cmd,
+                                         stdout=subprocess.PIPE,
+                                         stderr=self._stderr,
+                                         env=env)
+        self._first = self._read()
+        if not self._first:
+            self._finish()
+
+    def _read(self):
+        return os.read(self._process.stdout.fileno(), self.chunk_size)
+
+    def _finish(self):
+        self._process.stdout.close()
+        returncode = self._process.wait()
+        self._stderr.seek(0)
+        output = self._stderr.read()
+        self._stderr.close()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.cmd,
+                                                output=output)
+
+    def __iter__(self):
+        chunk, self._first = self._first, None
+        while chunk:
+            yield chunk
+            chunk = self._read()
+        if not self._process.stdout.closed:
+            self._finish()
+
+    def read(self):
+        return "".join(self)
+
+    def close(self):
+        if self._process.returncode is None:
+            try:
+                self._process.kill()
+            except OSError:
+                pass
+            self._process.wait()
+        if not self._process.stdout.closed:
+            self._process.stdout.close()
+        if not self._stderr.closed:
+            self._stderr.close()
+
+
+class CommandSink(object):
+    """
+    Feeds chunks to the stdin of a command, raising CalledProcessError
+    with the command's stderr when it fails.
+    """
+
+    def __init__(self, cmd, env=None):
+        self.cmd = cmd
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(cmd,
+                                         stdin=subprocess.PIPE,
+                                         stdout=self._stderr,
+                                         stderr=self._stderr,
+                                         env=env)
+
+    def write(self, chunk):
+        try:
+            self._process.stdin.write(chunk)
+        except IOError:
+            # the command died, close() raises with its stderr.
+            self.close()
+            raise
+
+    def close(self):
+        if not self._process.stdin.closed:
+            try:
+                self._process.stdin.close()
+            except IOError:
+                pass
+        returncode = self._process.wait()
+        if self._stderr.closed:
+            return
+        self._stderr.seek(0)
+        output = self._stderr.read()
+        self._stderr.close()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.cmd,
+                                                output=output)
@@ -0,0 +1,57 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+
+class Client(object):
+    """
+    Wraps a crane_ec2.Client, adding get_many, which describes many
+    instances with a single call.
+    """
+
+    def __init__(self, client, connection=None):
+        self._client = client
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    @property
+    def connection(self):
+        # the wrapped client's connection, so both talk to the same API.
+        if self._connection is None:
+            self._connection = self._client.ec2_conn
+        return self._connection
+
+    def get_many(self, instances):
+        """
+        Returns the instances that are ready, setting their host and state
+        like get does.
+        """
+        from boto.exception import EC2ResponseError
+
+        by_id = dict((i.ec2_id, i) for i in instances if i.ec2_id)
+        if not by_id:
+            return []
+        try:
+            reservations = self.connection.get_all_instances(
+                instance_ids=by_id.keys())
+        except EC2ResponseError as exc:
+            if exc.error_code != "InvalidInstanceID.NotFound":
+                raise
+            # an instance that was just launched may not be known yet, and
+            # fails the whole call.
+            return [i for i in by_id.values() if self._client.get(i)]
+        ready = []
+        for reservation in reservations:
+            for ec2_instance in reservation.instances:
+                instance = by_id.get(ec2_instance.id)
+                # same rules as get: the public address is assigned last.
+                if instance is None or \
+                        ec2_instance.ip_address == \
+                        ec2_instance.private_ip_address:
+                    continue
+                instance.state = ec2_instance.state
+                instance.host = ec2_instance.ip_address
+                ready.append(instance)
+        return ready
@@ -0,0 +1,156 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import calendar
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from mysqlapi.api.models import HealthStatus
+
+
+class Result(collections.namedtuple("Result",
+                                    "up checked_at latency")):
+
+    def age(self):
+        return max(0, time.time() - self.checked_at)
+
+
+class Inflight(object):
+    """
+    A check in progress, which hands its result to the callers waiting
+    for it.
+    """
+
+    def __init__(self):
+        self.result = None
+        self.waiters = 0
+        self._done = threading.Event()
+
+    def wait(self):
+        self._done.wait()
+        return self.result
+
+    def finish(self, result):
+        self.result = result
+        self._done.set()
+
+
+class HealthCache(object):
+
+    def __init__(self, ttl=None):
+        self._ttl = ttl
+        self._results = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        if self._ttl is None:
+            return settings.HEALTHCHECK_CACHE_TTL
+        return self._ttl
+
+    def get(self, key, check, max_age=None):
+        if max_age is None:
+            max_age = self.ttl
+        with self._lock:
+            result = self._results.get(key)
+            if result and result.age() < max_age:
+                return result
+            inflight = self._inflight.get(key)
+            owner = inflight is None
+            if owner:
+                inflight = self._inflight[key] = Inflight()
+            else:
+                inflight.waiters += 1
+        if not owner:
+            # the result may be expired or cleared from the cache by the
+            # time a waiter runs again, so it is handed over directly.
+            return inflight.wait()
+        result = None
+        try:
+            start = time.time()
+            try:
+                up = bool(check())
+            except Exception:
+                up = False
+            result = self.set(key, up, time.time() - start)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            inflight.finish(result)
+        return result
+
+    def set(self, key, up, latency=None):
+        result = Result(up, time.time(), latency)
+        with self._lock:
+            self._results[key] = result
+        return result
+
+    def peek(self, key):
+        with self._lock:
+            return self._results.get(key)
+
+    def prune(self, keys):
+        keys = set(keys)
+        with self._lock:
+            for key in self._results.keys():
+                if key not in keys:
+                    del self._results[key]
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+def timestamp(dt):
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1e6
+
+
+class SharedResults(object):
+    """
+    Keeps health results in the database, so the results of the single
+    probe_health process are served by every API process.
+    """
+
+    def set(self, key, up, latency=None):
+        fields = {"up": up, "checked_at": timezone.now(),
+                  "latency": latency}
+        if not HealthStatus.objects.filter(key=key).update(**fields):
+            HealthStatus.objects.create(key=key, **fields)
+        return Result(up, timestamp(fields["checked_at"]), latency)
+
+    def peek(self, key):
+        try:
+            status = HealthStatus.objects.get(key=key)
+        except HealthStatus.DoesNotExist:
+            return None
+        return Result(status.up, timestamp(status.checked_at),
+                      status.latency)
+
+    def prune(self, keys):
+        HealthStatus.objects.exclude(key__in=list(keys)).delete()
+
+
+_cache = HealthCache()
+shared = SharedResults()
+
+
+def check(instance):
+    if settings.HEALTH_PROBER:
+        # results are refreshed by the probe_health process, only fall
+        # back to a live check when it has fallen behind.
+        max_age = max(settings.HEALTHCHECK_CACHE_TTL,
+                      3 * settings.HEALTH_PROBE_INTERVAL)
+        result = shared.peek(instance.name)
+        if result is not None and result.age() < max_age:
+            return result
+    return _cache.get(instance.name, instance.is_up)
+
+
+def reset():
+    _cache.clear()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from mysqlapi.api.backup import dedup
+from mysqlapi.api.management.commands import s3
+
+
+class Command(NoArgsCommand):
+
+    can_import_settings = True
+    option_list = NoArgsCommand.option_list + (
+        make_option("--grace", type="int", dest="grace",
+                    help="Keep unreferenced chunks newer than this many "
+                         "seconds."),
+        make_option("--dry-run", action="store_true", dest="dry_run",
+                    default=False,
+                    help="Only report the chunks that would be deleted."),
+    )
+
+    def handle_noargs(self, **options):
+        garbage = dedup.collect(s3.bucket(), grace=options.get("grace"),
+                                dry_run=options.get("dry_run"))
+        if options.get("dry_run"):
+            return u"%d unreferenced chunks." % len(garbage)
+        return u"Deleted %d unreferenced chunks." % len(garbage)
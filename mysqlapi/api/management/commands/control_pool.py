@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from mysqlapi.api import pool
+
+
+class Command(NoArgsCommand):
+
+    can_import_settings = True
+    option_list = NoArgsCommand.option_list + (
+        make_option("--once", action="store_true", dest="once",
+                    default=False,
+                    help="Replenish the pool once and exit."),
+    )
+
+    def handle_noargs(self, **options):
+        provisioner = pool.get_provisioner()
+        if provisioner is None:
+            raise CommandError(u"MYSQLAPI_POOL_PROVISIONER is not set.")
+        controller = pool.PoolController(provisioner)
+        if options.get("once"):
+            forecast, added = controller.tick()
+            controller.prune()
+            return (u"%d free instances, %.1f allocations/hour, "
+                    u"added %d.\n" % (forecast.free, forecast.rate,
+                                      len(added)))
+        controller.run()
+        return u""
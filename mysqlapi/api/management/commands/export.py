@@ -4,20 +4,49 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
-from django.core.management.base import NoArgsCommand
+from optparse import make_option
 
-from mysqlapi.api.database import export
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+
+from mysqlapi.api.backup import dump, throttle
+from mysqlapi.api.backup.runner import BackupRunner, codec_options
 from mysqlapi.api.management.commands import s3
 
 
 class Command(NoArgsCommand):
 
     can_import_settings = True
+    option_list = NoArgsCommand.option_list + (
+        make_option("--workers", type="int", dest="workers",
+                    help="Number of databases dumped at the same time."),
+        make_option("--codec", dest="codec",
+                    help="Compression codec: gzip, zstd, lz4 or none."),
+        make_option("--level", type="int", dest="level",
+                    help="Compression level."),
+        make_option("--codec-threads", type="int", dest="codec_threads",
+                    help="Threads compressing each dump."),
+        make_option("--rate-limit", type="int", dest="rate_limit",
+                    help="Bytes per second read from the server by all "
+                         "dumps together."),
+    )
+
+    def codec(self, options):
+        try:
+            return codec_options(options.get("codec"), options.get("level"),
+                                 options.get("codec_threads"))
+        except ValueError as exc:
+            raise CommandError(unicode(exc))
 
     def handle_noargs(self, **options):
-        data = export()
-        self.send_data(data)
+        workers = options.get("workers") or settings.BACKUP_WORKERS
+        server = dump.default_server()
+        runner = BackupRunner(server, s3.bucket(), workers,
+                              codec=self.codec(options),
+                              throttle=throttle.from_settings(
+                                  server, options.get("rate_limit")))
+        manifest = runner.run()
+        if manifest.errors:
+            failed = ", ".join(sorted(manifest.errors))
+            raise CommandError(u"Failed to export %s." % failed)
         return u"Successfully exported!"
-
-    def send_data(self, data):
-        s3.store_data(data)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from mysqlapi.api.backup import catalog
+from mysqlapi.api.management.commands import s3
+from mysqlapi.api.models import Backup, BackupDatabase
+
+
+class Command(NoArgsCommand):
+
+    can_import_settings = True
+    option_list = NoArgsCommand.option_list + (
+        make_option("--database", dest="database",
+                    help="Only list the backups holding this database."),
+        make_option("--server", dest="server",
+                    help="Only list the backups of this server."),
+        make_option("--sync", action="store_true", dest="sync",
+                    default=False,
+                    help="Add the backups found in the bucket to the "
+                         "catalog first."),
+    )
+
+    def handle_noargs(self, **options):
+        if options.get("sync"):
+            added = catalog.sync(s3.bucket())
+            self.stdout.write("Added %d backups to the catalog.\n" %
+                              len(added))
+        if options.get("database"):
+            rows = BackupDatabase.objects.filter(name=options["database"])
+        else:
+            rows = Backup.objects.all()
+        if options.get("server"):
+            rows = rows.filter(server=options["server"])
+        for row in rows.order_by("-started_at"):
+            backup_id = getattr(row, "backup", row).backup_id
+            self.stdout.write("%s\t%s\t%s\t%d\n" % (
+                backup_id, row.server, row.started_at.isoformat(),
+                row.size))
+        return u""
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+
+# syncdb creates the tables missing, but doesn't change those that already
+# exist, so the columns added to them since are added here.
+INSTANCE_COLUMNS = (
+    ("db_name",
+     "ALTER TABLE api_instance ADD COLUMN db_name varchar(100) NOT NULL "
+     "DEFAULT ''"),
+    ("provisioned_id",
+     "ALTER TABLE api_instance ADD COLUMN provisioned_id integer NULL, "
+     "ADD INDEX api_instance_provisioned_id (provisioned_id), "
+     "ADD CONSTRAINT provisioned_id_refs_id_pool FOREIGN KEY "
+     "(provisioned_id) REFERENCES api_provisionedinstance (id)"),
+)
+
+PROVISIONED_COLUMNS = (
+    ("warm_db",
+     "ALTER TABLE api_provisionedinstance ADD COLUMN warm_db varchar(100) "
+     "NOT NULL DEFAULT ''"),
+    ("capacity",
+     "ALTER TABLE api_provisionedinstance ADD COLUMN capacity integer "
+     "NOT NULL DEFAULT 1"),
+    ("memory_mb",
+     "ALTER TABLE api_provisionedinstance ADD COLUMN memory_mb integer "
+     "NOT NULL DEFAULT 0"),
+    ("disk_mb",
+     "ALTER TABLE api_provisionedinstance ADD COLUMN disk_mb integer "
+     "NOT NULL DEFAULT 0"),
+    ("used",
+     "ALTER TABLE api_provisionedinstance ADD COLUMN used integer "
+     "NOT NULL DEFAULT 0"),
+)
+
+# servers used to hold a single database, linked by
+# api_provisionedinstance.instance_id.
+BACKFILL = (
+    "UPDATE api_instance i INNER JOIN api_provisionedinstance p "
+    "ON p.instance_id = i.id SET i.provisioned_id = p.id "
+    "WHERE i.provisioned_id IS NULL",
+    "UPDATE api_provisionedinstance p SET p.used = "
+    "(SELECT COUNT(*) FROM api_instance i WHERE i.provisioned_id = p.id)",
+)
+
+LEGACY_FK = """SELECT CONSTRAINT_NAME
+FROM information_schema.KEY_COLUMN_USAGE
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'api_provisionedinstance'
+AND COLUMN_NAME = 'instance_id' AND REFERENCED_TABLE_NAME IS NOT NULL"""
+
+
+def statements(instance_columns, provisioned_columns, legacy_fks=()):
+    """
+    Returns the statements bringing the pool tables, with the given
+    columns, up to date.
+    """
+    sql = []
+    for column, alter in PROVISIONED_COLUMNS:
+        if column not in provisioned_columns:
+            sql.append(alter)
+    for column, alter in INSTANCE_COLUMNS:
+        if column not in instance_columns:
+            sql.append(alter)
+    if "instance_id" in provisioned_columns:
+        sql.extend(BACKFILL)
+        for fk in legacy_fks:
+            sql.append("ALTER TABLE api_provisionedinstance "
+                       "DROP FOREIGN KEY %s" % fk)
+        sql.append("ALTER TABLE api_provisionedinstance "
+                   "DROP COLUMN instance_id")
+    return sql
+
+
+def columns(cursor, table):
+    description = connection.introspection.get_table_description(cursor,
+                                                                 table)
+    return set(column[0] for column in description)
+
+
+class Command(NoArgsCommand):
+
+    can_import_settings = True
+    option_list = NoArgsCommand.option_list + (
+        make_option("--dry-run", action="store_true", dest="dry_run",
+                    default=False,
+                    help="Only print the statements that would be run."),
+    )
+
+    def handle_noargs(self, **options):
+        cursor = connection.cursor()
+        provisioned_columns = columns(cursor, "api_provisionedinstance")
+        legacy_fks = []
+        if "instance_id" in provisioned_columns:
+            cursor.execute(LEGACY_FK)
+            legacy_fks = [row[0] for row in cursor.fetchall()]
+        sql = statements(columns(cursor, "api_instance"),
+                         provisioned_columns, legacy_fks)
+        for statement in sql:
+            self.stdout.write(statement + ";\n")
+            if not options.get("dry_run"):
+                cursor.execute(statement)
+        return u""
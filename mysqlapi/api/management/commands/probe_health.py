@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+
+from mysqlapi.api import prober
+from mysqlapi.api.models import (DatabaseManager, Instance,
+                                 ProvisionedInstance)
+
+
+class Command(NoArgsCommand):
+
+    can_import_settings = True
+    option_list = NoArgsCommand.option_list + (
+        make_option("--once", action="store_true", dest="once",
+                    default=False,
+                    help="Probe every instance once and exit."),
+    )
+
+    def handle_noargs(self, **options):
+        prober.set_models(Instance, ProvisionedInstance, DatabaseManager)
+        health_prober = prober.HealthProber(
+            settings.HEALTH_PROBE_INTERVAL,
+            settings.HEALTH_PROBE_CONCURRENCY)
+        if options.get("once"):
+            counts = health_prober.sweep()
+            return u"%d servers up, %d down.\n" % (counts["up"],
+                                                   counts["down"])
+        health_prober.run()
+        return u""
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from mysqlapi.api.backup import catalog
+from mysqlapi.api.management.commands import s3
+
+
+class Command(NoArgsCommand):
+
+    can_import_settings = True
+    option_list = NoArgsCommand.option_list + (
+        make_option("--days", type="int", dest="days",
+                    help="Delete backups older than this many days."),
+        make_option("--keep", type="int", dest="keep",
+                    help="Always keep this many backups of each server."),
+        make_option("--dry-run", action="store_true", dest="dry_run",
+                    default=False,
+                    help="Only list the backups that would be deleted."),
+    )
+
+    def handle_noargs(self, **options):
+        backups = catalog.prune(s3.bucket(), days=options.get("days"),
+                                keep=options.get("keep"),
+                                dry_run=options.get("dry_run"))
+        for backup in backups:
+            self.stdout.write("%s\t%s\n" % (backup.backup_id,
+                                            backup.started_at.isoformat()))
+        if options.get("dry_run"):
+            return u"%d backups would be deleted." % len(backups)
+        return u"Deleted %d backups." % len(backups)
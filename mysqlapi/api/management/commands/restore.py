@@ -4,12 +4,80 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
-from django.core.management.base import NoArgsCommand
+import time
+
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+
+from mysqlapi.api.backup import catalog, dump
+from mysqlapi.api.backup.restore import RestoreError, Restorer
+from mysqlapi.api.management.commands import s3
 
 
 class Command(NoArgsCommand):
 
     can_import_settings = True
+    option_list = NoArgsCommand.option_list + (
+        make_option("--backup", dest="backup",
+                    help="Backup to restore, defaults to the latest one."),
+        make_option("--database", action="append", dest="databases",
+                    help="Database to restore, may be given several times. "
+                         "Defaults to every database in the backup."),
+        make_option("--server", dest="server",
+                    help="Server (host:port) whose latest backup is "
+                         "restored. Defaults to the backup server."),
+        make_option("--threads", type="int", dest="threads",
+                    help="Connections used to load chunked databases."),
+        make_option("--until", dest="until",
+                    help="Replay the binary logs shipped after the backup "
+                         "up to this time (YYYY-MM-DD HH:MM:SS)."),
+    )
+
+    def find_backup(self, until, databases, server):
+        databases = databases or []
+        before = catalog.to_datetime(until)
+        if len(databases) == 1:
+            backup = catalog.latest(database=databases[0], before=before,
+                                    server=server)
+        else:
+            backup = catalog.latest(before=before, server=server,
+                                    databases=databases)
+        if backup is not None:
+            return backup.backup_id
+        if until is not None:
+            raise CommandError(u"No backup before %s." % before)
+        if server != dump.address(dump.default_server()):
+            raise CommandError(u"No backup of %s." % server)
+        # backups of the backup server taken before the catalog existed.
+        return s3.last_key()
 
     def handle_noargs(self, **options):
+        until = None
+        if options.get("until"):
+            try:
+                until = time.mktime(time.strptime(options["until"],
+                                                  "%Y-%m-%d %H:%M:%S"))
+            except ValueError:
+                raise CommandError(u"Invalid time: %s." % options["until"])
+        bucket = s3.bucket()
+        server = options.get("server") or \
+            dump.address(dump.default_server())
+        backup_id = options.get("backup") or \
+            self.find_backup(until, options.get("databases"), server)
+        manifest = s3.get_manifest(bucket, backup_id)
+        if manifest is None:
+            raise CommandError(u"Backup %s not found." % backup_id)
+        # databases go back to the server they were backed up from.
+        target = dump.server_for(manifest.server)
+        if target is None:
+            raise CommandError(u"Unknown server %s." % manifest.server)
+        threads = options.get("threads") or settings.BACKUP_RESTORE_THREADS
+        restorer = Restorer(target, bucket, manifest,
+                            out=self.stdout, threads=threads, until=until)
+        try:
+            restorer.restore(options.get("databases"))
+        except RestoreError as exc:
+            raise CommandError(unicode(exc))
         return u"Successfully restored!"
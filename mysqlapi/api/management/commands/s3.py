@@ -2,15 +2,29 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import Queue
+import threading
+
+from cStringIO import StringIO
+
 from django.conf import settings
 
 
 def connect():
-    from boto.s3.connection import S3Connection
+    from boto.s3.connection import OrdinaryCallingFormat, S3Connection
 
+    kwargs = {}
+    if settings.S3_HOST:
+        kwargs = {
+            "host": settings.S3_HOST,
+            "port": settings.S3_PORT,
+            "is_secure": settings.S3_SECURE,
+            "calling_format": OrdinaryCallingFormat(),
+        }
     return S3Connection(
         settings.S3_ACCESS_KEY,
-        settings.S3_SECRET_KEY
+        settings.S3_SECRET_KEY,
+        **kwargs
     )
 
 
@@ -24,18 +38,107 @@ def last_key():
     return key.get_contents_as_string()
 
 
-def store_data(data):
-    from boto.s3.key import Key
-    from uuid import uuid4
+class MultipartUpload(object):
+    """
+    Uploads an iterable of strings as an S3 multipart upload. At most
+    `concurrency` parts are uploaded at once and at most as many wait in
+    the queue, so memory stays bounded by the part size whatever the
+    length of the stream.
+    """
 
-    key = Key(bucket(), uuid4().hex)
-    key.set_contents_from_string(data)
+    def __init__(self, bucket, name, part_size, concurrency):
+        self.bucket = bucket
+        self.name = name
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.size = 0
+        self.parts = 0
+        self._errors = []
 
-    last_key = Key(bucket(), "lastkey")
-    last_key.set_contents_from_string(key.name)
-    return key
+    def _worker(self, mp, queue):
+        while True:
+            part = queue.get()
+            if part is None:
+                return
+            part_num, data = part
+            if self._errors:
+                continue
+            try:
+                mp.upload_part_from_file(StringIO(data), part_num)
+            except Exception as exc:
+                self._errors.append(exc)
 
+    def _put(self, queue, data):
+        if self._errors:
+            raise self._errors[0]
+        self.parts += 1
+        queue.put((self.parts, data))
 
-def get_data():
-    key = bucket().get_key(last_key())
-    return key.get_contents_as_string()
+    def upload(self, chunks):
+        mp = self.bucket.initiate_multipart_upload(self.name)
+        queue = Queue.Queue(maxsize=self.concurrency)
+        workers = []
+        for i in xrange(self.concurrency):
+            t = threading.Thread(target=self._worker, args=(mp, queue))
+            t.daemon = True
+            t.start()
+            workers.append(t)
+        failed = True
+        try:
+            buf, buffered = [], 0
+            for chunk in chunks:
+                buf.append(chunk)
+                buffered += len(chunk)
+                self.size += len(chunk)
+                if buffered >= self.part_size:
+                    self._put(queue, "".join(buf))
+                    buf, buffered = [], 0
+            if buf or not self.parts:
+                self._put(queue, "".join(buf))
+            failed = False
+        finally:
+            for t in workers:
+                queue.put(None)
+            for t in workers:
+                t.join()
+            if failed or self._errors:
+                mp.cancel_upload()
+        if self._errors:
+            raise self._errors[0]
+        mp.complete_upload()
+
+
+def upload_stream(bucket, name, chunks):
+    upload = MultipartUpload(bucket, name,
+                             part_size=settings.S3_PART_SIZE,
+                             concurrency=settings.S3_UPLOAD_CONCURRENCY)
+    upload.upload(chunks)
+    return upload
+
+
+def store_manifest(bucket, manifest, last=True):
+    bucket.new_key(manifest.key).set_contents_from_string(manifest.to_json())
+    if last:
+        last_key = bucket.new_key("lastkey")
+        last_key.set_contents_from_string(manifest.id)
+
+
+def get_manifest(bucket, backup_id):
+    from mysqlapi.api.backup.manifest import Manifest, key_for
+
+    key = bucket.get_key(key_for(backup_id))
+    if key is None:
+        return None
+    return Manifest.from_json(key.get_contents_as_string())
+
+
+def read_stream(bucket, name, chunk_size=1024 * 1024):
+    key = bucket.get_key(name)
+    if key is None:
+        raise KeyError("Object %s not found" % name)
+    while True:
+        data = key.read(chunk_size)
+        if not data:
+            break
+        yield data
+    key.close()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from mysqlapi.api.backup.runner import codec_options
+from mysqlapi.api.backup.scheduler import BackupScheduler
+from mysqlapi.api.management.commands import s3
+
+
+class Command(NoArgsCommand):
+
+    can_import_settings = True
+    option_list = NoArgsCommand.option_list + (
+        make_option("--once", action="store_true", dest="once",
+                    default=False,
+                    help="Start the backups that are due, wait for them "
+                         "and exit."),
+    )
+
+    def handle_noargs(self, **options):
+        try:
+            codec = codec_options()
+        except ValueError as exc:
+            raise CommandError(unicode(exc))
+        scheduler = BackupScheduler(s3.bucket(),
+                                    runner_options={"codec": codec})
+        if options.get("once"):
+            started = scheduler.tick()
+            scheduler.join_backups()
+            return u"Backed up %d instances." % len(started)
+        scheduler.run()
+        return u""
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+
+from mysqlapi.api.backup import dump
+from mysqlapi.api.backup.binlog import BinlogShipper
+from mysqlapi.api.management.commands import s3
+
+
+class Command(NoArgsCommand):
+
+    can_import_settings = True
+    option_list = NoArgsCommand.option_list + (
+        make_option("--follow", action="store_true", dest="follow",
+                    default=False,
+                    help="Keep shipping binary logs as they are closed."),
+        make_option("--interval", type="int", dest="interval",
+                    help="Seconds between two checks when following."),
+        make_option("--flush", action="store_true", dest="flush",
+                    default=False,
+                    help="Rotate the binary log before each check, so the "
+                         "current one is shipped too."),
+        make_option("--server", dest="server",
+                    help="Server (host:port) whose binary logs are shipped. "
+                         "Defaults to the backup server."),
+    )
+
+    def handle_noargs(self, **options):
+        server = dump.default_server()
+        if options.get("server"):
+            server = dump.server_for(options["server"])
+            if server is None:
+                raise CommandError(u"Unknown server %s." % options["server"])
+        shipper = BinlogShipper(server, s3.bucket(),
+                                flush=options.get("flush"))
+        if options.get("follow"):
+            interval = options.get("interval") or \
+                settings.BACKUP_BINLOG_INTERVAL
+            shipper.follow(interval)
+            return u""
+        shipped = shipper.ship()
+        return u"Shipped %d binary logs." % len(shipped)
@@ -2,18 +2,19 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import datetime
 import hashlib
 import os
 import re
-import subprocess
 
 import MySQLdb
 
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
-from mysqlapi.api import creator
-from mysqlapi.api.database import Connection
+from mysqlapi.api import creator, warmer
+from mysqlapi.api.database import CommandStream, Connection
 
 
 class InvalidInstanceName(Exception):
@@ -32,6 +33,12 @@ class DatabaseCreationError(Exception):
     pass
 
 
+class InstanceUnavailable(TypeError):
+
+    def __init__(self):
+        self.args = ["This instance is not available"]
+
+
 def generate_password(string):
     return hashlib.sha1(string + settings.SALT).hexdigest()
 
@@ -65,41 +72,43 @@ class DatabaseManager(object):
             return self._public_host
         return self.host
 
-    def create_database(self):
+    def _execute(self, sql):
         self.conn.open()
-        cursor = self.conn.cursor()
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(sql)
+        except MySQLdb.OperationalError:
+            self.conn.discard()
+            raise
+        finally:
+            self.conn.close()
+
+    def create_database(self):
         sql = "CREATE DATABASE %s default character set utf8 " + \
               "default collate utf8_general_ci"
-        cursor.execute(sql % self.name)
-        self.conn.close()
+        self._execute(sql % self.name)
 
     def drop_database(self):
-        self.conn.open()
-        cursor = self.conn.cursor()
-        cursor.execute("DROP DATABASE %s" % self.name)
-        self.conn.close()
+        self._execute("DROP DATABASE %s" % self.name)
 
     def create_user(self, username, host):
-        self.conn.open()
-        cursor = self.conn.cursor()
         username = generate_user(username)
         password = generate_password(username)
         sql = ("grant all privileges on {0}.* to '{1}'@'%'"
                " identified by '{2}'")
-        cursor.execute(sql.format(self.name, username, password))
-        self.conn.close()
+        self._execute(sql.format(self.name, username, password))
         return username, password
 
     def drop_user(self, username, host):
-        self.conn.open()
-        cursor = self.conn.cursor()
         username = generate_user(username)
-        cursor.execute("drop user '{0}'@'%'".format(username))
-        self.conn.close()
+        self._execute("drop user '{0}'@'%'".format(username))
 
     def export(self):
+        return self.export_stream().read()
+
+    def export_stream(self):
         cmd = ["mysqldump", "-u", "root", "-d", self.name, "--compact"]
-        return subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+        return CommandStream(cmd)
 
     def is_up(self):
         try:
@@ -136,10 +145,37 @@ class Instance(models.Model):
     host = models.CharField(max_length=50, null=True, blank=True)
     port = models.CharField(max_length=5, default="3306")
     shared = models.BooleanField(default=False)
+    # the database on the server, when it isn't named after the instance,
+    # e.g. a pre-created pool database.
+    db_name = models.CharField(max_length=100, blank=True)
+    # the pool server hosting the database, for instances allocated from
+    # the pool.
+    provisioned = models.ForeignKey("ProvisionedInstance", null=True,
+                                    blank=True, related_name="tenants",
+                                    on_delete=models.PROTECT)
+
+    @property
+    def database_name(self):
+        return self.db_name or self.name
 
     def is_up(self):
         return self.state == "running" and self.db_manager().is_up()
 
+    def legacy_provisioned(self):
+        """
+        Links the instance to the pool server it was allocated on before
+        servers held several databases, for instances not linked to it by
+        the migrate_pool command yet. Returns None when there isn't one.
+        """
+        if self.shared or self.ec2_id or not self.host:
+            return None
+        servers = ProvisionedInstance.objects.filter(host=self.host,
+                                                     port=self.port)[:1]
+        if not servers:
+            return None
+        self.provisioned = servers[0]
+        return self.provisioned
+
     def db_manager(self):
         host = self.host
         port = self.port
@@ -151,11 +187,10 @@ class Instance(models.Model):
             user = settings.SHARED_USER
             password = settings.SHARED_PASSWORD
             public_host = settings.SHARED_SERVER_PUBLIC_HOST
-        elif ProvisionedInstance.objects.filter(instance=self).exists():
-            pi = ProvisionedInstance.objects.get(instance=self)
-            user = pi.admin_user
-            password = pi.admin_password
-        return DatabaseManager(self.name,
+        elif self.provisioned_id:
+            user = self.provisioned.admin_user
+            password = self.provisioned.admin_password
+        return DatabaseManager(self.database_name,
                                host=host,
                                port=port,
                                user=user,
@@ -164,45 +199,209 @@ class Instance(models.Model):
 
 
 class ProvisionedInstance(models.Model):
-    instance = models.ForeignKey(Instance, null=True, blank=True, unique=True)
     host = models.CharField(max_length=500)
     port = models.IntegerField(default=3306)
     admin_user = models.CharField(max_length=255, default="root")
     admin_password = models.CharField(max_length=255, blank=True)
+    # database created ahead of time on a server with room left, handed to
+    # the next instance allocated here.
+    warm_db = models.CharField(max_length=100, blank=True)
+    # how many databases the server holds, further limited by its memory
+    # and disk (in MB, 0 when unknown) divided by POOL_TENANT_MEMORY_MB and
+    # POOL_TENANT_DISK_MB.
+    capacity = models.IntegerField(default=1)
+    memory_mb = models.IntegerField(default=0)
+    disk_mb = models.IntegerField(default=0)
+    used = models.IntegerField(default=0)
 
-    def _manager(self, name=None):
-        if not hasattr(self, "_db_manager"):
-            self._db_manager = DatabaseManager(name=self.instance.name,
-                                               host=self.host,
-                                               port=self.port,
-                                               user=self.admin_user,
-                                               password=self.admin_password)
-        return self._db_manager
+    @property
+    def slots(self):
+        slots = self.capacity
+        limits = ((self.memory_mb, settings.POOL_TENANT_MEMORY_MB),
+                  (self.disk_mb, settings.POOL_TENANT_DISK_MB))
+        for size, per_tenant in limits:
+            if size and per_tenant:
+                slots = min(slots, size // per_tenant)
+        return slots
+
+    @property
+    def free_slots(self):
+        return max(0, self.slots - self.used)
+
+    def _manager(self, name):
+        return DatabaseManager(name=name,
+                               host=self.host,
+                               port=self.port,
+                               user=self.admin_user,
+                               password=self.admin_password)
 
     def alloc(self, instance):
-        if self.instance:
-            raise TypeError("This instance is not available")
-        self.instance = instance
-        try:
-            self._manager().create_database()
-        except Exception as exc:
-            raise DatabaseCreationError(*exc.args)
+        if not self.free_slots:
+            raise InstanceUnavailable()
+        created = instance.pk is None
+        if created:
+            instance.save()
+        # the slot is taken only while the server still has room, so
+        # concurrent requests can't overfill it, and only one of them gets
+        # its warm database, if any. The others still get a slot there,
+        # with a database created on demand.
+        warm_db = self.warm_db
+        free = ProvisionedInstance.objects.filter(pk=self.pk,
+                                                  used__lt=self.slots)
+        if not warm_db or not free.filter(warm_db=warm_db).update(
+                used=models.F("used") + 1, warm_db=""):
+            warm_db = ""
+            if not free.update(used=models.F("used") + 1):
+                if created:
+                    instance.delete()
+                raise InstanceUnavailable()
+        self.used += 1
+        self.warm_db = ""
+        if warm_db:
+            instance.db_name = warm_db
+        else:
+            try:
+                self._manager(instance.database_name).create_database()
+            except Exception as exc:
+                self._release()
+                if created:
+                    instance.delete()
+                raise DatabaseCreationError(*exc.args)
+        instance.provisioned = self
         instance.host = self.host
         instance.port = str(self.port)
         instance.shared = False
         instance.ec2_id = None
         instance.state = "running"
         instance.save()
-        self.instance = instance
-        self.save()
 
-    def dealloc(self):
-        if not self.instance:
+    def dealloc(self, instance):
+        if instance.provisioned_id is None or \
+                instance.provisioned_id != self.pk:
             raise TypeError("This instance is not allocated")
-        self._manager().drop_database()
-        self.instance.state = "stopped"
-        self.instance = None
-        self.save()
+        self._manager(instance.database_name).drop_database()
+        instance.state = "stopped"
+        instance.provisioned = None
+        instance.save()
+        self._release()
+
+    def _release(self):
+        ProvisionedInstance.objects.filter(pk=self.pk, used__gt=0).update(
+            used=models.F("used") - 1)
+        self.used = max(0, self.used - 1)
+
+
+def free_provisioned_instances():
+    """
+    Returns the pool servers with room for another database, the fullest
+    first (best fit), so databases are packed on as few servers as
+    possible and the empty ones are left for the instances to come.
+    Among servers equally full, those with a warm database come first.
+    """
+    hosts = ProvisionedInstance.objects.filter(
+        used__lt=models.F("capacity"))
+    hosts = [pi for pi in hosts if pi.free_slots]
+    hosts.sort(key=lambda pi: (pi.free_slots, not pi.warm_db, pi.pk))
+    return hosts
+
+
+class HealthStatus(models.Model):
+    # results of the probe_health command, read by every API process.
+    key = models.CharField(max_length=255, unique=True)
+    up = models.BooleanField(default=False)
+    checked_at = models.DateTimeField()
+    latency = models.FloatField(null=True, blank=True)
+
+
+class PoolAllocation(models.Model):
+    host = models.CharField(max_length=500)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class ProvisioningJob(models.Model):
+    STATE_CHOICES = (
+        ("pending", "pending"),
+        ("done", "done"),
+        ("failed", "failed"),
+    )
+
+    instance = models.ForeignKey(Instance, unique=True)
+    state = models.CharField(max_length=20,
+                             default="pending",
+                             choices=STATE_CHOICES)
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField()
+    lease_token = models.CharField(max_length=32, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    reason = models.CharField(max_length=1000, blank=True)
+
+    class Meta:
+        index_together = (("state", "run_after"),)
+
+    def _leased(self):
+        # updates only go through while this process still holds the
+        # lease, so a job claimed again after its lease expired isn't
+        # overwritten by the process that lost it.
+        return ProvisioningJob.objects.filter(pk=self.pk,
+                                              lease_token=self.lease_token)
+
+    def extend(self, seconds):
+        self.lease_expires_at = timezone.now() + \
+            datetime.timedelta(seconds=seconds)
+        return bool(self._leased().update(
+            lease_expires_at=self.lease_expires_at))
+
+    def retry(self, delay):
+        self.attempts += 1
+        self.run_after = timezone.now() + datetime.timedelta(seconds=delay)
+        return bool(self._leased().update(attempts=self.attempts,
+                                          run_after=self.run_after,
+                                          lease_token="",
+                                          lease_expires_at=None))
+
+    def finish(self, state="done", reason=""):
+        self.state = state
+        self.reason = unicode(reason)[:1000]
+        return bool(self._leased().update(state=self.state,
+                                          reason=self.reason,
+                                          lease_token="",
+                                          lease_expires_at=None))
+
+
+class Backup(models.Model):
+    backup_id = models.CharField(max_length=64, unique=True)
+    server = models.CharField(max_length=255, db_index=True)
+    started_at = models.DateTimeField(db_index=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    size = models.BigIntegerField(default=0)
+    stored_size = models.BigIntegerField(default=0)
+    failed = models.IntegerField(default=0)
+
+
+class BackupDatabase(models.Model):
+    backup = models.ForeignKey(Backup, related_name="databases")
+    name = models.CharField(max_length=100)
+    server = models.CharField(max_length=255)
+    started_at = models.DateTimeField()
+    size = models.BigIntegerField(default=0)
+    stored_size = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64)
+    object_count = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = (("name", "started_at"),
+                          ("server", "name", "started_at"))
+
+
+class BackupSchedule(models.Model):
+    instance = models.ForeignKey(Instance, unique=True)
+    next_run_at = models.DateTimeField(db_index=True)
+    last_started_at = models.DateTimeField(null=True, blank=True)
+    last_finished_at = models.DateTimeField(null=True, blank=True)
+    last_status = models.CharField(max_length=20, blank=True)
+    last_backup_id = models.CharField(max_length=64, blank=True)
+    last_error = models.CharField(max_length=1000, blank=True)
 
 
 def create_database(instance, ec2_client=None):
@@ -239,12 +438,28 @@ def _create_shared_database(instance):
 
 
 def _create_from_pool(instance):
-    provisioned_instance = ProvisionedInstance.objects.filter(
-        instance__isnull=True)[:1]
-    if not provisioned_instance:
-        raise DatabaseCreationError(instance,
-                                    "No free instances available in the pool")
-    provisioned_instance[0].alloc(instance)
+    # requests losing a server to a concurrent one (it filled up or its
+    # warm database was taken) move on to the next best fit.
+    instance.save()
+    try:
+        for attempt in xrange(settings.POOL_ALLOC_ATTEMPTS):
+            free = free_provisioned_instances()
+            if not free:
+                break
+            for provisioned_instance in free[:settings.POOL_ALLOC_CANDIDATES]:
+                try:
+                    provisioned_instance.alloc(instance)
+                except InstanceUnavailable:
+                    continue
+                PoolAllocation.objects.create(host=provisioned_instance.host)
+                warmer.wake()
+                return
+    except Exception:
+        instance.delete()
+        raise
+    instance.delete()
+    raise DatabaseCreationError(instance,
+                                "No free instances available in the pool")
 
 
 def _create_dedicate_database(instance, ec2_client):
@@ -0,0 +1,156 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import abc
+import collections
+import datetime
+import math
+import sys
+import threading
+import traceback
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_by_path
+
+from mysqlapi.api import warmer
+from mysqlapi.api.models import PoolAllocation, ProvisionedInstance
+
+
+class Forecast(collections.namedtuple("Forecast",
+                                      "free warm allocated rate hours_left "
+                                      "threshold pending needed servers")):
+
+    def to_dict(self):
+        return dict(self._asdict())
+
+
+class Provisioner(object):
+    """
+    Base class of the provisioners, which add servers to the pool. There
+    is none by default: POOL_PROVISIONER names a subclass for the
+    infrastructure the servers run on.
+
+    provision returns the new servers as dicts of ProvisionedInstance
+    fields (host, port, admin_user, admin_password and optionally
+    capacity, memory_mb and disk_mb); a provisioner that takes a while to
+    set them up can return fewer, count the others in pending and add
+    them later.
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def provision(self, count):
+        pass
+
+    def pending(self):
+        return 0
+
+
+def get_provisioner(path=None):
+    path = path if path is not None else settings.POOL_PROVISIONER
+    if not path:
+        return None
+    return import_by_path(path)()
+
+
+def host_capacity():
+    # servers added by the controller hold at least one database.
+    return max(1, settings.POOL_HOST_CAPACITY)
+
+
+def forecast(now=None, pending=0):
+    """
+    Returns how long the room left in the pool lasts at the allocation
+    rate of the forecast window, and how many databases and servers
+    should be added so it lasts the provisioning lead time. pending is
+    the number of servers being provisioned.
+    """
+    now = now or timezone.now()
+    window = settings.POOL_FORECAST_WINDOW
+    free = [pi for pi in ProvisionedInstance.objects.all() if pi.free_slots]
+    free_count = sum(pi.free_slots for pi in free)
+    warm = len([pi for pi in free if pi.warm_db])
+    since = now - datetime.timedelta(seconds=window)
+    allocated = PoolAllocation.objects.filter(created_at__gt=since).count()
+    rate = allocated * 3600.0 / window
+    hours_left = free_count / rate if rate else None
+    threshold = max(settings.POOL_MIN_FREE,
+                    int(math.ceil(rate * settings.POOL_LEAD_TIME / 3600.0)))
+    capacity = host_capacity()
+    needed = max(0, threshold - free_count - pending * capacity)
+    servers = int(math.ceil(needed / float(capacity)))
+    return Forecast(free_count, warm, allocated, rate, hours_left, threshold,
+                    pending, needed, servers)
+
+
+def hosts():
+    """
+    Returns the usage of every pool server.
+    """
+    usage = []
+    for pi in ProvisionedInstance.objects.order_by("host", "port"):
+        slots = pi.slots
+        usage.append({"host": pi.host,
+                      "port": pi.port,
+                      "slots": slots,
+                      "used": pi.used,
+                      "free": pi.free_slots,
+                      "utilization": float(pi.used) / slots if slots else 1.0,
+                      "warm": bool(pi.warm_db)})
+    return usage
+
+
+class PoolController(threading.Thread):
+    """
+    Tops the pool up through a Provisioner before it runs dry.
+    """
+
+    def __init__(self, provisioner, interval=None):
+        super(PoolController, self).__init__()
+        self.provisioner = provisioner
+        self.interval = interval or settings.POOL_CONTROLLER_INTERVAL
+        self.daemon = True
+        self.last_forecast = None
+        self._stopped = threading.Event()
+
+    def tick(self, now=None):
+        """
+        Returns the forecast and the instances added to the pool.
+        """
+        f = forecast(now, self.provisioner.pending())
+        self.last_forecast = f
+        added = []
+        if f.servers:
+            count = min(f.servers, settings.POOL_MAX_PROVISION)
+            for spec in self.provisioner.provision(count):
+                spec.setdefault("capacity", host_capacity())
+                added.append(ProvisionedInstance.objects.create(**spec))
+        if added:
+            warmer.wake()
+        return f, added
+
+    def prune(self, now=None):
+        now = now or timezone.now()
+        since = now - datetime.timedelta(
+            seconds=settings.POOL_FORECAST_WINDOW)
+        PoolAllocation.objects.filter(created_at__lte=since).delete()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.tick()
+                self.prune()
+            except Exception:
+                sys.stderr.write("Failed to replenish the pool\n")
+                traceback.print_exc(file=sys.stderr)
+            self._stopped.wait(self.interval)
+
+    def close(self):
+        self._stopped.set()
+
+    def stop(self):
+        self.close()
+        self.join()
@@ -0,0 +1,117 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import Queue
+import sys
+import threading
+import time
+import traceback
+
+from mysqlapi.api import health
+
+model_class = None
+provisioned_class = None
+manager_class = None
+
+
+def set_models(instance_cls, provisioned_cls, manager_cls):
+    global model_class, provisioned_class, manager_class
+    model_class = instance_cls
+    provisioned_class = provisioned_cls
+    manager_class = manager_cls
+
+
+def provisioned_key(provisioned):
+    return "provisioned:%s" % provisioned.pk
+
+
+def targets():
+    """
+    Returns the endpoints to probe, each mapped to the cache keys that
+    share it, so instances on the same server cost a single probe. Pool
+    servers are probed even when they hold no database yet.
+    """
+    endpoints = {}
+    for instance in model_class.objects.filter(state="running"):
+        db = instance.db_manager()
+        key = (db.conn.hostname, str(db.conn.port), db.conn.username)
+        endpoints.setdefault(key, (db, []))[1].append(instance.name)
+    for pi in provisioned_class.objects.all():
+        db = manager_class("", host=pi.host, port=pi.port,
+                           user=pi.admin_user, password=pi.admin_password)
+        key = (db.conn.hostname, str(db.conn.port), db.conn.username)
+        endpoints.setdefault(key, (db, []))[1].append(provisioned_key(pi))
+    return endpoints.values()
+
+
+class HealthProber(threading.Thread):
+    """
+    Probes every instance server, `concurrency` at a time, every
+    `interval` seconds. Only one prober should run, from the probe_health
+    command: it stores its results in the database for the API processes
+    to serve, so they don't each hold connections to every server.
+    """
+
+    def __init__(self, interval, concurrency, cache=None):
+        super(HealthProber, self).__init__()
+        self.interval = interval
+        self.concurrency = concurrency
+        self.cache = cache or health.shared
+        self.last_sweep = {}
+        self.daemon = True
+        self._stopped = threading.Event()
+
+    def _probe(self, queue, results):
+        while True:
+            try:
+                db, keys = queue.get_nowait()
+            except Queue.Empty:
+                return
+            start = time.time()
+            up = db.is_up()
+            results.put((keys, up, time.time() - start))
+
+    def sweep(self):
+        start = time.time()
+        queue = Queue.Queue()
+        for target in targets():
+            queue.put(target)
+        results = Queue.Queue()
+        workers = []
+        for i in xrange(min(self.concurrency, queue.qsize())):
+            t = threading.Thread(target=self._probe, args=(queue, results))
+            t.start()
+            workers.append(t)
+        for t in workers:
+            t.join()
+        # results are stored from this thread, so the probing threads
+        # don't open database connections of their own.
+        counts = {"up": 0, "down": 0}
+        probed = []
+        while not results.empty():
+            keys, up, latency = results.get()
+            for key in keys:
+                self.cache.set(key, up, latency)
+            probed.extend(keys)
+            counts["up" if up else "down"] += 1
+        self.cache.prune(probed)
+        counts["duration"] = time.time() - start
+        self.last_sweep = counts
+        return counts
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sweep()
+            except Exception:
+                sys.stderr.write("Failed to probe instances\n")
+                traceback.print_exc(file=sys.stderr)
+            self._stopped.wait(self.interval)
+
+    def close(self):
+        self._stopped.set()
+
+    def stop(self):
+        self.close()
+        self.join()
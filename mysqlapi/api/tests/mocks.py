@@ -2,6 +2,10 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import time
+
+from mysqlapi.api.pool import Provisioner
+
 
 class FakeEC2Client(object):
 
@@ -44,6 +48,30 @@ class FakeEC2ClientPendingInstance(object):
         return True
 
 
+class FakeBatchEC2Client(FakeEC2Client):
+    """
+    Describes many instances at once; the instances in `booting` are
+    running after the given number of calls.
+    """
+
+    def __init__(self, booting=None, *args, **kwargs):
+        self.booting = dict(booting or {})
+        super(FakeBatchEC2Client, self).__init__(*args, **kwargs)
+
+    def get_many(self, instances):
+        self.actions.append("get instances %s" %
+                            ", ".join(i.name for i in instances))
+        ready = []
+        for instance in instances:
+            if self.booting.get(instance.name, 0) > 0:
+                self.booting[instance.name] -= 1
+                continue
+            instance.host = "127.0.0.1"
+            instance.state = "running"
+            ready.append(instance)
+        return ready
+
+
 class MultipleFailureEC2Client(FakeEC2Client):
 
     def __init__(self, times, *args, **kwargs):
@@ -56,3 +84,110 @@ class MultipleFailureEC2Client(FakeEC2Client):
             self.failures += 1
             return False
         return super(MultipleFailureEC2Client, self).get(instance)
+
+
+class FakeKey(object):
+
+    def __init__(self, bucket, name, data=""):
+        self.bucket = bucket
+        self.name = name
+        self.data = data
+        self.last_modified = time.strftime("%Y-%m-%dT%H:%M:%S.000Z",
+                                           time.gmtime())
+        self._pos = 0
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def set_contents_from_string(self, data):
+        self.data = data
+        self.bucket.keys[self.name] = self
+
+    def get_contents_as_string(self):
+        return self.data
+
+    def read(self, size=0):
+        if not size:
+            size = len(self.data)
+        data = self.data[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        self._pos = 0
+
+
+class FakeMultiPartUpload(object):
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.key_name = name
+        self.parts = {}
+        self.completed = False
+        self.cancelled = False
+
+    def upload_part_from_file(self, fp, part_num):
+        self.parts[part_num] = fp.read()
+
+    def complete_upload(self):
+        data = "".join(self.parts[n] for n in sorted(self.parts))
+        FakeKey(self.bucket, self.key_name).set_contents_from_string(data)
+        self.completed = True
+
+    def cancel_upload(self):
+        self.cancelled = True
+
+
+class FakeBucket(object):
+    """
+    In-memory stand-in for a boto S3 bucket.
+    """
+
+    def __init__(self, name="mysqlapi"):
+        self.name = name
+        self.keys = {}
+        self.uploads = []
+
+    def new_key(self, name):
+        return FakeKey(self, name)
+
+    def copy_key(self, new_key_name, src_bucket_name, src_key_name,
+                 metadata=None):
+        data = self.keys[src_key_name].data
+        FakeKey(self, new_key_name).set_contents_from_string(data)
+
+    def get_key(self, name):
+        key = self.keys.get(name)
+        if key:
+            key.close()
+        return key
+
+    def list(self, prefix=""):
+        return [self.keys[name] for name in sorted(self.keys)
+                if name.startswith(prefix)]
+
+    def delete_keys(self, names):
+        for name in names:
+            self.keys.pop(name, None)
+
+    def initiate_multipart_upload(self, name):
+        upload = FakeMultiPartUpload(self, name)
+        self.uploads.append(upload)
+        return upload
+
+
+class FakeProvisioner(Provisioner):
+
+    def __init__(self, in_flight=0):
+        self.in_flight = in_flight
+        self.requests = []
+
+    def provision(self, count):
+        self.requests.append(count)
+        first = sum(self.requests) - count
+        return [{"host": "10.0.1.%d" % (first + i), "admin_user": "root"}
+                for i in xrange(count)]
+
+    def pending(self):
+        return self.in_flight
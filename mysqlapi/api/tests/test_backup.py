@@ -0,0 +1,206 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import hashlib
+import json
+
+from unittest import TestCase
+from django.test.utils import override_settings
+
+from mysqlapi.api import compression
+from mysqlapi.api.backup import dump
+from mysqlapi.api.backup.manifest import Manifest
+from mysqlapi.api.backup.runner import BackupRunner
+from mysqlapi.api.database import Connection
+from mysqlapi.api.tests import mocks
+
+import mock
+
+
+class DumpTestCase(TestCase):
+
+    def test_dump_command(self):
+        server = Connection(hostname="10.0.0.1", port="3307",
+                            username="admin", password="secret")
+        cmd = dump.dump_command(server, "mydb")
+        expected = ["mysqldump", "-h", "10.0.0.1", "-P", "3307",
+                    "-u", "admin", "--quick", "--single-transaction",
+                    "--databases", "mydb"]
+        self.assertEqual(expected, cmd)
+        self.assertNotIn("secret", " ".join(cmd))
+
+    @override_settings(BACKUP_BINLOG=True)
+    def test_dump_command_records_binlog_coordinates(self):
+        server = Connection(hostname="10.0.0.1", username="admin")
+        cmd = dump.dump_command(server, "mydb")
+        self.assertIn("--master-data=2", cmd)
+
+    def test_binlog_position_stream(self):
+        header = ("-- MySQL dump\n--\n-- CHANGE MASTER TO "
+                  "MASTER_LOG_FILE='mysql-bin.000003', MASTER_LOG_POS=120;")
+        stream = dump.BinlogPositionStream(iter([header[:40], header[40:],
+                                                 "\nrest"]))
+        self.assertEqual(header + "\nrest", "".join(stream))
+        self.assertEqual({"file": "mysql-bin.000003", "position": 120},
+                         stream.binlog)
+
+    def test_binlog_position_stream_without_coordinates(self):
+        stream = dump.BinlogPositionStream(iter(["-- MySQL dump\n"]))
+        list(stream)
+        self.assertEqual(None, stream.binlog)
+
+    def test_command_env_passes_the_password(self):
+        server = Connection(username="admin", password="secret")
+        self.assertEqual("secret", dump.command_env(server)["MYSQL_PWD"])
+
+    @override_settings(RESERVED_NAMES=("mysql", "mysqlapi"))
+    def test_list_databases_skips_reserved_names(self):
+        server = mock.Mock()
+        cursor = server.cursor.return_value
+        cursor.fetchall.return_value = [("mysql",), ("mysqlapi",),
+                                        ("performance_schema",), ("app1",),
+                                        ("app2",)]
+        self.assertEqual(["app1", "app2"], dump.list_databases(server))
+        server.close.assert_called_with()
+
+    def test_checksum_stream(self):
+        stream = dump.ChecksumStream(iter(["ab", "cd"]))
+        self.assertEqual("abcd", "".join(stream))
+        self.assertEqual(4, stream.size)
+        self.assertEqual(hashlib.sha256("abcd").hexdigest(), stream.checksum)
+
+
+class ManifestTestCase(TestCase):
+
+    def test_to_json_and_back(self):
+        manifest = Manifest("abc123", "localhost:3306", started_at=10)
+        manifest.add(database="mydb", key="abc123/mydb.sql", size=4)
+        manifest.finish()
+        loaded = Manifest.from_json(manifest.to_json())
+        self.assertEqual("abc123", loaded.id)
+        self.assertEqual(10, loaded.started_at)
+        self.assertEqual(manifest.finished_at, loaded.finished_at)
+        self.assertEqual(manifest.entries, loaded.entries)
+
+    def test_key(self):
+        self.assertEqual("abc123/manifest.json", Manifest("abc123", "").key)
+
+    def test_size(self):
+        manifest = Manifest("abc123", "")
+        manifest.add(database="a", size=3)
+        manifest.add(database="b", size=4)
+        self.assertEqual(7, manifest.size())
+
+
+class BackupRunnerTestCase(TestCase):
+
+    def setUp(self):
+        override = override_settings(BACKUP_CHUNK_THRESHOLD=0,
+                                     BACKUP_FINGERPRINT="none")
+        override.enable()
+        self.addCleanup(override.disable)
+        self.bucket = mocks.FakeBucket()
+        self.server = Connection(hostname="localhost", username="root")
+        patcher = mock.patch("mysqlapi.api.backup.dump.dump")
+        self.dump = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dump.side_effect = lambda server, db: iter(["-- %s\n" % db])
+        patcher = mock.patch("mysqlapi.api.backup.catalog.record")
+        self.record = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_run_stores_each_database_and_a_manifest(self):
+        runner = BackupRunner(self.server, self.bucket, workers=2,
+                              backup_id="abc123")
+        manifest = runner.run(["app1", "app2", "app3"])
+        self.assertEqual(["app1", "app2", "app3"], manifest.databases())
+        for entry in manifest.entries:
+            data = self.bucket.keys[entry["key"]].data
+            self.assertEqual("-- %s\n" % entry["database"], data)
+            self.assertEqual(len(data), entry["size"])
+            self.assertEqual(hashlib.sha256(data).hexdigest(),
+                             entry["sha256"])
+        stored = json.loads(self.bucket.keys["abc123/manifest.json"].data)
+        self.assertEqual(3, len(stored["entries"]))
+        self.assertEqual("abc123", self.bucket.keys["lastkey"].data)
+        self.record.assert_called_with(manifest)
+
+    def test_run_without_moving_the_last_key(self):
+        runner = BackupRunner(self.server, self.bucket, backup_id="abc123",
+                              last=False)
+        runner.run(["app1"])
+        self.assertIn("abc123/manifest.json", self.bucket.keys)
+        self.assertNotIn("lastkey", self.bucket.keys)
+
+    def test_run_records_the_binlog_coordinates_of_each_dump(self):
+        self.dump.side_effect = lambda server, db: iter([
+            "-- CHANGE MASTER TO MASTER_LOG_FILE='mysql-bin.000002', "
+            "MASTER_LOG_POS=%d;\n" % len(db)])
+        manifest = BackupRunner(self.server, self.bucket).run(["app1", "a"])
+        self.assertEqual({"app1": {"file": "mysql-bin.000002",
+                                   "position": 4},
+                          "a": {"file": "mysql-bin.000002", "position": 1}},
+                         manifest.metadata["snapshots"])
+
+    def test_run_stores_deduplicated_dumps(self):
+        with override_settings(BACKUP_DEDUP=True):
+            manifest = BackupRunner(self.server, self.bucket,
+                                    backup_id="abc123").run(["app1"])
+        entry = manifest.entries[0]
+        self.assertEqual(1, len(entry["chunks"]))
+        self.assertNotIn("abc123/app1.sql", self.bucket.keys)
+
+    def test_run_compresses_dumps(self):
+        codec = compression.CodecOptions("gzip", 1, 2)
+        manifest = BackupRunner(self.server, self.bucket, backup_id="abc123",
+                                codec=codec).run(["app1"])
+        entry = manifest.entries[0]
+        self.assertEqual("abc123/app1.sql.gz", entry["key"])
+        self.assertEqual("gzip", entry["codec"])
+        data = self.bucket.keys["abc123/app1.sql.gz"].data
+        self.assertEqual(len(data), entry["stored_size"])
+        stats = manifest.metadata["compression"]
+        self.assertEqual("gzip", stats["codec"])
+        self.assertEqual(1, stats["level"])
+        self.assertEqual(entry["size"], stats["size"])
+        self.assertEqual(float(entry["size"]) / len(data), stats["ratio"])
+
+    def test_run_lists_databases_when_none_given(self):
+        m = "mysqlapi.api.backup.dump.list_databases"
+        with mock.patch(m) as list_databases:
+            list_databases.return_value = ["app1"]
+            manifest = BackupRunner(self.server, self.bucket).run()
+        self.assertEqual(["app1"], manifest.databases())
+
+    def test_run_records_failed_databases(self):
+        def fake_dump(server, db):
+            if db == "broken":
+                raise RuntimeError("mysqldump: Got error")
+            return iter(["data"])
+        self.dump.side_effect = fake_dump
+        manifest = BackupRunner(self.server, self.bucket).run(["app1",
+                                                               "broken"])
+        self.assertEqual(["app1"], manifest.databases())
+        self.assertEqual({"broken": "mysqldump: Got error"}, manifest.errors)
+
+    def test_run_dumps_large_databases_in_chunks(self):
+        m = "mysqlapi.api.backup.dump.database_size"
+        with mock.patch(m) as database_size:
+            database_size.side_effect = lambda server, db: {"big": 100,
+                                                            "small": 1}[db]
+            m = "mysqlapi.api.backup.chunked.ChunkedDump"
+            with mock.patch(m) as ChunkedDump:
+                job = ChunkedDump.return_value
+                job.run.return_value = [{"database": "big", "kind": "chunk",
+                                         "key": "abc123/big/t.00001.sql",
+                                         "size": 10}]
+                job.binlog = {"file": "mysql-bin.000003", "position": 120}
+                with override_settings(BACKUP_CHUNK_THRESHOLD=10):
+                    runner = BackupRunner(self.server, self.bucket,
+                                          backup_id="abc123")
+                    manifest = runner.run(["big", "small"])
+        kinds = [(e["database"], e["kind"]) for e in manifest.entries]
+        self.assertEqual([("big", "chunk"), ("small", "database")], kinds)
+        self.assertEqual({"big": job.binlog},
+                         manifest.metadata["snapshots"])
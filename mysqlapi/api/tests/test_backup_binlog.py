@@ -0,0 +1,191 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import gzip
+import os
+import shutil
+import struct
+import tempfile
+
+from StringIO import StringIO
+from unittest import TestCase
+
+from mysqlapi.api.backup import binlog
+from mysqlapi.api.database import Connection
+from mysqlapi.api.tests import mocks
+
+import mock
+
+
+def fake_binlog(created):
+    return binlog.MAGIC + struct.pack("<I", created) + "events"
+
+
+class BinlogTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_started_at_reads_the_first_event_timestamp(self):
+        path = os.path.join(self.directory, "mysql-bin.000001")
+        with open(path, "wb") as f:
+            f.write(fake_binlog(1430000000))
+        self.assertEqual(1430000000, binlog.started_at(path))
+
+    def test_started_at_rejects_other_files(self):
+        path = os.path.join(self.directory, "other")
+        with open(path, "wb") as f:
+            f.write("not a binlog")
+        with self.assertRaises(ValueError):
+            binlog.started_at(path)
+
+    def test_fetch_command(self):
+        server = Connection(hostname="10.0.0.1", username="admin",
+                            password="secret")
+        cmd = binlog.fetch_command(server, "mysql-bin.000001", "/tmp/x")
+        self.assertEqual(["mysqlbinlog", "--read-from-remote-server",
+                          "--raw", "--result-file=/tmp/x/",
+                          "-h", "10.0.0.1", "-P", "3306", "-u", "admin",
+                          "mysql-bin.000001"], cmd)
+        self.assertNotIn("secret", " ".join(cmd))
+
+
+class CoveringTestCase(TestCase):
+
+    index = [{"name": "mysql-bin.000001", "started_at": 100},
+             {"name": "mysql-bin.000003", "started_at": 300},
+             {"name": "mysql-bin.000002", "started_at": 200},
+             {"name": "mysql-bin.000004", "started_at": 400}]
+
+    def test_covering_starts_at_the_snapshot(self):
+        entries = binlog.covering(self.index, {"file": "mysql-bin.000002",
+                                               "position": 4})
+        self.assertEqual(["mysql-bin.000002", "mysql-bin.000003",
+                          "mysql-bin.000004"], [e["name"] for e in entries])
+
+    def test_covering_stops_at_the_target_time(self):
+        entries = binlog.covering(self.index, {"file": "mysql-bin.000002",
+                                               "position": 4}, until=350)
+        self.assertEqual(["mysql-bin.000002", "mysql-bin.000003"],
+                         [e["name"] for e in entries])
+
+    def test_covering_fails_beyond_the_shipped_logs(self):
+        # the last log shipped may end before the target time.
+        with self.assertRaises(KeyError):
+            binlog.covering(self.index, {"file": "mysql-bin.000002",
+                                         "position": 4}, until=450)
+
+    def test_covering_requires_the_snapshot_binlog(self):
+        with self.assertRaises(KeyError):
+            binlog.covering(self.index, {"file": "mysql-bin.000009",
+                                         "position": 4})
+
+    def test_covering_orders_logs_by_number(self):
+        index = [{"name": "mysql-bin.999999", "started_at": 100},
+                 {"name": "mysql-bin.1000000", "started_at": 200}]
+        entries = binlog.covering(index, {"file": "mysql-bin.999999",
+                                          "position": 4})
+        self.assertEqual(["mysql-bin.999999", "mysql-bin.1000000"],
+                         [e["name"] for e in entries])
+
+    def test_covering_fails_on_a_missing_log(self):
+        index = [e for e in self.index if e["name"] != "mysql-bin.000003"]
+        with self.assertRaises(KeyError):
+            binlog.covering(index, {"file": "mysql-bin.000002",
+                                    "position": 4})
+
+    def test_covering_fails_on_a_missing_log_before_the_target_time(self):
+        index = [e for e in self.index if e["name"] != "mysql-bin.000003"]
+        with self.assertRaises(KeyError):
+            binlog.covering(index, {"file": "mysql-bin.000002",
+                                    "position": 4}, until=350)
+
+    def test_covering_ignores_logs_of_another_base_name(self):
+        index = self.index + [{"name": "other-bin.000003",
+                               "started_at": 300}]
+        entries = binlog.covering(index, {"file": "mysql-bin.000003",
+                                          "position": 4})
+        self.assertEqual(["mysql-bin.000003", "mysql-bin.000004"],
+                         [e["name"] for e in entries])
+
+
+class BinlogShipperTestCase(TestCase):
+
+    def setUp(self):
+        self.bucket = mocks.FakeBucket()
+        self.server = Connection(hostname="localhost", username="root")
+        m = "mysqlapi.api.backup.binlog.list_binlogs"
+        patcher = mock.patch(m)
+        self.list_binlogs = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.list_binlogs.return_value = [("mysql-bin.000001", 100),
+                                          ("mysql-bin.000002", 100),
+                                          ("mysql-bin.000003", 10)]
+        patcher = mock.patch("subprocess.check_call")
+        self.check_call = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.check_call.side_effect = self.fetch
+
+    def fetch(self, cmd, env=None):
+        directory = cmd[3].split("=", 1)[1]
+        with open(os.path.join(directory, cmd[-1]), "wb") as f:
+            f.write(fake_binlog(int(cmd[-1][-1]) * 100))
+
+    def test_ship_uploads_the_closed_binlogs(self):
+        shipped = binlog.BinlogShipper(self.server, self.bucket).ship()
+        self.assertEqual(["mysql-bin.000001", "mysql-bin.000002"],
+                         [e["name"] for e in shipped])
+        data = self.bucket.keys[
+            "binlog/localhost:3306/mysql-bin.000001.gz"].data
+        content = gzip.GzipFile(fileobj=StringIO(data)).read()
+        self.assertEqual(fake_binlog(100), content)
+        index = binlog.read_index(self.bucket, "localhost:3306")
+        self.assertEqual([100, 200], [e["started_at"] for e in index])
+        self.assertEqual(len(content), index[0]["size"])
+        self.assertEqual("gzip", index[0]["codec"])
+
+    def test_ship_skips_shipped_binlogs(self):
+        shipper = binlog.BinlogShipper(self.server, self.bucket)
+        shipper.ship()
+        self.list_binlogs.return_value.append(("mysql-bin.000004", 10))
+        shipped = shipper.ship()
+        self.assertEqual(["mysql-bin.000003"], [e["name"] for e in shipped])
+        self.assertEqual(3, len(binlog.read_index(self.bucket,
+                                                  "localhost:3306")))
+
+    def test_ship_keeps_the_logs_of_each_server_apart(self):
+        other = Connection(hostname="10.0.0.2", username="root")
+        binlog.BinlogShipper(self.server, self.bucket).ship()
+        binlog.BinlogShipper(other, self.bucket).ship()
+        self.assertIn("binlog/10.0.0.2:3306/mysql-bin.000001.gz",
+                      self.bucket.keys)
+        self.assertEqual(2, len(binlog.read_index(self.bucket,
+                                                  "localhost:3306")))
+        self.assertEqual(2, len(binlog.read_index(self.bucket,
+                                                  "10.0.0.2:3306")))
+
+    def test_ship_carries_on_the_index_shipped_before_servers(self):
+        self.bucket.new_key(binlog.LEGACY_INDEX_KEY).set_contents_from_string(
+            '[{"name": "mysql-bin.000001", "started_at": 100}]')
+        shipped = binlog.BinlogShipper(self.server, self.bucket).ship()
+        self.assertEqual(["mysql-bin.000002"], [e["name"] for e in shipped])
+        self.assertEqual([], binlog.read_index(self.bucket, "10.0.0.2:3306"))
+
+    def test_ship_can_rotate_the_binlog_first(self):
+        m = "mysqlapi.api.backup.binlog.flush_binlogs"
+        with mock.patch(m) as flush_binlogs:
+            binlog.BinlogShipper(self.server, self.bucket, flush=True).ship()
+        flush_binlogs.assert_called_with(self.server)
+
+    def test_follow_ships_until_closed(self):
+        shipper = binlog.BinlogShipper(self.server, self.bucket)
+        calls = []
+
+        def ship():
+            calls.append(1)
+            shipper.close()
+        shipper.ship = ship
+        shipper.follow(0)
+        self.assertEqual(1, len(calls))
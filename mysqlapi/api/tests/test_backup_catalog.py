@@ -0,0 +1,144 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+
+from django.test import TestCase
+from django.utils import timezone
+
+from mysqlapi.api.backup import catalog
+from mysqlapi.api.backup.manifest import Manifest
+from mysqlapi.api.management.commands import s3
+from mysqlapi.api.models import Backup, BackupDatabase
+from mysqlapi.api.tests import mocks
+
+DAY = 24 * 60 * 60
+NOW = 1430000000
+
+
+def make_manifest(backup_id, started_at, databases=("app1",),
+                  server="db1:3306"):
+    manifest = Manifest(backup_id, server, started_at=started_at)
+    for name in databases:
+        manifest.add(database=name, key="%s/%s.sql" % (backup_id, name),
+                     size=10, stored_size=4, sha256="ab")
+    manifest.finished_at = started_at + 60
+    return manifest
+
+
+class CatalogTestCase(TestCase):
+
+    def test_record(self):
+        backup = catalog.record(make_manifest("b1", NOW, ("app1", "app2")))
+        self.assertEqual("db1:3306", backup.server)
+        self.assertEqual(catalog.to_datetime(NOW), backup.started_at)
+        self.assertEqual(20, backup.size)
+        self.assertEqual(8, backup.stored_size)
+        names = [d.name for d in backup.databases.order_by("name")]
+        self.assertEqual(["app1", "app2"], names)
+        db = BackupDatabase.objects.get(backup=backup, name="app1")
+        self.assertEqual(1, db.object_count)
+        self.assertEqual(64, len(db.sha256))
+
+    def test_record_twice_replaces_the_backup(self):
+        catalog.record(make_manifest("b1", NOW, ("app1", "app2")))
+        catalog.record(make_manifest("b1", NOW, ("app1",)))
+        self.assertEqual(1, Backup.objects.count())
+        self.assertEqual(1, BackupDatabase.objects.count())
+
+    def test_latest(self):
+        catalog.record(make_manifest("b1", NOW - 2 * DAY))
+        catalog.record(make_manifest("b2", NOW - DAY, ("app2",)))
+        catalog.record(make_manifest("b3", NOW))
+        self.assertEqual("b3", catalog.latest().backup_id)
+        self.assertEqual("b2", catalog.latest(
+            before=catalog.to_datetime(NOW - 60)).backup_id)
+        self.assertEqual("b1", catalog.latest(
+            database="app1",
+            before=catalog.to_datetime(NOW - 60)).backup_id)
+        self.assertEqual(None, catalog.latest(
+            database="app2", before=catalog.to_datetime(NOW - 2 * DAY)))
+        self.assertEqual(None, catalog.latest(server="db2:3306"))
+
+    def test_latest_holding_several_databases(self):
+        catalog.record(make_manifest("b1", NOW - DAY, ("app1", "app2")))
+        catalog.record(make_manifest("b2", NOW, ("app1",)))
+        catalog.record(make_manifest("b3", NOW, ("app1", "app2"),
+                                     server="db2:3306"))
+        self.assertEqual("b1", catalog.latest(
+            databases=["app1", "app2"], server="db1:3306").backup_id)
+        self.assertEqual("b2", catalog.latest(
+            databases=["app1"], server="db1:3306").backup_id)
+
+    def test_latest_skips_unfinished_backups(self):
+        manifest = make_manifest("b1", NOW)
+        manifest.finished_at = None
+        catalog.record(manifest)
+        self.assertEqual(None, catalog.latest(database="app1"))
+
+    def test_expired_keeps_the_latest_backups(self):
+        for n in xrange(5):
+            catalog.record(make_manifest("b%d" % n, NOW - n * DAY))
+        catalog.record(make_manifest("other", NOW - 10 * DAY,
+                                     server="db2:3306"))
+        now = catalog.to_datetime(NOW)
+        expired = catalog.expired(days=2, keep=1, now=now)
+        self.assertEqual(["b4", "b3"], [b.backup_id for b in expired])
+        expired = catalog.expired(days=2, keep=4, now=now)
+        self.assertEqual(["b4"], [b.backup_id for b in expired])
+
+    def test_prune_deletes_objects_and_rows(self):
+        bucket = mocks.FakeBucket()
+        old = make_manifest("old", NOW - 10 * DAY)
+        old.add(database="app1", key="chunked", size=1, chunks=["ab"])
+        for manifest in (old, make_manifest("new", NOW)):
+            bucket.new_key("%s/app1.sql" % manifest.id) \
+                .set_contents_from_string("data")
+            s3.store_manifest(bucket, manifest)
+            catalog.record(manifest)
+        days = (timezone.now() - catalog.to_datetime(NOW)).days + 5
+        pruned = catalog.prune(bucket, days=days, keep=1)
+        self.assertEqual(["old"], [b.backup_id for b in pruned])
+        self.assertEqual(["lastkey", "new/app1.sql", "new/manifest.json"],
+                         sorted(bucket.keys))
+        self.assertEqual(["new"], [b.backup_id
+                                   for b in Backup.objects.all()])
+
+    def test_prune_keeps_objects_reused_by_later_backups(self):
+        bucket = mocks.FakeBucket()
+        old = make_manifest("old", NOW - 10 * DAY)
+        new = make_manifest("new", NOW, databases=())
+        new.add(database="app1", key="old/app1.sql", size=10,
+                reused_from="old")
+        for manifest in (old, new):
+            s3.store_manifest(bucket, manifest)
+            catalog.record(manifest)
+        bucket.new_key("old/app1.sql").set_contents_from_string("data")
+        days = (timezone.now() - catalog.to_datetime(NOW)).days + 5
+        catalog.prune(bucket, days=days, keep=1)
+        self.assertIn("old/app1.sql", bucket.keys)
+        self.assertNotIn("old/manifest.json", bucket.keys)
+        self.assertEqual(0, Backup.objects.get(backup_id="new").stored_size)
+
+    def test_prune_dry_run(self):
+        catalog.record(make_manifest("old", NOW - 100 * DAY))
+        catalog.record(make_manifest("new", NOW))
+        pruned = catalog.prune(mocks.FakeBucket(), days=1, keep=1,
+                               dry_run=True)
+        self.assertEqual(["old"], [b.backup_id for b in pruned])
+        self.assertEqual(2, Backup.objects.count())
+
+    def test_sync_records_unknown_backups(self):
+        bucket = mocks.FakeBucket()
+        catalog.record(make_manifest("b1", NOW - DAY))
+        s3.store_manifest(bucket, make_manifest("b1", NOW - DAY))
+        s3.store_manifest(bucket, make_manifest("b2", NOW))
+        added = catalog.sync(bucket)
+        self.assertEqual(["b2"], [b.backup_id for b in added])
+        self.assertEqual(2, Backup.objects.count())
+
+    def test_to_datetime(self):
+        self.assertEqual(datetime.datetime(2015, 4, 25, 22, 13, 20,
+                                           tzinfo=timezone.utc),
+                         catalog.to_datetime(NOW))
@@ -0,0 +1,171 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from unittest import TestCase
+
+from mysqlapi.api.backup import chunked
+from mysqlapi.api.database import Connection
+from mysqlapi.api.tests import mocks
+
+import mock
+
+
+def fake_connection(rows=()):
+    conn = mock.Mock()
+    conn.literal.side_effect = lambda v: "NULL" if v is None else repr(v)
+    conn.cursor.return_value.__iter__ = lambda self: iter(rows)
+    return conn
+
+
+class SplitTestCase(TestCase):
+
+    def test_small_table_is_a_single_chunk(self):
+        chunks = chunked.split("t", "id", 1, 100, 100, 1000)
+        self.assertEqual(1, len(chunks))
+        self.assertIsNone(chunks[0].column)
+
+    def test_table_without_primary_key_is_a_single_chunk(self):
+        chunks = chunked.split("t", None, None, None, 5000, 1000)
+        self.assertEqual(1, len(chunks))
+
+    def test_large_table_is_split_in_ranges(self):
+        chunks = chunked.split("t", "id", 1, 100, 4000, 1000)
+        ranges = [(c.lower, c.upper, c.last) for c in chunks]
+        expected = [(1, 26, False), (26, 51, False), (51, 76, False),
+                    (76, 100, True)]
+        self.assertEqual(expected, ranges)
+
+    def test_query(self):
+        chunk = chunked.Chunk("t", "id", 1, 26, last=False)
+        sql, args = chunk.query("db")
+        self.assertEqual("SELECT * FROM `db`.`t` WHERE `id` >= %s AND "
+                         "`id` < %s", sql)
+        self.assertEqual((1, 26), args)
+
+    def test_query_last_chunk_includes_upper_bound(self):
+        sql, args = chunked.Chunk("t", "id", 76, 100).query("db")
+        self.assertIn("`id` <= %s", sql)
+
+    def test_query_whole_table(self):
+        self.assertEqual(("SELECT * FROM `db`.`t`", ()),
+                         chunked.Chunk("t").query("db"))
+
+    def test_quote_name(self):
+        self.assertEqual("`we``ird`", chunked.quote_name("we`ird"))
+
+
+class InsertsTestCase(TestCase):
+
+    def test_inserts(self):
+        conn = fake_connection([(1, "a"), (2, None)])
+        data = "".join(chunked.inserts(conn, "db", chunked.Chunk("t")))
+        expected = chunked.HEADER + \
+            "INSERT INTO `t` VALUES (1,'a'),(2,NULL);\n"
+        self.assertEqual(expected, data)
+
+    def test_inserts_are_batched(self):
+        conn = fake_connection([(1,), (2,), (3,)])
+        with mock.patch("mysqlapi.api.backup.chunked.STATEMENT_SIZE", 6):
+            data = "".join(chunked.inserts(conn, "db", chunked.Chunk("t")))
+        self.assertEqual(2, data.count("INSERT INTO"))
+
+
+class PlanTestCase(TestCase):
+
+    def test_plan(self):
+        conn = mock.Mock()
+        m = "mysqlapi.api.backup.chunked"
+        with mock.patch(m + ".tables") as tables:
+            tables.return_value = [("big", "BASE TABLE", 3000),
+                                   ("small", "BASE TABLE", 10),
+                                   ("v", "VIEW", None)]
+            with mock.patch(m + ".primary_key") as primary_key:
+                primary_key.return_value = "id"
+                conn.cursor.return_value.fetchone.return_value = (1, 3000)
+                chunks = chunked.plan(conn, "db", 1000)
+        self.assertEqual(["big", "big", "big", "small"],
+                         [c.table for c in chunks])
+
+
+class ChunkedDumpTestCase(TestCase):
+
+    def test_run(self):
+        bucket = mocks.FakeBucket()
+        server = Connection(hostname="localhost", username="root")
+        job = chunked.ChunkedDump(server, "db", bucket, "abc123",
+                                  workers=2, chunk_rows=1000)
+        m = "mysqlapi.api.backup.chunked"
+        with mock.patch(m + ".Snapshot") as Snapshot:
+            snapshot = Snapshot.return_value
+            snapshot.connections = [fake_connection([(1,)]),
+                                    fake_connection([(1,)])]
+            snapshot.binlog = {"file": "mysql-bin.000001", "position": 4}
+            with mock.patch(m + ".plan") as plan:
+                plan.return_value = [chunked.Chunk("t", "id", 1, 10, False),
+                                     chunked.Chunk("t", "id", 10, 20)]
+                with mock.patch.object(job, "_schema"):
+                    with mock.patch.object(job, "_objects"):
+                        entries = job.run()
+        snapshot.open.assert_called_with()
+        snapshot.close.assert_called_with()
+        keys = sorted(e["key"] for e in entries)
+        self.assertEqual(["abc123/db/t.00001.sql", "abc123/db/t.00002.sql"],
+                         keys)
+        self.assertEqual(snapshot.binlog, job.binlog)
+        self.assertIn("INSERT INTO `t` VALUES (1);",
+                      bucket.keys["abc123/db/t.00001.sql"].data)
+
+    def test_run_reuses_unchanged_tables(self):
+        bucket = mocks.FakeBucket()
+        server = Connection(hostname="localhost", username="root")
+        reused = [{"database": "db", "kind": "chunk", "table": "old",
+                   "key": "prev/db/old.00001.sql", "size": 1,
+                   "reused_from": "prev"}]
+        job = chunked.ChunkedDump(server, "db", bucket, "abc123",
+                                  workers=1, chunk_rows=1000,
+                                  reuse={"old": reused})
+        m = "mysqlapi.api.backup.chunked"
+        with mock.patch(m + ".Snapshot") as Snapshot:
+            Snapshot.return_value.connections = [fake_connection([(1,)])]
+            with mock.patch(m + ".plan") as plan:
+                plan.return_value = [chunked.Chunk("old"),
+                                     chunked.Chunk("new")]
+                with mock.patch.object(job, "_schema"):
+                    with mock.patch.object(job, "_objects"):
+                        entries = job.run()
+        keys = sorted(e["key"] for e in entries)
+        self.assertEqual(["abc123/db/new.00001.sql",
+                          "prev/db/old.00001.sql"], keys)
+        self.assertNotIn("abc123/db/old.00001.sql", bucket.keys)
+
+    def test_run_dumps_tables_written_to_before_the_snapshot(self):
+        bucket = mocks.FakeBucket()
+        server = Connection(hostname="localhost", username="root")
+        reuse = {}
+        for table in ("old", "written"):
+            reuse[table] = [{"database": "db", "kind": "chunk",
+                             "table": table, "size": 1,
+                             "key": "prev/db/%s.00001.sql" % table,
+                             "reused_from": "prev"}]
+        m = "mysqlapi.api.backup.chunked"
+        with mock.patch(m + ".Snapshot") as Snapshot:
+            Snapshot.return_value.connections = [fake_connection([(1,)])]
+
+            def unchanged():
+                # fingerprinted again once the snapshot is open.
+                self.assertTrue(Snapshot.return_value.open.called)
+                return set(["old"])
+
+            job = chunked.ChunkedDump(server, "db", bucket, "abc123",
+                                      workers=1, chunk_rows=1000,
+                                      reuse=reuse, unchanged=unchanged)
+            with mock.patch(m + ".plan") as plan:
+                plan.return_value = [chunked.Chunk("old"),
+                                     chunked.Chunk("written")]
+                with mock.patch.object(job, "_schema"):
+                    with mock.patch.object(job, "_objects"):
+                        entries = job.run()
+        keys = sorted(e["key"] for e in entries)
+        self.assertEqual(["abc123/db/written.00001.sql",
+                          "prev/db/old.00001.sql"], keys)
@@ -0,0 +1,143 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import hashlib
+import random
+
+from unittest import TestCase
+from django.test.utils import override_settings
+
+from mysqlapi.api.backup import dedup
+from mysqlapi.api.backup.manifest import Manifest
+from mysqlapi.api.backup.restore import read_entry
+from mysqlapi.api.management.commands import s3
+from mysqlapi.api.tests import mocks
+
+
+def fake_dump(rows, seed=0):
+    rnd = random.Random(seed)
+    values = ["(%d,'%s')" % (i, "x" * rnd.randint(10, 200))
+              for i in xrange(rows)]
+    lines = []
+    for i in xrange(0, rows, 50):
+        lines.append("INSERT INTO `t` VALUES %s;\n" % ",".join(
+            values[i:i + 50]))
+    return "".join(lines)
+
+
+def pieces(data, size):
+    return [data[i:i + size] for i in xrange(0, len(data), size)]
+
+
+class ContentChunkerTestCase(TestCase):
+
+    def setUp(self):
+        self.chunker = dedup.ContentChunker(avg_size=4096)
+        self.data = fake_dump(3000)
+
+    def test_split_keeps_the_content(self):
+        chunks = list(self.chunker.split(pieces(self.data, 1000)))
+        self.assertEqual(self.data, "".join(chunks))
+        self.assertTrue(len(chunks) > 10)
+
+    def test_split_respects_the_size_bounds(self):
+        chunks = list(self.chunker.split(pieces(self.data, 1000)))
+        for chunk in chunks[:-1]:
+            self.assertTrue(1024 <= len(chunk) <= 16384, len(chunk))
+
+    def test_split_does_not_depend_on_the_read_size(self):
+        a = list(self.chunker.split(pieces(self.data, 1000)))
+        b = list(self.chunker.split(pieces(self.data, 7777)))
+        self.assertEqual(a, b)
+
+    def test_split_survives_insertions(self):
+        before = set(self.chunker.split([self.data]))
+        middle = len(self.data) // 2
+        changed = self.data[:middle] + "),(9999,'new'" + self.data[middle:]
+        after = set(self.chunker.split([changed]))
+        self.assertTrue(len(before & after) >= len(before) - 3)
+
+    def test_split_cuts_data_without_separators(self):
+        chunks = list(self.chunker.split(["a" * 40000]))
+        self.assertEqual([16384, 16384, 7232], [len(c) for c in chunks])
+
+
+class ChunkStoreTestCase(TestCase):
+
+    def setUp(self):
+        self.bucket = mocks.FakeBucket()
+
+    def test_put_uploads_new_chunks_only(self):
+        store = dedup.ChunkStore(self.bucket, concurrency=2)
+        digests = store.put(["aaa", "bbb", "aaa"])
+        self.assertEqual([hashlib.sha256(c).hexdigest()
+                          for c in ("aaa", "bbb", "aaa")], digests)
+        self.assertEqual(2, store.new_chunks)
+        store = dedup.ChunkStore(self.bucket, concurrency=2)
+        store.put(["aaa", "ccc"])
+        self.assertEqual(1, store.new_chunks)
+        self.assertEqual(1, store.reused_chunks)
+        self.assertEqual(3, len(self.bucket.keys))
+
+    def test_read_returns_the_content(self):
+        digests = dedup.ChunkStore(self.bucket, concurrency=1).put(["a", "b"])
+        self.assertEqual("ab", "".join(dedup.read(self.bucket, digests)))
+
+    def test_read_detects_missing_chunks(self):
+        with self.assertRaises(KeyError):
+            list(dedup.read(self.bucket, ["0" * 64]))
+
+    @override_settings(BACKUP_DEDUP=True, BACKUP_DEDUP_CHUNK_SIZE=4096)
+    def test_store_returns_the_chunks(self):
+        data = fake_dump(1000)
+        entry = dedup.store(self.bucket, "abc/app1.sql", pieces(data, 1000))
+        self.assertNotIn("abc/app1.sql", self.bucket.keys)
+        self.assertTrue(len(entry["chunks"]) > 1)
+        entry.update(key="abc/app1.sql", size=len(data),
+                     sha256=hashlib.sha256(data).hexdigest())
+        self.assertEqual(data, "".join(read_entry(self.bucket, entry)))
+        again = dedup.store(self.bucket, "def/app1.sql", [data])
+        self.assertEqual(entry["chunks"], again["chunks"])
+        self.assertEqual(0, again["stored_size"])
+
+    @override_settings(BACKUP_DEDUP=False)
+    def test_store_without_dedup_uploads_an_object(self):
+        entry = dedup.store(self.bucket, "abc/app1.sql", ["data"])
+        self.assertEqual({"stored_size": 4}, entry)
+        self.assertEqual("data", self.bucket.keys["abc/app1.sql"].data)
+
+
+class CollectTestCase(TestCase):
+
+    def setUp(self):
+        self.bucket = mocks.FakeBucket()
+        store = dedup.ChunkStore(self.bucket, concurrency=1)
+        self.kept, self.garbage = store.put(["kept", "garbage"])
+        manifest = Manifest("abc123", "localhost:3306")
+        manifest.add(database="app1", key="abc123/app1.sql", size=4,
+                     chunks=[self.kept])
+        s3.store_manifest(self.bucket, manifest)
+        for key in self.bucket.list(dedup.CHUNK_PREFIX):
+            key.last_modified = "2015-01-01T00:00:00.000Z"
+
+    def test_collect_deletes_unreferenced_chunks(self):
+        deleted = dedup.collect(self.bucket, grace=3600)
+        self.assertEqual([dedup.chunk_key(self.garbage)], deleted)
+        self.assertNotIn(dedup.chunk_key(self.garbage), self.bucket.keys)
+        self.assertIn(dedup.chunk_key(self.kept), self.bucket.keys)
+
+    def test_collect_keeps_recent_chunks(self):
+        dedup.ChunkStore(self.bucket, concurrency=1).put(["fresh"])
+        deleted = dedup.collect(self.bucket, grace=3600)
+        self.assertEqual([dedup.chunk_key(self.garbage)], deleted)
+
+    def test_collect_keeps_old_chunks_reused_by_a_running_backup(self):
+        dedup.ChunkStore(self.bucket, concurrency=1).put(["garbage"])
+        self.assertEqual([], dedup.collect(self.bucket, grace=3600))
+        self.assertIn(dedup.chunk_key(self.garbage), self.bucket.keys)
+
+    def test_collect_dry_run(self):
+        deleted = dedup.collect(self.bucket, grace=3600, dry_run=True)
+        self.assertEqual(1, len(deleted))
+        self.assertIn(dedup.chunk_key(self.garbage), self.bucket.keys)
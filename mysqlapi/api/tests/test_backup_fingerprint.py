@@ -0,0 +1,208 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import threading
+
+from unittest import TestCase
+from django.test.utils import override_settings
+
+from mysqlapi.api.backup import fingerprint
+from mysqlapi.api.backup.manifest import Manifest
+from mysqlapi.api.backup.runner import BackupRunner
+from mysqlapi.api.database import Connection
+from mysqlapi.api.tests import mocks
+
+import mock
+import MySQLdb
+
+
+class FakeCursor(object):
+    """
+    Answers queries with the rows of the first matching fragment.
+    """
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.queries = []
+        self._rows = []
+
+    def execute(self, query, args=None):
+        self.queries.append(query)
+        self._rows = []
+        for fragment, rows in self.answers:
+            if fragment in query:
+                self._rows = rows
+                break
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0]
+
+
+class FingerprintTestCase(TestCase):
+
+    def test_status(self):
+        cursor = FakeCursor([("TABLES", [("t1", "c", "u", 10, 100, 0),
+                                         ("t2", "c", None, 10, 100, None),
+                                         ("t3", "c", "u", 10, 100, 1)])])
+        result = fingerprint.status(cursor, "db")
+        self.assertEqual({"t1": "c/u/10/100", "t2": None, "t3": None},
+                         result)
+        self.assertIn("information_schema_stats_expiry = 0",
+                      cursor.queries[0])
+
+    def test_status_on_servers_without_statistics_expiry(self):
+        cursor = FakeCursor([("TABLES", [("t1", "c", "u", 10, 100, 0)])])
+        execute = cursor.execute
+
+        def unknown_variable(query, args=None):
+            if query.startswith("SET"):
+                raise MySQLdb.OperationalError(1193, "Unknown variable")
+            execute(query, args)
+        cursor.execute = unknown_variable
+        self.assertEqual({"t1": "c/u/10/100"},
+                         fingerprint.status(cursor, "db"))
+
+    def test_checksum(self):
+        cursor = FakeCursor([("CHECKSUM TABLE `db`.`t1`", [("db.t1", 42)]),
+                             ("CHECKSUM TABLE", [("db.t2", None)]),
+                             ("TABLES", [("t1",), ("t2",)])])
+        self.assertEqual({"t1": "42", "t2": None},
+                         fingerprint.checksum(cursor, "db"))
+
+    def test_take_includes_the_table_definition(self):
+        server = mock.Mock()
+        cursor = FakeCursor([
+            ("SHOW CREATE", [("t1", "CREATE TABLE `t1` (...) "
+                                    "AUTO_INCREMENT=12")]),
+            ("information_schema.TABLES", [("t1", "c", "u", 10, 100, 0)])])
+        server.cursor.return_value = cursor
+        first = fingerprint.take(server, "db", "status")
+        self.assertTrue(first["t1"].startswith("status:c/u/10/100:"))
+        self.assertIn(fingerprint.OBJECTS, first)
+        server.close.assert_called_with()
+        cursor.answers[0] = ("SHOW CREATE", [("t1", "CREATE TABLE `t1` (...) "
+                                                    "AUTO_INCREMENT=99")])
+        self.assertEqual(first, fingerprint.take(server, "db", "status"))
+        cursor.answers[0] = ("SHOW CREATE", [("t1", "CREATE TABLE `t1` (x)")])
+        self.assertNotEqual(first, fingerprint.take(server, "db", "status"))
+
+    def test_unchanged_tables(self):
+        old = {"t1": "a", "t2": "b", "t3": None, "": "o"}
+        new = {"t1": "a", "t2": "c", "t3": None, "t4": "d", "": "o"}
+        self.assertEqual(set(["t1"]), fingerprint.unchanged_tables(old, new))
+        self.assertEqual(set(), fingerprint.unchanged_tables(None, new))
+
+    def test_unchanged(self):
+        old = {"t1": "a", "": "o"}
+        self.assertTrue(fingerprint.unchanged(old, dict(old)))
+        self.assertFalse(fingerprint.unchanged(old, {"t1": "a", "": "p"}))
+        self.assertFalse(fingerprint.unchanged(old, {"t1": "a", "t2": "b",
+                                                     "": "o"}))
+        self.assertFalse(fingerprint.unchanged({"t1": None, "": "o"},
+                                               {"t1": None, "": "o"}))
+        self.assertFalse(fingerprint.unchanged(None, old))
+
+
+class SkipUnchangedTestCase(TestCase):
+
+    def setUp(self):
+        override = override_settings(BACKUP_CHUNK_THRESHOLD=0,
+                                     BACKUP_FINGERPRINT="status")
+        override.enable()
+        self.addCleanup(override.disable)
+        self.bucket = mocks.FakeBucket()
+        self.server = Connection(hostname="localhost", username="root")
+        self.fingerprints = {"t1": "a", "": "o"}
+        for target, attr in (("mysqlapi.api.backup.dump.dump", "dump"),
+                             ("mysqlapi.api.backup.catalog.record", None),
+                             ("mysqlapi.api.backup.fingerprint.take",
+                              "take")):
+            patcher = mock.patch(target)
+            value = patcher.start()
+            self.addCleanup(patcher.stop)
+            if attr:
+                setattr(self, attr, value)
+        self.dump.side_effect = lambda server, db: iter(["-- %s\n" % db])
+        self.take.side_effect = lambda server, db: dict(self.fingerprints)
+        self.previous = Manifest("prev", "localhost:3306")
+        self.previous.add(database="app1", kind="database",
+                          key="prev/app1.sql", size=8, sha256="ab")
+        self.previous.metadata = {
+            "fingerprints": {"app1": dict(self.fingerprints)},
+            "snapshots": {"app1": {"file": "mysql-bin.000001",
+                                   "position": 4}}}
+        patcher = mock.patch.object(BackupRunner, "previous")
+        patcher.start().return_value = self.previous
+        self.addCleanup(patcher.stop)
+
+    def test_unchanged_database_reuses_the_previous_backup(self):
+        manifest = BackupRunner(self.server, self.bucket,
+                                backup_id="abc123").run(["app1"])
+        self.assertFalse(self.dump.called)
+        entry = manifest.entries[0]
+        self.assertEqual("prev/app1.sql", entry["key"])
+        self.assertEqual("prev", entry["reused_from"])
+        self.assertEqual(self.previous.metadata["snapshots"],
+                         manifest.metadata["snapshots"])
+        self.assertEqual({"app1": self.fingerprints},
+                         manifest.metadata["fingerprints"])
+
+    def test_workers_fingerprint_concurrently(self):
+        servers = []
+        waited = []
+        both = threading.Event()
+
+        def take(server, db):
+            servers.append(server)
+            if len(servers) == 2:
+                both.set()
+            waited.append(both.wait(5))
+            return dict(self.fingerprints)
+
+        self.take.side_effect = take
+        BackupRunner(self.server, self.bucket, workers=2).run(["app1",
+                                                               "app2"])
+        self.assertEqual([True, True], waited)
+        self.assertIsNot(servers[0], servers[1])
+        self.assertNotIn(self.server, servers)
+
+    def test_changed_database_is_dumped(self):
+        self.fingerprints["t1"] = "b"
+        manifest = BackupRunner(self.server, self.bucket,
+                                backup_id="abc123").run(["app1"])
+        self.assertEqual("abc123/app1.sql", manifest.entries[0]["key"])
+        self.assertNotIn("reused_from", manifest.entries[0])
+
+    def test_previously_failed_database_is_dumped(self):
+        self.previous.errors = {"app1": "failed"}
+        manifest = BackupRunner(self.server, self.bucket,
+                                backup_id="abc123").run(["app1"])
+        self.assertEqual("abc123/app1.sql", manifest.entries[0]["key"])
+
+    def test_large_database_reuses_unchanged_tables(self):
+        self.fingerprints["t2"] = "new"
+        self.previous.metadata["fingerprints"]["app1"]["t2"] = "old"
+        self.previous.entries = [
+            {"database": "app1", "kind": "chunk", "table": "t1",
+             "key": "prev/app1/t1.00001.sql", "size": 1},
+            {"database": "app1", "kind": "chunk", "table": "t2",
+             "key": "prev/app1/t2.00001.sql", "size": 1}]
+        m = "mysqlapi.api.backup.chunked.ChunkedDump"
+        with mock.patch(m) as ChunkedDump:
+            ChunkedDump.return_value.run.return_value = []
+            ChunkedDump.return_value.binlog = None
+            with override_settings(BACKUP_CHUNK_THRESHOLD=1):
+                with mock.patch("mysqlapi.api.backup.dump.database_size") \
+                        as database_size:
+                    database_size.return_value = 10
+                    BackupRunner(self.server, self.bucket).run(["app1"])
+        reuse = ChunkedDump.call_args[1]["reuse"]
+        self.assertEqual(["t1"], reuse.keys())
+        self.assertEqual("prev", reuse["t1"][0]["reused_from"])
+        # a write to t1 lands between the fingerprints and the snapshot.
+        self.fingerprints["t1"] = "b"
+        self.assertEqual(set(), ChunkedDump.call_args[1]["unchanged"]())
@@ -0,0 +1,168 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import hashlib
+
+from StringIO import StringIO
+from unittest import TestCase
+
+from mysqlapi.api.backup import loader
+from mysqlapi.api.backup.manifest import Manifest
+from mysqlapi.api.backup.restore import Restorer
+from mysqlapi.api.database import Connection
+from mysqlapi.api.tests import mocks
+
+import mock
+
+CREATE = """CREATE TABLE `t` (
+  `id` int(11) NOT NULL,
+  `name` varchar(20) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `name_idx` (`name`),
+  UNIQUE KEY `name_uniq` (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8"""
+
+
+class StatementsTestCase(TestCase):
+
+    def test_statements_joins_lines_across_chunks(self):
+        chunks = ["INSERT INTO t VALUES (1);\nINSERT INTO", " t VALUES (2);\n"]
+        self.assertEqual(["INSERT INTO t VALUES (1);",
+                          "INSERT INTO t VALUES (2);"],
+                         list(loader.statements(chunks)))
+
+    def test_statements_without_trailing_newline(self):
+        self.assertEqual(["a;", "b;"], list(loader.statements(["a;\nb;"])))
+
+
+class SplitIndexesTestCase(TestCase):
+
+    def test_split_indexes(self):
+        ddl, indexes = loader.split_indexes(CREATE)
+        self.assertEqual(["KEY `name_idx` (`name`)",
+                          "UNIQUE KEY `name_uniq` (`name`)"], indexes)
+        self.assertIn("  PRIMARY KEY (`id`)\n)", ddl)
+        self.assertNotIn("KEY `name_idx`", ddl)
+
+    def test_split_indexes_keeps_tables_with_foreign_keys(self):
+        ddl = CREATE.replace(
+            "  UNIQUE KEY `name_uniq` (`name`)",
+            "  CONSTRAINT `fk` FOREIGN KEY (`id`) REFERENCES `u` (`id`)")
+        self.assertEqual((ddl, []), loader.split_indexes(ddl))
+
+    def test_split_indexes_keeps_an_index_on_the_auto_increment_column(self):
+        ddl = """CREATE TABLE `t` (
+  `id` int(11) NOT NULL,
+  `seq` int(11) NOT NULL AUTO_INCREMENT,
+  `name` varchar(20) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `name_idx` (`name`),
+  KEY `seq_idx` (`seq`,`id`),
+  UNIQUE KEY `seq_uniq` (`seq`)
+) ENGINE=InnoDB AUTO_INCREMENT=10 DEFAULT CHARSET=utf8"""
+        ddl, indexes = loader.split_indexes(ddl)
+        self.assertEqual(["KEY `name_idx` (`name`)",
+                          "UNIQUE KEY `seq_uniq` (`seq`)"], indexes)
+        self.assertIn("  KEY `seq_idx` (`seq`,`id`)\n)", ddl)
+
+    def test_split_indexes_auto_increment_primary_key(self):
+        ddl = CREATE.replace("`id` int(11) NOT NULL,",
+                             "`id` int(11) NOT NULL AUTO_INCREMENT,")
+        self.assertEqual(2, len(loader.split_indexes(ddl)[1]))
+
+    def test_split_indexes_without_indexes(self):
+        ddl = "CREATE TABLE `t` (\n  `id` int(11)\n)"
+        self.assertEqual((ddl, []), loader.split_indexes(ddl))
+
+
+class ParallelLoaderTestCase(TestCase):
+
+    def setUp(self):
+        self.bucket = mocks.FakeBucket()
+        self.server = Connection(hostname="localhost", username="root")
+        self.manifest = Manifest("abc123", "localhost:3306")
+        self.executed = []
+        conn = mock.Mock()
+        conn.cursor.return_value.execute.side_effect = self.executed.append
+        patcher = mock.patch("mysqlapi.api.database.connect")
+        self.connect = patcher.start()
+        self.connect.return_value = conn
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("mysqlapi.api.backup.restore.CommandSink")
+        self.sink = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.out = StringIO()
+        self.restorer = Restorer(self.server, self.bucket, self.manifest,
+                                 out=self.out, threads=2)
+
+    def store(self, key, data, **entry):
+        self.bucket.new_key(key).set_contents_from_string(data)
+        self.manifest.add(database="app1", key=key, size=len(data),
+                          sha256=hashlib.sha256(data).hexdigest(), **entry)
+
+    def store_table(self):
+        self.store("abc123/app1/schema-create.sql",
+                   "CREATE DATABASE IF NOT EXISTS `app1`;\n", kind="database")
+        self.store("abc123/app1/t-schema.sql",
+                   "DROP TABLE IF EXISTS `t`;\n%s;\n" % CREATE,
+                   kind="schema", table="t")
+        self.store("abc123/app1/t.00001.sql",
+                   "INSERT INTO `t` VALUES (1,'a');\n", kind="chunk",
+                   table="t")
+        self.store("abc123/app1/t.00002.sql",
+                   "INSERT INTO `t` VALUES (2,'b');\n", kind="chunk",
+                   table="t")
+
+    def test_restore_uses_the_parallel_loader_for_chunks(self):
+        self.store_table()
+        self.restorer.restore()
+        self.assertIn("CREATE DATABASE IF NOT EXISTS `app1`;", self.executed)
+        self.assertIn("INSERT INTO `t` VALUES (1,'a');", self.executed)
+        self.assertIn("INSERT INTO `t` VALUES (2,'b');", self.executed)
+        self.assertFalse(self.sink.called)
+
+    def test_load_disables_checks(self):
+        self.store_table()
+        self.restorer.restore()
+        self.assertIn("SET SESSION unique_checks = 0", self.executed)
+        self.assertIn("SET SESSION foreign_key_checks = 0", self.executed)
+
+    def test_indexes_are_built_after_the_last_chunk(self):
+        self.store_table()
+        self.restorer.restore()
+        create = [s for s in self.executed if s.startswith("CREATE TABLE")]
+        self.assertNotIn("name_idx", create[0])
+        alter = ("ALTER TABLE `t` ADD KEY `name_idx` (`name`), "
+                 "ADD UNIQUE KEY `name_uniq` (`name`)")
+        self.assertIn(alter, self.executed)
+        inserts = [i for i, s in enumerate(self.executed)
+                   if s.startswith("INSERT")]
+        self.assertTrue(max(inserts) < self.executed.index(alter))
+
+    def test_load_reports_table_throughput(self):
+        self.store_table()
+        self.restorer.restore()
+        self.assertIn("app1.t: 64 bytes in", self.out.getvalue())
+
+    def test_views_and_objects_go_through_the_mysql_client(self):
+        self.store_table()
+        self.store("abc123/app1/v-view.sql", "CREATE VIEW v;\n", kind="view",
+                   table="v")
+        written = []
+        self.sink.return_value.write.side_effect = written.append
+        self.restorer.restore()
+        self.assertEqual("USE `app1`;\nCREATE VIEW v;\n", "".join(written))
+
+    def test_load_errors_are_raised(self):
+        self.store_table()
+        self.bucket.keys["abc123/app1/t.00002.sql"].data = "tampered;\n"
+        with self.assertRaises(Exception):
+            self.restorer.restore()
+
+    def test_single_thread_streams_into_mysql(self):
+        self.store_table()
+        self.restorer.threads = 1
+        self.restorer.restore()
+        self.assertTrue(self.sink.called)
+        self.assertFalse(self.connect.called)
@@ -0,0 +1,177 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import hashlib
+import os
+import time
+
+from StringIO import StringIO
+from unittest import TestCase
+
+from mysqlapi.api import compression
+from mysqlapi.api.backup import binlog
+from mysqlapi.api.backup.manifest import Manifest
+from mysqlapi.api.backup.restore import Restorer, RestoreError
+from mysqlapi.api.database import Connection
+from mysqlapi.api.tests import mocks
+
+import mock
+
+
+class RestorerTestCase(TestCase):
+
+    def setUp(self):
+        self.bucket = mocks.FakeBucket()
+        self.server = Connection(hostname="localhost", username="root")
+        self.manifest = Manifest("abc123", "localhost:3306")
+        patcher = mock.patch("mysqlapi.api.backup.restore.CommandSink")
+        self.sink = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.written = []
+        self.sink.return_value.write.side_effect = self.written.append
+
+    def store(self, key, data, database="app1", codec=None, **entry):
+        stored = data
+        if codec:
+            compressor = compression.compressor(codec)
+            stored = compressor.compress(data) + compressor.flush()
+            entry["codec"] = codec
+        self.bucket.new_key(key).set_contents_from_string(stored)
+        self.manifest.add(database=database, key=key, size=len(data),
+                          sha256=hashlib.sha256(data).hexdigest(), **entry)
+
+    def test_restore_streams_the_dump_into_mysql(self):
+        self.store("abc123/app1.sql", "CREATE DATABASE app1;\n",
+                   kind="database")
+        Restorer(self.server, self.bucket, self.manifest).restore()
+        cmd = self.sink.call_args[0][0]
+        self.assertEqual(["mysql", "-h", "localhost", "-P", "3306",
+                          "-u", "root"], cmd)
+        self.assertEqual("CREATE DATABASE app1;\n", "".join(self.written))
+        self.sink.return_value.close.assert_called_with()
+
+    def test_restore_decompresses(self):
+        self.store("abc123/app1.sql.gz", "INSERT INTO t VALUES (1);\n",
+                   kind="database", codec="gzip")
+        Restorer(self.server, self.bucket, self.manifest).restore()
+        self.assertEqual("INSERT INTO t VALUES (1);\n", "".join(self.written))
+
+    def test_restore_chunked_layout_in_order(self):
+        self.store("abc123/app1/t.00001.sql", "chunk;\n", kind="chunk")
+        self.store("abc123/app1/t-schema.sql", "schema;\n", kind="schema")
+        self.store("abc123/app1/schema-create.sql", "create;\n",
+                   kind="database")
+        Restorer(self.server, self.bucket, self.manifest).restore()
+        self.assertEqual("create;\nUSE `app1`;\nschema;\nchunk;\n",
+                         "".join(self.written))
+
+    def test_restore_selected_databases(self):
+        self.store("abc123/app1.sql", "app1;\n", kind="database")
+        self.store("abc123/app2.sql", "app2;\n", database="app2",
+                   kind="database")
+        restored = Restorer(self.server, self.bucket,
+                            self.manifest).restore(["app2"])
+        self.assertEqual(["app2"], restored)
+        self.assertEqual("app2;\n", "".join(self.written))
+
+    def test_restore_unknown_database(self):
+        with self.assertRaises(RestoreError):
+            Restorer(self.server, self.bucket,
+                     self.manifest).restore(["nope"])
+
+    def test_restore_checks_the_checksum(self):
+        self.store("abc123/app1.sql", "app1;\n", kind="database")
+        self.bucket.keys["abc123/app1.sql"].data = "tampered;\n"
+        with self.assertRaises(RestoreError):
+            Restorer(self.server, self.bucket, self.manifest).restore()
+
+    def test_restore_reports_progress(self):
+        self.store("abc123/app1.sql", "app1;\n", kind="database")
+        out = StringIO()
+        Restorer(self.server, self.bucket, self.manifest, out=out).restore()
+        self.assertIn("app1: 100% (6/6 bytes", out.getvalue())
+
+
+class ReplayTestCase(TestCase):
+
+    def setUp(self):
+        self.bucket = mocks.FakeBucket()
+        self.server = Connection(hostname="localhost", username="root")
+        self.manifest = Manifest("abc123", "localhost:3306", started_at=100)
+        self.manifest.add(database="app1", kind="database",
+                          key="abc123/app1.sql", size=0)
+        self.bucket.new_key("abc123/app1.sql").set_contents_from_string("")
+        self.manifest.metadata["snapshots"] = {
+            "app1": {"file": "mysql-bin.000002", "position": 120}}
+        index = []
+        for n in (1, 2, 3):
+            name = "mysql-bin.00000%d" % n
+            data = "binlog %d" % n
+            self.bucket.new_key("binlog/" + name).set_contents_from_string(
+                data)
+            index.append({"name": name, "key": "binlog/" + name,
+                          "size": len(data), "started_at": n * 100,
+                          "sha256": hashlib.sha256(data).hexdigest()})
+        binlog.store_index(self.bucket, "localhost:3306", index)
+        patcher = mock.patch("mysqlapi.api.backup.restore.CommandSink")
+        self.sink = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("mysqlapi.api.backup.restore.CommandStream")
+        self.stream = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.files = {}
+
+        def events(cmd):
+            for path in cmd[3:]:
+                if not path.startswith("--"):
+                    self.files[os.path.basename(path)] = open(path).read()
+            self.stream.return_value.__iter__.return_value = ["events"]
+            return self.stream.return_value
+        self.stream.side_effect = events
+
+    def test_restore_replays_binlogs_up_to_the_target_time(self):
+        until = 250
+        Restorer(self.server, self.bucket, self.manifest,
+                 until=until).restore()
+        cmd = self.stream.call_args[0][0]
+        stop = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(until))
+        self.assertEqual(["mysqlbinlog", "--database=app1",
+                          "--start-position=120",
+                          "--stop-datetime=%s" % stop], cmd[:4])
+        self.assertEqual({"mysql-bin.000002": "binlog 2"}, self.files)
+        self.sink.return_value.write.assert_called_with("events")
+
+    def test_restore_fails_beyond_the_shipped_binlogs(self):
+        with self.assertRaises(RestoreError):
+            Restorer(self.server, self.bucket, self.manifest,
+                     until=350).restore()
+        self.assertFalse(self.stream.called)
+
+    def test_restore_replays_the_binlogs_of_the_backup_server(self):
+        self.manifest.server = "10.0.0.2:3306"
+        with self.assertRaises(RestoreError):
+            Restorer(self.server, self.bucket, self.manifest,
+                     until=250).restore()
+
+    def test_restore_without_target_time_does_not_replay(self):
+        Restorer(self.server, self.bucket, self.manifest).restore()
+        self.assertFalse(self.stream.called)
+
+    def test_restore_rejects_backups_after_the_target_time(self):
+        with self.assertRaises(RestoreError):
+            Restorer(self.server, self.bucket, self.manifest,
+                     until=50).restore()
+
+    def test_replay_requires_binlog_coordinates(self):
+        self.manifest.metadata = {}
+        with self.assertRaises(RestoreError):
+            Restorer(self.server, self.bucket, self.manifest,
+                     until=250).restore()
+
+    def test_replay_requires_the_snapshot_binlog(self):
+        self.manifest.metadata["snapshots"]["app1"]["file"] = \
+            "mysql-bin.000009"
+        with self.assertRaises(RestoreError):
+            Restorer(self.server, self.bucket, self.manifest,
+                     until=250).restore()
@@ -0,0 +1,163 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+import random
+
+import mock
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from mysqlapi.api.backup import scheduler
+from mysqlapi.api.backup.manifest import Manifest
+from mysqlapi.api.models import BackupSchedule, Instance
+from mysqlapi.api.tests import mocks
+
+NOW = datetime.datetime(2015, 4, 25, 12, 0, tzinfo=timezone.utc)
+
+
+@override_settings(BACKUP_WINDOW_START="02:00", BACKUP_WINDOW_HOURS=4,
+                   BACKUP_JITTER=0)
+class NextRunTestCase(TestCase):
+
+    def window(self, day):
+        start = day.replace(hour=2, minute=0)
+        return start, start + datetime.timedelta(hours=4)
+
+    def test_next_run_is_in_the_next_window(self):
+        at = scheduler.next_run("app1", NOW)
+        start, end = self.window(NOW + datetime.timedelta(days=1))
+        self.assertTrue(start <= at <= end)
+
+    def test_next_run_is_in_todays_window_when_it_is_still_ahead(self):
+        before = NOW.replace(hour=0)
+        at = scheduler.next_run("app1", before)
+        start, end = self.window(NOW)
+        self.assertTrue(start <= at <= end)
+        self.assertTrue(at > before)
+
+    def test_next_run_is_the_same_time_every_day(self):
+        first = scheduler.next_run("app1", NOW)
+        second = scheduler.next_run("app1", first)
+        self.assertEqual(datetime.timedelta(days=1), second - first)
+
+    def test_instances_are_spread_over_the_window(self):
+        runs = set(scheduler.next_run("app%d" % i, NOW) for i in range(20))
+        self.assertTrue(len(runs) > 15)
+
+    @override_settings(BACKUP_JITTER=600)
+    def test_jitter_stays_within_the_window(self):
+        rnd = random.Random(42)
+        base = scheduler.offset("app1", 4 * 60 * 60)
+        start, end = self.window(NOW + datetime.timedelta(days=1))
+        for i in range(50):
+            at = scheduler.next_run("app1", NOW, rnd=rnd)
+            self.assertTrue(start <= at <= end)
+            seconds = (at - start).total_seconds()
+            self.assertTrue(abs(seconds - base) <= 600)
+
+
+@override_settings(BACKUP_JITTER=0)
+class BackupSchedulerTestCase(TestCase):
+
+    def setUp(self):
+        self.bucket = mocks.FakeBucket()
+        self.scheduler = scheduler.BackupScheduler(self.bucket,
+                                                   concurrency=2, per_host=1)
+        self.started = []
+        patcher = mock.patch.object(self.scheduler, "start_backup",
+                                    side_effect=self.start_backup)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def start_backup(self, schedule, host):
+        self.started.append((schedule.instance.name, host))
+        thread = mock.Mock()
+        thread.is_alive.return_value = True
+        return thread
+
+    def create(self, name, host="10.0.0.1", state="running"):
+        instance = Instance.objects.create(name=name, host=host, state=state)
+        return BackupSchedule.objects.create(
+            instance=instance,
+            next_run_at=NOW - datetime.timedelta(minutes=1))
+
+    def test_sync_schedules_running_instances(self):
+        Instance.objects.create(name="app1", host="10.0.0.1",
+                                state="running")
+        Instance.objects.create(name="app2", state="pending")
+        created = self.scheduler.sync(NOW)
+        self.assertEqual(["app1"], [s.instance.name for s in created])
+        self.assertTrue(created[0].next_run_at > NOW)
+        self.assertEqual([], self.scheduler.sync(NOW))
+
+    def test_tick_starts_due_backups(self):
+        self.create("app1")
+        schedule = self.create("app2", host="10.0.0.2")
+        schedule.next_run_at = NOW + datetime.timedelta(hours=1)
+        schedule.save()
+        started = self.scheduler.tick(NOW)
+        self.assertEqual(["app1"], [s.instance.name for s in started])
+        schedule = BackupSchedule.objects.get(instance__name="app1")
+        self.assertEqual(NOW, schedule.last_started_at)
+        self.assertTrue(schedule.next_run_at > NOW)
+
+    def test_tick_runs_one_backup_per_host(self):
+        self.create("app1")
+        self.create("app2")
+        self.create("app3", host="10.0.0.2")
+        self.scheduler.tick(NOW)
+        hosts = [host for _, host in self.started]
+        self.assertEqual(["10.0.0.1:3306", "10.0.0.2:3306"], sorted(hosts))
+
+    def test_tick_respects_concurrency(self):
+        for i in range(3):
+            self.create("app%d" % i, host="10.0.0.%d" % i)
+        self.scheduler.tick(NOW)
+        self.assertEqual(2, len(self.started))
+        self.scheduler.tick(NOW)
+        self.assertEqual(2, len(self.started))
+
+    @mock.patch("mysqlapi.api.backup.scheduler.BackupRunner")
+    def test_backup_records_the_result(self, runner):
+        manifest = Manifest("b1", "10.0.0.1:3306")
+        runner.return_value.run.return_value = manifest
+        schedule = self.create("app1")
+        self.scheduler.running["10.0.0.1:3306"] = 1
+        self.scheduler.backup(schedule, "10.0.0.1:3306")
+        runner.return_value.run.assert_called_once_with(["app1"])
+        self.assertEqual(1, runner.call_args[1]["workers"])
+        self.assertFalse(runner.call_args[1]["last"])
+        schedule = BackupSchedule.objects.get(pk=schedule.pk)
+        self.assertEqual("ok", schedule.last_status)
+        self.assertEqual("b1", schedule.last_backup_id)
+        self.assertTrue(schedule.next_run_at > schedule.last_finished_at)
+        self.assertEqual(0, self.scheduler.running["10.0.0.1:3306"])
+
+    @mock.patch("mysqlapi.api.backup.scheduler.BackupRunner")
+    def test_backup_records_failures(self, runner):
+        runner.return_value.run.side_effect = Exception("server is gone")
+        schedule = self.create("app1")
+        self.scheduler.running["10.0.0.1:3306"] = 1
+        self.scheduler.backup(schedule, "10.0.0.1:3306")
+        schedule = BackupSchedule.objects.get(pk=schedule.pk)
+        self.assertEqual("failed", schedule.last_status)
+        self.assertEqual("server is gone", schedule.last_error)
+        self.assertIsNotNone(schedule.next_run_at)
+
+
+class ScheduleBackupsCommandTestCase(TestCase):
+
+    @mock.patch("mysqlapi.api.management.commands.schedule_backups.s3")
+    @mock.patch("mysqlapi.api.management.commands.schedule_backups."
+                "BackupScheduler")
+    def test_once(self, scheduler_class, s3):
+        sched = scheduler_class.return_value
+        sched.tick.return_value = [mock.Mock()]
+        call_command("schedule_backups", once=True)
+        sched.tick.assert_called_once_with()
+        sched.join_backups.assert_called_once_with()
+        self.assertFalse(sched.run.called)
@@ -0,0 +1,177 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from unittest import TestCase
+from django.test.utils import override_settings
+
+from mysqlapi.api.backup import throttle
+from mysqlapi.api.backup.runner import BackupRunner
+from mysqlapi.api.database import Connection
+from mysqlapi.api.tests import mocks
+
+import mock
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = throttle.TokenBucket(100, clock=self.clock,
+                                           sleep=self.clock.sleep)
+
+    def test_consume_within_the_burst_does_not_wait(self):
+        self.assertEqual(0, self.bucket.consume(100))
+        self.assertEqual([], self.clock.slept)
+
+    def test_consume_waits_for_the_rate(self):
+        self.bucket.consume(100)
+        self.assertEqual(0.5, self.bucket.consume(50))
+        self.assertEqual(2.0, self.bucket.consume(200))
+        self.assertEqual([0.5, 2.0], self.clock.slept)
+
+    def test_tokens_refill_over_time(self):
+        self.bucket.consume(100)
+        self.clock.now += 1
+        self.assertEqual(0, self.bucket.consume(100))
+
+    def test_refill_is_capped_by_the_burst(self):
+        self.clock.now += 60
+        self.bucket.consume(100)
+        self.assertEqual(1.0, self.bucket.consume(100))
+
+
+class LoadMonitorTestCase(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch("mysqlapi.api.backup.throttle.Connection")
+        self.conn = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.cursor = self.conn.cursor.return_value
+        self.cursor.description = [("Slave_IO_State",),
+                                   ("Seconds_Behind_Master",)]
+        self.status = {"threads": 5, "lag": 0}
+        self.cursor.fetchone.side_effect = self.fetchone
+        self.clock = FakeClock()
+
+    def fetchone(self):
+        query = self.cursor.execute.call_args[0][0]
+        if "Threads_running" in query:
+            return ("Threads_running", str(self.status["threads"]))
+        if self.status["lag"] is None:
+            return None
+        return ("Waiting", self.status["lag"])
+
+    def monitor(self, **kwargs):
+        server = Connection(hostname="localhost", username="root")
+        return throttle.LoadMonitor(server, clock=self.clock,
+                                    sleep=self.clock.sleep, **kwargs)
+
+    def test_threads_running(self):
+        monitor = self.monitor(max_threads_running=10)
+        self.assertEqual(None, monitor.overloaded())
+        self.status["threads"] = 20
+        self.clock.now += 1
+        self.assertEqual("20 threads running", monitor.overloaded())
+        self.conn.close.assert_called_with()
+
+    def test_replication_lag(self):
+        monitor = self.monitor(max_lag=30)
+        self.status["lag"] = 60
+        self.assertEqual("replication 60s behind", monitor.overloaded())
+
+    def test_not_a_replica(self):
+        self.status["lag"] = None
+        self.assertEqual(None, self.monitor(max_lag=30).overloaded())
+
+    def test_checks_are_cached_for_the_interval(self):
+        monitor = self.monitor(max_threads_running=10, interval=5)
+        monitor.overloaded()
+        self.status["threads"] = 20
+        self.assertEqual(None, monitor.overloaded())
+        self.assertEqual(1, self.cursor.execute.call_count)
+
+    def test_wait_pauses_while_overloaded(self):
+        monitor = self.monitor(max_threads_running=10, pause=5)
+        self.status["threads"] = 20
+
+        def recover(seconds):
+            self.clock.sleep(seconds)
+            if len(self.clock.slept) == 2:
+                self.status["threads"] = 1
+        monitor.sleep = recover
+        monitor.wait()
+        self.assertEqual([5, 5], self.clock.slept)
+        self.assertEqual(10, monitor.paused)
+
+
+class ThrottleTestCase(TestCase):
+
+    def test_wrap_consumes_the_bucket_and_waits_for_the_monitor(self):
+        monitor = mock.Mock(paused=3)
+        t = throttle.Throttle(1000, monitor)
+        t.bucket = mock.Mock(rate=1000)
+        self.assertEqual(["ab", "cde"], list(t.wrap(["ab", "cde"])))
+        self.assertEqual([mock.call(2), mock.call(3)],
+                         t.bucket.consume.call_args_list)
+        self.assertEqual(2, monitor.wait.call_count)
+        self.assertEqual({"rate": 1000, "paused": 3}, t.stats())
+
+    @override_settings(BACKUP_RATE_LIMIT=0, BACKUP_MAX_THREADS_RUNNING=0,
+                       BACKUP_MAX_REPLICATION_LAG=0)
+    def test_from_settings_without_limits(self):
+        self.assertEqual(None, throttle.from_settings(Connection()))
+        t = throttle.from_settings(Connection(), rate=500)
+        self.assertEqual(500, t.bucket.rate)
+        self.assertEqual(None, t.monitor)
+
+    @override_settings(BACKUP_RATE_LIMIT=0, BACKUP_MAX_THREADS_RUNNING=50,
+                       BACKUP_MAX_REPLICATION_LAG=0)
+    def test_from_settings_with_a_monitor(self):
+        t = throttle.from_settings(Connection())
+        self.assertEqual(None, t.bucket)
+        self.assertEqual(50, t.monitor.max_threads_running)
+
+
+class ThrottledRunnerTestCase(TestCase):
+
+    def setUp(self):
+        override = override_settings(BACKUP_CHUNK_THRESHOLD=0,
+                                     BACKUP_FINGERPRINT="none",
+                                     BACKUP_MAX_WORKERS=2)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.server = Connection(hostname="localhost", username="root")
+        patcher = mock.patch("mysqlapi.api.backup.catalog.record")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_workers_are_capped(self):
+        runner = BackupRunner(self.server, mocks.FakeBucket(), workers=8)
+        self.assertEqual(2, runner.workers)
+
+    def test_dumps_go_through_the_throttle(self):
+        t = throttle.Throttle()
+        with mock.patch("mysqlapi.api.backup.dump.dump") as dump:
+            dump.return_value = iter(["data"])
+            with mock.patch.object(t, "wrap") as wrap:
+                wrap.return_value = iter(["data"])
+                manifest = BackupRunner(self.server, mocks.FakeBucket(),
+                                        throttle=t).run(["app1"])
+        wrap.assert_called_with(dump.return_value)
+        self.assertEqual({"rate": 0, "paused": 0},
+                         manifest.metadata["throttle"])
@@ -0,0 +1,137 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import zlib
+
+from unittest import TestCase
+
+from mysqlapi.api import compression
+
+import mock
+
+
+class NegotiateTestCase(TestCase):
+
+    def test_no_accepted_encoding(self):
+        self.assertIsNone(compression.negotiate(""))
+
+    def test_gzip(self):
+        self.assertEqual("gzip", compression.negotiate("gzip, deflate"))
+
+    def test_unsupported_encoding(self):
+        self.assertIsNone(compression.negotiate("br, deflate"))
+
+    def test_q_zero_disables_encoding(self):
+        self.assertIsNone(compression.negotiate("gzip;q=0"))
+
+    def test_wildcard(self):
+        self.assertEqual("gzip", compression.negotiate("*"))
+
+    def test_prefers_highest_q(self):
+        with mock.patch("mysqlapi.api.compression.available") as available:
+            available.return_value = ["zstd", "gzip"]
+            accept = "gzip;q=1.0, zstd;q=0.5"
+            self.assertEqual("gzip", compression.negotiate(accept))
+
+    def test_lz4_is_not_offered_to_http_clients(self):
+        with mock.patch("mysqlapi.api.compression.available") as available:
+            available.return_value = ["lz4", "gzip"]
+            self.assertEqual("gzip", compression.negotiate("*"))
+
+    def test_prefers_zstd_when_equally_accepted(self):
+        with mock.patch("mysqlapi.api.compression.available") as available:
+            available.return_value = ["zstd", "gzip"]
+            self.assertEqual("zstd", compression.negotiate("gzip, zstd"))
+
+
+class CompressedStreamTestCase(TestCase):
+
+    def test_gzip(self):
+        chunks = ["CREATE TABLE foo;\n"] * 100
+        stream = compression.CompressedStream(
+            chunks, compression.compressor("gzip"))
+        data = "".join(stream)
+        self.assertEqual("".join(chunks),
+                         zlib.decompress(data, 16 + zlib.MAX_WBITS))
+
+    def test_close_closes_the_source(self):
+        source = mock.MagicMock()
+        stream = compression.CompressedStream(
+            source, compression.compressor("gzip"))
+        stream.close()
+        source.close.assert_called_with()
+
+    def test_unsupported_compressor(self):
+        with self.assertRaises(ValueError):
+            compression.compressor("br")
+
+
+class DecompressorTestCase(TestCase):
+
+    def gzip(self, data):
+        codec = compression.compressor("gzip")
+        return codec.compress(data) + codec.flush()
+
+    def test_gzip_with_several_members(self):
+        data = self.gzip("first\n") + self.gzip("second\n")
+        chunks = [data[:5], data[5:]]
+        stream = compression.DecompressedStream(
+            chunks, compression.decompressor("gzip"))
+        self.assertEqual("first\nsecond\n", "".join(stream))
+
+    def test_identity(self):
+        stream = compression.DecompressedStream(
+            ["ab", "cd"], compression.decompressor("identity"))
+        self.assertEqual("abcd", "".join(stream))
+
+    def test_unsupported_decompressor(self):
+        with self.assertRaises(ValueError):
+            compression.decompressor("br")
+
+    def test_lz4_needs_the_lz4_module(self):
+        with mock.patch("mysqlapi.api.compression.lz4_frame", None):
+            with self.assertRaises(ValueError):
+                compression.decompressor("lz4")
+
+
+class ParallelCompressorTestCase(TestCase):
+
+    data = "".join("INSERT INTO t VALUES (%d);\n" % i for i in xrange(5000))
+
+    def decompress(self, chunks):
+        return "".join(compression.DecompressedStream(
+            chunks, compression.decompressor("gzip")))
+
+    def test_blocks(self):
+        blocks = list(compression.blocks(["abc", "defgh", "ij"], 4))
+        self.assertEqual(["abcd", "efgh", "ij"], blocks)
+
+    def test_compress_in_parallel(self):
+        compressor = compression.ParallelCompressor("gzip", level=1,
+                                                    threads=4,
+                                                    block_size=1000)
+        chunks = [self.data[i:i + 777] for i in xrange(0, len(self.data),
+                                                       777)]
+        compressed = list(compressor.compress(chunks))
+        self.assertEqual(self.data, self.decompress(compressed))
+        self.assertEqual(len(self.data), compressor.size)
+        self.assertEqual(len("".join(compressed)), compressor.stored_size)
+        self.assertTrue(compressor.ratio() > 1)
+
+    def test_compress_with_one_thread(self):
+        compressor = compression.ParallelCompressor("gzip", threads=1,
+                                                    block_size=1000)
+        compressed = list(compressor.compress([self.data]))
+        self.assertEqual(self.data, self.decompress(compressed))
+
+    def test_compress_raises_block_errors(self):
+        compressor = compression.ParallelCompressor("gzip", threads=2)
+        with mock.patch("mysqlapi.api.compression.compressor") as factory:
+            factory.return_value.compress.side_effect = ValueError("boom")
+            with self.assertRaises(ValueError):
+                list(compressor.compress(["data"]))
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            compression.ParallelCompressor("br")
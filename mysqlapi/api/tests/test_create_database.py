@@ -16,7 +16,8 @@ from mysqlapi.api.database import Connection
 from mysqlapi.api.models import (create_database, DatabaseManager,
                                  DatabaseCreationError, Instance,
                                  InstanceAlreadyExists, InvalidInstanceName,
-                                 ProvisionedInstance, canonicalize_db_name)
+                                 ProvisionedInstance, ProvisioningJob,
+                                 canonicalize_db_name)
 from mysqlapi.api.tests import mocks
 from mysqlapi.api.views import CreateDatabase
 
@@ -29,7 +30,7 @@ class CreateDatabaseViewTestCase(unittest.TestCase):
         cls.conn.open()
         cls.old_poll_interval = settings.EC2_POLL_INTERVAL
         settings.EC2_POLL_INTERVAL = 0
-        set_model(Instance)
+        set_model(Instance, ProvisioningJob)
 
     @classmethod
     def tearDownClass(cls):
@@ -213,7 +214,7 @@ class CreateDatabaseFunctionTestCase(unittest.TestCase):
         cls.conn.open()
         cls.old_poll_interval = settings.EC2_POLL_INTERVAL
         settings.EC2_POLL_INTERVAL = 0
-        set_model(Instance)
+        set_model(Instance, ProvisioningJob)
 
     @classmethod
     def tearDownClass(cls):
@@ -302,12 +303,10 @@ class CreateDatabaseFunctionTestCase(unittest.TestCase):
 
     def test_create_database_provisioned_none_left(self):
         settings.USE_POOL = True
-        instance = Instance.objects.create(name="mydb")
-        self.addCleanup(instance.delete)
-        pi = ProvisionedInstance.objects.create(instance=instance,
-                                                host="127.0.0.1",
+        pi = ProvisionedInstance.objects.create(host="127.0.0.1",
                                                 port=3306,
-                                                admin_user="root")
+                                                admin_user="root",
+                                                used=1)
         self.addCleanup(pi.delete)
         instance = Instance(name="hello_world")
         with self.assertRaises(DatabaseCreationError) as cm:
@@ -0,0 +1,402 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+import Queue
+import threading
+import time
+import unittest
+
+import mock
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from mysqlapi.api import creator
+from mysqlapi.api.models import Instance, ProvisioningJob
+from mysqlapi.api.tests import mocks
+
+
+class BlockingManager(object):
+
+    release = threading.Event()
+    lock = threading.Lock()
+    running = 0
+    peak = 0
+
+    def __init__(self, name, host, user, password):
+        self.name = name
+
+    def create_database(self):
+        cls = BlockingManager
+        with cls.lock:
+            cls.running += 1
+            cls.peak = max(cls.peak, cls.running)
+        cls.release.wait(5)
+        with cls.lock:
+            cls.running -= 1
+        if self.name == "broken":
+            raise Exception("Could not create the database.")
+
+
+def make_job(name):
+    job = mock.Mock()
+    job.instance.name = name
+    return job
+
+
+class CreatorPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        BlockingManager.release = threading.Event()
+        BlockingManager.running = BlockingManager.peak = 0
+        creator.set_model(Instance, ProvisioningJob)
+        creator._instance_queue = creator.InstanceQueue()
+        self.client = mocks.FakeEC2Client()
+        # jobs are handed to the workers directly, the poller has nothing
+        # to claim.
+        patcher = mock.patch("mysqlapi.api.creator.claim", return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        BlockingManager.release.set()
+        creator.close_queue()
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_start_creator_starts_the_workers(self):
+        pool = creator.start_creator(BlockingManager, self.client, workers=3)
+        self.assertEqual(3, len(pool.workers))
+        self.assertTrue(all(w.is_alive() for w in pool.workers))
+        self.assertTrue(pool.poller.is_alive())
+        self.assertIs(pool, creator._pool)
+        BlockingManager.release.set()
+        pool.stop()
+        self.assertFalse(any(w.is_alive() for w in pool.workers))
+        self.assertFalse(pool.poller.is_alive())
+
+    def test_workers_create_databases_concurrently(self):
+        pool = creator.start_creator(BlockingManager, self.client, workers=3)
+        jobs = [make_job("db%d" % i) for i in range(4)]
+        for job in jobs:
+            creator._instance_queue.put_ready(job)
+        self.wait_for(lambda: BlockingManager.running == 3)
+        stats = pool.stats()
+        self.assertEqual(3, stats["busy"])
+        self.assertEqual(1, stats["ready"])
+        BlockingManager.release.set()
+        self.wait_for(lambda: pool.stats()["created"] == 4)
+        pool.stop()
+        self.assertEqual(3, BlockingManager.peak)
+        for job in jobs:
+            job.finish.assert_called_once_with()
+
+    def test_stats(self):
+        BlockingManager.release.set()
+        pool = creator.start_creator(BlockingManager, self.client, workers=2)
+        creator._instance_queue.put_ready(make_job("db1"))
+        creator._instance_queue.put_ready(make_job("broken"))
+        self.wait_for(lambda: pool.stats()["created"] == 1 and
+                      pool.stats()["failed"] == 1)
+        pool.stop()
+        stats = pool.stats()
+        self.assertEqual(0, stats["busy"])
+        self.assertEqual(0, stats["requeued"])
+        self.assertEqual(0, stats["queued"])
+        self.assertEqual(["creator-0", "creator-1"],
+                         [w["name"] for w in stats["workers"]])
+        self.assertEqual(2, sum(w["created"] + w["failed"]
+                                for w in stats["workers"]))
+        self.assertIn("terminate instance broken", self.client.actions)
+
+
+class InstanceQueueTestCase(unittest.TestCase):
+
+    def test_get_ready_drains_before_finishing(self):
+        queue = creator.InstanceQueue()
+        job = make_job("db1")
+        queue.put_ready(job)
+        queue.finish()
+        self.assertIs(job, queue.get_ready(timeout=1))
+        with self.assertRaises(Queue.Empty):
+            queue.get_ready(timeout=5)
+
+    def test_get_ready_timeout(self):
+        queue = creator.InstanceQueue()
+        with self.assertRaises(Queue.Empty):
+            queue.get_ready(timeout=0.01)
+
+    def test_wake_interrupts_wait(self):
+        queue = creator.InstanceQueue()
+        t = threading.Timer(0.05, queue.wake)
+        t.start()
+        start = time.time()
+        queue.wait(5)
+        self.assertTrue(time.time() - start < 4)
+        t.join()
+
+    def test_close_interrupts_wait(self):
+        queue = creator.InstanceQueue()
+        t = threading.Timer(0.05, queue.close)
+        t.start()
+        start = time.time()
+        queue.wait(5)
+        self.assertTrue(time.time() - start < 4)
+        t.join()
+
+    @override_settings(EC2_POLL_INTERVAL=10, CREATOR_MAX_BACKOFF=60)
+    def test_backoff(self):
+        self.assertEqual([10, 20, 40, 60, 60],
+                         [creator.backoff(i) for i in range(1, 6)])
+
+
+class JobTestCase(TestCase):
+
+    def setUp(self):
+        creator.set_model(Instance, ProvisioningJob)
+        creator._instance_queue = creator.InstanceQueue()
+        self.now = timezone.now()
+
+    def create(self, name, run_after=None, **kwargs):
+        instance = Instance.objects.create(name=name, ec2_id="i-" + name)
+        return ProvisioningJob.objects.create(
+            instance=instance, run_after=run_after or self.now, **kwargs)
+
+    def test_enqueue_creates_a_job(self):
+        instance = Instance.objects.create(name="db1")
+        creator.enqueue(instance)
+        creator.enqueue(instance)
+        job = ProvisioningJob.objects.get(instance=instance)
+        self.assertEqual("pending", job.state)
+        self.assertTrue(creator._instance_queue._woken)
+
+    def test_build_queue_adds_jobs_for_pending_instances(self):
+        self.create("db1")
+        db2 = Instance.objects.create(name="db2", ec2_id="i-2")
+        Instance.objects.create(name="db3", ec2_id="i-3", state="running")
+        Instance.objects.create(name="db4", shared=True)
+        Instance.objects.create(name="db5")
+        creator.build_queue()
+        names = ProvisioningJob.objects.values_list("instance__name",
+                                                    flat=True)
+        self.assertEqual(["db1", "db2"], sorted(names))
+        self.assertEqual(1, ProvisioningJob.objects.filter(
+            instance=db2).count())
+
+    def test_claim_leases_due_jobs(self):
+        self.create("db1")
+        self.create("db2", run_after=self.now + datetime.timedelta(hours=1))
+        self.create("db3", state="done")
+        jobs = creator.claim(10, 60, now=self.now)
+        self.assertEqual(["db1"], [j.instance.name for j in jobs])
+        job = ProvisioningJob.objects.get(pk=jobs[0].pk)
+        self.assertEqual(jobs[0].lease_token, job.lease_token)
+        self.assertEqual(self.now + datetime.timedelta(seconds=60),
+                         job.lease_expires_at)
+
+    def test_claim_limit(self):
+        for i in range(3):
+            self.create("db%d" % i)
+        self.assertEqual(2, len(creator.claim(2, 60, now=self.now)))
+        self.assertEqual(1, len(creator.claim(2, 60, now=self.now)))
+
+    def test_claim_skips_leased_jobs(self):
+        self.create("db1")
+        self.assertEqual(1, len(creator.claim(10, 60, now=self.now)))
+        self.assertEqual([], creator.claim(10, 60, now=self.now))
+
+    def test_claim_takes_jobs_whose_lease_expired(self):
+        self.create("db1")
+        first, = creator.claim(10, 60, now=self.now)
+        later = self.now + datetime.timedelta(seconds=61)
+        second, = creator.claim(10, 60, now=later)
+        self.assertNotEqual(first.lease_token, second.lease_token)
+        self.assertFalse(first.finish())
+        self.assertTrue(second.finish())
+        self.assertEqual("done", ProvisioningJob.objects.get().state)
+
+    def test_retry_releases_the_job(self):
+        self.create("db1")
+        job, = creator.claim(10, 60, now=self.now)
+        self.assertTrue(job.retry(30))
+        job = ProvisioningJob.objects.get(pk=job.pk)
+        self.assertEqual(1, job.attempts)
+        self.assertEqual("", job.lease_token)
+        self.assertTrue(job.run_after > self.now)
+        self.assertEqual([], creator.claim(10, 60))
+
+
+class InstancePollerTestCase(TestCase):
+
+    def setUp(self):
+        creator.set_model(Instance, ProvisioningJob)
+        creator._instance_queue = creator.InstanceQueue()
+        overrides = override_settings(EC2_POLL_INTERVAL=10,
+                                      CREATOR_MAX_BACKOFF=60,
+                                      CREATOR_MAX_ATTEMPTS=3,
+                                      CREATOR_DEADLINE=600)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def create(self, name, **kwargs):
+        instance = Instance.objects.create(name=name, ec2_id="i-" + name)
+        ProvisioningJob.objects.create(instance=instance,
+                                       run_after=timezone.now(), **kwargs)
+
+    def test_poll_describes_the_batch_at_once(self):
+        for name in ("db1", "db2", "db3"):
+            self.create(name)
+        client = mocks.FakeBatchEC2Client(booting={"db2": 1})
+        poller = creator.InstancePoller(client)
+        poller.poll_once()
+        self.assertEqual(["get instances db1, db2, db3"], client.actions)
+        ready = [creator._instance_queue.get_ready(timeout=1)
+                 for i in range(2)]
+        self.assertEqual(["db1", "db3"], [j.instance.name for j in ready])
+        self.assertEqual("127.0.0.1", ready[0].instance.host)
+        job = ProvisioningJob.objects.get(instance__name="db2")
+        self.assertEqual(1, job.attempts)
+        self.assertEqual({"polls": 1, "requeued": 1, "expired": 0,
+                          "lost": 0}, poller.stats)
+        self.assertEqual([], poller.poll_once())
+
+    def test_poll_falls_back_to_get(self):
+        self.create("db1")
+        self.create("db2")
+        client = mocks.MultipleFailureEC2Client(times=1)
+        poller = creator.InstancePoller(client)
+        poller.poll_once()
+        self.assertEqual(["get instance db2"], client.actions)
+        self.assertEqual(1, poller.stats["requeued"])
+
+    def test_poll_requeues_the_batch_when_the_call_fails(self):
+        self.create("db1")
+        self.create("db2")
+        client = mocks.FakeBatchEC2Client()
+        client.get_many = mock.Mock(side_effect=Exception("throttled"))
+        poller = creator.InstancePoller(client)
+        with mock.patch("sys.stderr"):
+            poller.poll_once()
+        self.assertEqual(2, poller.stats["requeued"])
+        self.assertEqual(0, creator._instance_queue.qsize())
+
+    def test_poll_requeues_instances_with_backoff(self):
+        self.create("db1", attempts=1)
+        client = mocks.MultipleFailureEC2Client(times=1)
+        poller = creator.InstancePoller(client)
+        before = timezone.now()
+        poller.poll_once()
+        job = ProvisioningJob.objects.get()
+        self.assertEqual(2, job.attempts)
+        self.assertEqual("pending", job.state)
+        delay = (job.run_after - before).total_seconds()
+        self.assertTrue(19 <= delay <= 21)
+
+    def test_poll_gives_up_after_the_attempts(self):
+        self.create("db1", attempts=2)
+        client = mocks.MultipleFailureEC2Client(times=1)
+        poller = creator.InstancePoller(client)
+        poller.poll_once()
+        self.assertEqual(1, poller.stats["expired"])
+        job = ProvisioningJob.objects.get()
+        self.assertEqual("failed", job.state)
+        self.assertEqual("error", job.instance.state)
+        self.assertIn("terminate instance db1", client.actions)
+
+    def test_poll_drops_jobs_whose_lease_was_lost(self):
+        self.create("db1")
+        self.create("db2", attempts=2)
+        jobs = creator.claim(10, 60)
+        # another process claims the jobs again once their lease expired.
+        ProvisioningJob.objects.update(lease_expires_at=timezone.now())
+        creator.claim(10, 60)
+        client = mocks.FakeBatchEC2Client(booting={"db2": 1})
+        poller = creator.InstancePoller(client)
+        poller.poll(jobs)
+        self.assertEqual(0, creator._instance_queue.qsize())
+        self.assertEqual(2, poller.stats["lost"])
+        self.assertNotIn("terminate instance db2", client.actions)
+        self.assertEqual(["pending", "pending"], list(
+            ProvisioningJob.objects.values_list("state", flat=True)))
+
+    def test_poll_gives_up_after_the_deadline(self):
+        self.create("db1")
+        ProvisioningJob.objects.update(
+            created_at=timezone.now() - datetime.timedelta(seconds=601))
+        client = mocks.MultipleFailureEC2Client(times=1)
+        poller = creator.InstancePoller(client)
+        poller.poll_once()
+        job = ProvisioningJob.objects.get()
+        self.assertEqual(u"The instance did not start in 600 seconds.",
+                         job.reason)
+
+
+class DatabaseCreatorTestCase(TestCase):
+
+    def setUp(self):
+        creator.set_model(Instance, ProvisioningJob)
+        instance = Instance.objects.create(name="db1", ec2_id="i-1",
+                                           host="127.0.0.1")
+        ProvisioningJob.objects.create(instance=instance,
+                                       run_after=timezone.now())
+        self.job, = creator.claim(10, 60)
+
+    def test_create_finishes_the_job(self):
+        BlockingManager.release.set()
+        worker = creator.DatabaseCreator(BlockingManager,
+                                         mocks.FakeEC2Client())
+        self.assertEqual("created", worker.create(self.job))
+        self.assertEqual("done", ProvisioningJob.objects.get().state)
+
+    def test_create_fails_when_it_cant_authorize(self):
+        client = mocks.FakeEC2Client()
+        client.authorize = lambda instance: False
+        worker = creator.DatabaseCreator(BlockingManager, client)
+        self.assertEqual("failed", worker.create(self.job))
+        job = ProvisioningJob.objects.get()
+        self.assertEqual("failed", job.state)
+        self.assertEqual("error", job.instance.state)
+
+    def lose_lease(self):
+        ProvisioningJob.objects.update(lease_expires_at=timezone.now())
+        creator.claim(10, 60)
+
+    def test_create_drops_a_job_whose_lease_was_lost(self):
+        # the lease expires while the job waits for a worker.
+        self.lose_lease()
+        client = mocks.FakeEC2Client()
+        manager = mock.Mock()
+        worker = creator.DatabaseCreator(manager, client)
+        self.assertEqual("lost", worker.create(self.job))
+        self.assertFalse(manager.called)
+        self.assertEqual([], client.actions)
+        job = ProvisioningJob.objects.get()
+        self.assertEqual("pending", job.state)
+        self.assertEqual("pending", job.instance.state)
+
+    def test_create_does_not_terminate_after_losing_the_lease(self):
+        client = mocks.FakeEC2Client()
+        manager = mock.Mock()
+
+        def create_database():
+            self.lose_lease()
+            raise Exception("Can't create database 'db1'; database exists")
+
+        manager.return_value.create_database.side_effect = create_database
+        worker = creator.DatabaseCreator(manager, client)
+        self.assertEqual("lost", worker.create(self.job))
+        self.assertNotIn("terminate instance db1", client.actions)
+        self.assertEqual("pending", ProvisioningJob.objects.get().state)
+
+    def test_create_lost_the_lease_before_finishing(self):
+        manager = mock.Mock()
+        manager.return_value.create_database.side_effect = self.lose_lease
+        worker = creator.DatabaseCreator(manager, mocks.FakeEC2Client())
+        self.assertEqual("lost", worker.create(self.job))
+        self.assertEqual("pending", ProvisioningJob.objects.get().state)
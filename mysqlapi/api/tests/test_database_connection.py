@@ -4,11 +4,16 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import time
 import traceback
 
+import mock
+import MySQLdb
+
 from django.test import TestCase
 
-from mysqlapi.api.database import Connection
+from mysqlapi.api.database import (Connection, ConnectionPool, PoolTimeout,
+                                   get_pool, reset_pools)
 
 
 class DatabaseConnectionTestCase(TestCase):
@@ -33,3 +38,136 @@ class DatabaseConnectionTestCase(TestCase):
             msg = "Should not raise any exception when closing a None " +\
                   "connection, but raised:\n%s"
             self.fail(msg % traceback.format_exc(e))
+
+    def test_close_returns_the_connection_to_the_pool(self):
+        conn = Connection(hostname="localhost", username="root")
+        conn.open()
+        raw = conn._connection
+        conn.close()
+        conn.open()
+        self.assertIs(raw, conn._connection)
+        conn.close()
+
+
+class ConnectionPoolTestCase(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch("mysqlapi.api.database.connect")
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connect.side_effect = lambda *args: mock.Mock()
+
+    def pool(self, **kwargs):
+        return ConnectionPool("10.0.0.1", "3306", "root", "", "", **kwargs)
+
+    def test_acquire_creates_a_connection(self):
+        pool = self.pool()
+        conn = pool.acquire()
+        self.connect.assert_called_with("10.0.0.1", "3306", "root", "", "")
+        self.assertEqual(1, pool.stats()["created"])
+        self.assertEqual(1, pool.stats()["in_use"])
+        pool.release(conn)
+        self.assertEqual(1, pool.stats()["idle"])
+
+    def test_acquire_reuses_released_connections(self):
+        pool = self.pool()
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIs(conn, pool.acquire())
+        conn.ping.assert_called_with()
+        self.assertEqual(1, self.connect.call_count)
+        self.assertEqual(1, pool.stats()["reused"])
+
+    def test_acquire_discards_connections_that_fail_ping(self):
+        pool = self.pool()
+        conn = pool.acquire()
+        conn.ping.side_effect = MySQLdb.OperationalError(2006, "gone away")
+        pool.release(conn)
+        other = pool.acquire()
+        self.assertIsNot(conn, other)
+        conn.close.assert_called_with()
+        stats = pool.stats()
+        self.assertEqual(1, stats["broken"])
+        self.assertEqual(1, stats["size"])
+
+    def test_release_rolls_back_the_open_transaction(self):
+        pool = self.pool()
+        conn = pool.acquire()
+        pool.release(conn)
+        conn.rollback.assert_called_once_with()
+        self.assertEqual(1, pool.stats()["idle"])
+
+    def test_release_discards_connections_that_fail_rollback(self):
+        pool = self.pool()
+        conn = pool.acquire()
+        conn.rollback.side_effect = MySQLdb.OperationalError(2006, "gone")
+        pool.release(conn)
+        conn.close.assert_called_with()
+        stats = pool.stats()
+        self.assertEqual((0, 0, 1), (stats["size"], stats["idle"],
+                                     stats["broken"]))
+        self.assertIsNot(conn, pool.acquire())
+
+    def test_idle_connections_are_evicted(self):
+        pool = self.pool(idle_timeout=0)
+        conn = pool.acquire()
+        pool.release(conn)
+        time.sleep(0.01)
+        self.assertIsNot(conn, pool.acquire())
+        self.assertEqual(1, pool.stats()["evicted"])
+
+    def test_acquire_times_out_when_pool_is_exhausted(self):
+        pool = self.pool(max_size=1, wait_timeout=0.01)
+        pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(1, pool.stats()["timeouts"])
+
+    def test_connect_failure_frees_the_slot(self):
+        pool = self.pool(max_size=1)
+        self.connect.side_effect = MySQLdb.OperationalError(2003, "down")
+        with self.assertRaises(MySQLdb.OperationalError):
+            pool.acquire()
+        self.assertEqual(0, pool.stats()["size"])
+
+    def test_get_pool_is_keyed_by_host_port_and_user(self):
+        self.addCleanup(reset_pools)
+        pool = get_pool("10.0.0.1", "3306", "root", "")
+        self.assertIs(pool, get_pool("10.0.0.1", 3306, "root", ""))
+        self.assertIsNot(pool, get_pool("10.0.0.1", "3307", "root", ""))
+        self.assertIsNot(pool, get_pool("10.0.0.1", "3306", "admin", ""))
+
+    def test_get_pool_retires_the_pool_of_an_old_password(self):
+        self.addCleanup(reset_pools)
+        pool = get_pool("10.0.0.1", "3306", "root", "old")
+        conn = pool.acquire()
+        other = get_pool("10.0.0.1", "3306", "root", "new")
+        self.assertIsNot(pool, other)
+        self.assertTrue(pool.retired)
+        pool.release(conn)
+        conn.close.assert_called_with()
+        self.assertEqual(0, pool.stats()["size"])
+
+    def test_get_pool_sweeps_every_pool(self):
+        self.addCleanup(reset_pools)
+        with mock.patch("mysqlapi.api.database.SWEEP_INTERVAL", 0):
+            unused = get_pool("10.0.0.1", "3306", "root", "")
+            unused.idle_timeout = 0
+            idle = unused.acquire()
+            unused.release(idle)
+            busy = get_pool("10.0.0.2", "3306", "root", "")
+            busy.acquire()
+            time.sleep(0.01)
+            get_pool("10.0.0.3", "3306", "root", "")
+            idle.close.assert_called_with()
+            self.assertEqual(0, unused.stats()["size"])
+            self.assertTrue(unused.retired)
+            self.assertIsNot(unused, get_pool("10.0.0.1", "3306", "root", ""))
+            self.assertIs(busy, get_pool("10.0.0.2", "3306", "root", ""))
+            self.assertFalse(busy.retired)
+
+    def test_sweep_keeps_pools_with_connections(self):
+        pool = self.pool()
+        pool.release(pool.acquire())
+        self.assertFalse(pool.sweep())
+        self.assertEqual(1, pool.stats()["idle"])
@@ -6,17 +6,62 @@
 
 from unittest import TestCase
 
-from mysqlapi.api.database import export
+from mysqlapi.api.database import CommandSink, CommandStream
 
-import mock
 import subprocess
+import tempfile
 
 
-class ExportTestCase(TestCase):
+class CommandStreamTestCase(TestCase):
 
-    def test_export(self):
-        with mock.patch("subprocess.check_output") as check_output:
-            export()
-            cmd = ["mysqldump", "-u", "root", "--quick",
-                   "--all-databases", "--compact"]
-            check_output.assert_called_with(cmd, stderr=subprocess.STDOUT)
+    def test_iterates_over_the_command_output(self):
+        stream = CommandStream(["printf", "abcdef"], chunk_size=2)
+        self.assertEqual(["ab", "cd", "ef"], list(stream))
+
+    def test_read(self):
+        stream = CommandStream(["printf", "abcdef"])
+        self.assertEqual("abcdef", stream.read())
+
+    def test_raises_when_command_fails_before_output(self):
+        cmd = ["sh", "-c", "echo 'mysqldump: Unknown database' >&2; exit 2"]
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            CommandStream(cmd)
+        self.assertEqual(2, cm.exception.returncode)
+        self.assertEqual("mysqldump: Unknown database\n",
+                         cm.exception.output)
+
+    def test_raises_when_command_fails_after_output(self):
+        cmd = ["sh", "-c", "printf data; echo failed >&2; exit 3"]
+        stream = CommandStream(cmd)
+        with self.assertRaises(subprocess.CalledProcessError):
+            stream.read()
+
+    def test_close_kills_the_command(self):
+        stream = CommandStream(["sh", "-c", "printf data; sleep 60"])
+        stream.close()
+        self.assertIsNotNone(stream._process.returncode)
+
+
+class CommandSinkTestCase(TestCase):
+
+    def test_writes_to_the_command_stdin(self):
+        out = tempfile.NamedTemporaryFile()
+        sink = CommandSink(["sh", "-c", "cat > %s" % out.name])
+        sink.write("ab")
+        sink.write("cd")
+        sink.close()
+        self.assertEqual("abcd", out.read())
+
+    def test_close_raises_when_command_fails(self):
+        cmd = ["sh", "-c", "cat > /dev/null; echo 'ERROR 1064' >&2; exit 1"]
+        sink = CommandSink(cmd)
+        sink.write("garbage")
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            sink.close()
+        self.assertEqual("ERROR 1064\n", cm.exception.output)
+
+    def test_write_raises_when_command_died(self):
+        sink = CommandSink(["sh", "-c", "echo 'access denied' >&2; exit 1"])
+        with self.assertRaises(subprocess.CalledProcessError):
+            for i in xrange(1000):
+                sink.write("x" * 65536)
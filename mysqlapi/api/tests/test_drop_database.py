@@ -134,4 +134,4 @@ class DropDatabaseViewTestCase(TestCase):
         row = self.cursor.fetchone()
         self.assertIsNone(row)
         pi = ProvisionedInstance.objects.get(pk=pi.pk)
-        self.assertEqual(None, pi.instance)
+        self.assertEqual(0, pi.used)
@@ -0,0 +1,77 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import unittest
+
+import mock
+from boto.exception import EC2ResponseError
+
+from mysqlapi.api import ec2
+from mysqlapi.api.models import Instance
+from mysqlapi.api.tests import mocks
+
+
+def reservation(*instances):
+    r = mock.Mock()
+    r.instances = [mock.Mock(id=id, state=state, ip_address=ip,
+                             private_ip_address=private_ip)
+                   for id, state, ip, private_ip in instances]
+    return r
+
+
+class ClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = mock.Mock()
+        self.wrapped = mocks.FakeEC2Client()
+        self.client = ec2.Client(self.wrapped, connection=self.conn)
+        self.instances = [Instance(name="db1", ec2_id="i-1"),
+                          Instance(name="db2", ec2_id="i-2"),
+                          Instance(name="db3", ec2_id="i-3")]
+
+    def test_delegates_to_the_wrapped_client(self):
+        self.client.terminate(self.instances[0])
+        self.assertEqual(["terminate instance db1"], self.wrapped.actions)
+
+    def test_get_many(self):
+        self.conn.get_all_instances.return_value = [
+            reservation(("i-1", "running", "54.0.0.1", "10.0.0.1"),
+                        ("i-2", "pending", "10.0.0.2", "10.0.0.2")),
+            reservation(("i-3", "running", "54.0.0.3", "10.0.0.3")),
+        ]
+        ready = self.client.get_many(self.instances)
+        ids = self.conn.get_all_instances.call_args[1]["instance_ids"]
+        self.assertEqual(["i-1", "i-2", "i-3"], sorted(ids))
+        self.assertEqual(["db1", "db3"], [i.name for i in ready])
+        self.assertEqual("54.0.0.1", ready[0].host)
+        self.assertEqual("running", ready[0].state)
+        self.assertIsNone(self.instances[1].host)
+
+    def test_get_many_uses_the_wrapped_client_connection(self):
+        wrapped = mock.Mock()
+        wrapped.ec2_conn.get_all_instances.return_value = [
+            reservation(("i-1", "running", "54.0.0.1", "10.0.0.1"))]
+        ready = ec2.Client(wrapped).get_many(self.instances[:1])
+        self.assertEqual(["db1"], [i.name for i in ready])
+
+    def test_get_many_without_ec2_ids(self):
+        self.assertEqual([], self.client.get_many([Instance(name="db1")]))
+        self.assertFalse(self.conn.get_all_instances.called)
+
+    def test_get_many_falls_back_to_get_for_unknown_instances(self):
+        self.conn.get_all_instances.side_effect = EC2ResponseError(
+            400, "Bad Request", body="""<Response><Errors><Error>
+<Code>InvalidInstanceID.NotFound</Code><Message>i-3</Message>
+</Error></Errors></Response>""")
+        ready = self.client.get_many(self.instances)
+        self.assertEqual(3, len(ready))
+        self.assertIn("get instance db1", self.wrapped.actions)
+
+    def test_get_many_raises_other_errors(self):
+        self.conn.get_all_instances.side_effect = EC2ResponseError(
+            503, "Unavailable", body="""<Response><Errors><Error>
+<Code>RequestLimitExceeded</Code><Message>slow down</Message>
+</Error></Errors></Response>""")
+        with self.assertRaises(EC2ResponseError):
+            self.client.get_many(self.instances)
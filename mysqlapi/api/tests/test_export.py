@@ -4,13 +4,17 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import zlib
+
 from django.test import TestCase
 from django.test.client import RequestFactory
 
 from mysqlapi.api.database import Connection
-from mysqlapi.api.models import DatabaseManager
+from mysqlapi.api.models import DatabaseManager, Instance
 from mysqlapi.api.views import export
 
+import mock
+
 
 class ExportViewTestCase(TestCase):
 
@@ -40,7 +44,8 @@ CREATE TABLE `foo` (
         request = RequestFactory().get("/", {"service_host": "127.0.0.1"})
         result = export(request, "magneto")
         self.assertEqual(200, result.status_code)
-        self.assertEqual(expected, result.content.replace("InnoDB", "MyISAM"))
+        content = "".join(result.streaming_content)
+        self.assertEqual(expected, content.replace("InnoDB", "MyISAM"))
         db.drop_database()
         db.drop_user("magneto", "%")
 
@@ -60,7 +65,8 @@ CREATE TABLE `foo` (
         request = RequestFactory().get("/")
         result = export(request, "magneto")
         self.assertEqual(200, result.status_code)
-        self.assertEqual(expected, result.content.replace("InnoDB", "MyISAM"))
+        content = "".join(result.streaming_content)
+        self.assertEqual(expected, content.replace("InnoDB", "MyISAM"))
         db.drop_database()
         db.drop_user("magneto", "%")
 
@@ -83,3 +89,38 @@ CREATE TABLE `foo` (
         request = RequestFactory().delete("/")
         response = export(request, "xavier")
         self.assertEqual(405, response.status_code)
+
+
+class CompressedExportViewTestCase(TestCase):
+
+    def test_export_is_gzipped_when_the_client_accepts_it(self):
+        m = "mysqlapi.api.models.DatabaseManager.export_stream"
+        with mock.patch(m) as export_stream:
+            export_stream.return_value = iter(["CREATE TABLE ", "`foo`;\n"])
+            request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip")
+            response = export(request, "magneto")
+            content = "".join(response.streaming_content)
+        self.assertEqual("gzip", response["Content-Encoding"])
+        self.assertEqual("Accept-Encoding", response["Vary"])
+        self.assertEqual("CREATE TABLE `foo`;\n",
+                         zlib.decompress(content, 16 + zlib.MAX_WBITS))
+
+    def test_export_is_plain_without_accept_encoding(self):
+        m = "mysqlapi.api.models.DatabaseManager.export_stream"
+        with mock.patch(m) as export_stream:
+            export_stream.return_value = iter(["CREATE TABLE `foo`;\n"])
+            response = export(RequestFactory().get("/"), "magneto")
+            content = "".join(response.streaming_content)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual("CREATE TABLE `foo`;\n", content)
+
+
+class InstanceExportViewTestCase(TestCase):
+
+    def test_export_dumps_the_database_of_the_instance(self):
+        Instance.objects.create(name="magneto", db_name="warm_0123abcd",
+                                state="running")
+        with mock.patch("mysqlapi.api.views.DatabaseManager") as manager:
+            manager.return_value.export_stream.return_value = iter([""])
+            export(RequestFactory().get("/"), "magneto")
+        manager.assert_called_with("warm_0123abcd", "localhost")
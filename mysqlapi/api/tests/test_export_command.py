@@ -3,62 +3,61 @@
 # license that can be found in the LICENSE file.
 
 from unittest import TestCase
-from django.conf import settings
+from django.core.management.base import CommandError
 from django.test.utils import override_settings
 
+from mysqlapi.api.backup.manifest import Manifest
 from mysqlapi.api.management.commands.export import Command
 
 import mock
-import subprocess
 
 
 class ExportCommandTestCase(TestCase):
-    def test_export(self):
-        with mock.patch("subprocess.check_output") as check_output:
-            m = "mysqlapi.api.management.commands.export.Command.send_data"
-            with mock.patch(m):
-                Command().handle_noargs()
-                cmd = ["mysqldump", "-u", "root", "--quick",
-                       "--all-databases", "--compact"]
-                check_output.assert_called_with(cmd, stderr=subprocess.STDOUT)
-
-    def test_export_should_send_data(self):
-        with mock.patch("subprocess.check_output") as check_output:
-            check_output.return_value = "data"
-            m = "mysqlapi.api.management.commands.export.Command.send_data"
-            with mock.patch(m) as send_data:
-                Command().handle_noargs()
-                send_data.assert_called_with("data")
-
-    @override_settings(S3_ACCESS_KEY="access", S3_SECRET_KEY="secret")
-    def test_send_data_should_get_keys_from_settings(self):
-        access = settings.S3_ACCESS_KEY
-        secret = settings.S3_SECRET_KEY
-        with mock.patch("boto.s3.connection.S3Connection") as s3con:
-            conn = mock.Mock()
-            s3 = s3con.return_value
-            s3.return_value = conn
-            with mock.patch("boto.s3.key.Key"):
-                Command().send_data("data")
-                s3con.assert_called_with(access, secret)
 
-    @override_settings(S3_BUCKET="bucket")
-    def test_send_data_should_get_buckets_from_settings(self):
-        bucket = settings.S3_BUCKET
-        with mock.patch("boto.s3.connection.S3Connection") as s3con:
-            conn = mock.Mock()
-            s3 = s3con.return_value
-            s3.return_value = conn
-            with mock.patch("boto.s3.key.Key"):
-                Command().send_data("data")
-                s3.get_bucket.assert_called_with(bucket)
-
-    def test_send_data(self):
-        with mock.patch("boto.s3.connection.S3Connection") as s3con:
-            conn = mock.Mock()
-            s3 = s3con.return_value
-            s3.return_value = conn
-            with mock.patch("boto.s3.key.Key") as Key:
-                key = Key.return_value
-                Command().send_data("data")
-                key.set_contents_from_string.assert_any_call("data")
+    def setUp(self):
+        patcher = mock.patch("mysqlapi.api.management.commands.s3.bucket")
+        self.bucket = patcher.start()
+        self.addCleanup(patcher.stop)
+        m = "mysqlapi.api.management.commands.export.BackupRunner"
+        patcher = mock.patch(m)
+        self.runner = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manifest = Manifest("abc123", "localhost:3306")
+        self.runner.return_value.run.return_value = self.manifest
+
+    @override_settings(BACKUP_WORKERS=3)
+    def test_export(self):
+        result = Command().handle_noargs()
+        self.assertEqual(u"Successfully exported!", result)
+        server, bucket, workers = self.runner.call_args[0]
+        self.assertEqual(self.bucket.return_value, bucket)
+        self.assertEqual(3, workers)
+        self.runner.return_value.run.assert_called_with()
+
+    def test_export_workers_option(self):
+        Command().handle_noargs(workers=8)
+        self.assertEqual(8, self.runner.call_args[0][2])
+
+    @override_settings(BACKUP_CODEC="gzip", BACKUP_CODEC_LEVEL="",
+                       BACKUP_CODEC_THREADS=2)
+    def test_export_compresses_with_the_configured_codec(self):
+        Command().handle_noargs()
+        codec = self.runner.call_args[1]["codec"]
+        self.assertEqual(("gzip", None, 2), codec)
+
+    def test_export_codec_options(self):
+        Command().handle_noargs(codec="gzip", level=9, codec_threads=8)
+        self.assertEqual(("gzip", 9, 8), self.runner.call_args[1]["codec"])
+
+    def test_export_without_compression(self):
+        Command().handle_noargs(codec="none")
+        self.assertEqual(None, self.runner.call_args[1]["codec"])
+
+    def test_export_unavailable_codec(self):
+        with self.assertRaises(CommandError):
+            Command().handle_noargs(codec="br")
+
+    def test_export_fails_when_a_database_fails(self):
+        self.manifest.errors["mydb"] = "mysqldump: Got error"
+        with self.assertRaises(CommandError):
+            Command().handle_noargs()
@@ -2,10 +2,18 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import datetime
+import threading
+import time
+import unittest
+
 from django.test import TestCase
 from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
 
-from mysqlapi.api.models import Instance
+from mysqlapi.api import health
+from mysqlapi.api.models import HealthStatus, Instance
 from mysqlapi.api.tests import mocks
 from mysqlapi.api.views import Healthcheck
 
@@ -17,6 +25,7 @@ class HealthcheckTestCase(TestCase):
     def setUp(self):
         self.instance = Instance.objects.create(name="g8mysql",
                                                 state="running")
+        health.reset()
 
     def tearDown(self):
         self.instance.delete()
@@ -62,3 +71,133 @@ class HealthcheckTestCase(TestCase):
         response = view.get(request, "g8mysql")
         self.assertEqual(202, response.status_code)
         self.assertEqual([], fake.actions)
+
+    def test_healthcheck_caches_the_result(self):
+        request = RequestFactory().get("/resources/g8mysql/status/")
+        with mock.patch("mysqlapi.api.models.DatabaseManager.is_up") as is_up:
+            is_up.return_value = True
+            view = Healthcheck()
+            view.get(request, "g8mysql")
+            is_up.return_value = False
+            response = view.get(request, "g8mysql")
+        self.assertEqual(204, response.status_code)
+        self.assertEqual(1, is_up.call_count)
+        self.assertEqual("0", response["Age"])
+
+    @override_settings(HEALTH_PROBER=True, HEALTHCHECK_CACHE_TTL=0)
+    def test_healthcheck_serves_the_result_stored_by_the_prober(self):
+        health.shared.set("g8mysql", False, 0.01)
+        request = RequestFactory().get("/resources/g8mysql/status/")
+        with mock.patch("mysqlapi.api.models.DatabaseManager.is_up") as is_up:
+            response = Healthcheck().get(request, "g8mysql")
+        self.assertEqual(500, response.status_code)
+        self.assertFalse(is_up.called)
+
+    @override_settings(HEALTH_PROBER=True, HEALTH_PROBE_INTERVAL=10)
+    def test_healthcheck_checks_when_the_prober_fell_behind(self):
+        health.shared.set("g8mysql", False, 0.01)
+        HealthStatus.objects.update(
+            checked_at=timezone.now() - datetime.timedelta(minutes=5))
+        request = RequestFactory().get("/resources/g8mysql/status/")
+        with mock.patch("mysqlapi.api.models.DatabaseManager.is_up") as is_up:
+            is_up.return_value = True
+            response = Healthcheck().get(request, "g8mysql")
+        self.assertEqual(204, response.status_code)
+        self.assertTrue(is_up.called)
+
+
+class SharedResultsTestCase(TestCase):
+
+    def test_set_and_peek(self):
+        results = health.SharedResults()
+        self.assertIsNone(results.peek("mydb"))
+        results.set("mydb", True, 0.5)
+        results.set("mydb", False, 0.25)
+        result = results.peek("mydb")
+        self.assertFalse(result.up)
+        self.assertEqual(0.25, result.latency)
+        self.assertTrue(result.age() < 5)
+        self.assertEqual(1, HealthStatus.objects.count())
+
+    def test_prune_forgets_other_keys(self):
+        results = health.SharedResults()
+        results.set("mydb", True)
+        results.set("gone", True)
+        results.prune(["mydb"])
+        self.assertEqual(["mydb"], [s.key for s in
+                                    HealthStatus.objects.all()])
+
+
+class HealthCacheTestCase(unittest.TestCase):
+
+    def test_get_runs_the_check_and_stores_the_result(self):
+        cache = health.HealthCache(ttl=60)
+        result = cache.get("mydb", lambda: True)
+        self.assertTrue(result.up)
+        self.assertEqual(result, cache.get("mydb", lambda: False))
+
+    def test_get_runs_the_check_again_when_result_expired(self):
+        cache = health.HealthCache(ttl=0)
+        cache.get("mydb", lambda: True)
+        self.assertFalse(cache.get("mydb", lambda: False).up)
+
+    def test_get_reports_check_failures_as_down(self):
+        def check():
+            raise RuntimeError("connection refused")
+        cache = health.HealthCache(ttl=60)
+        self.assertFalse(cache.get("mydb", check).up)
+
+    def concurrent_gets(self, cache, check, count):
+        """
+        Runs `count` gets at once, the check blocking until all of them
+        are waiting for it.
+        """
+        release = threading.Event()
+        results = []
+
+        def blocking_check():
+            release.wait(5)
+            return check()
+
+        def get():
+            results.append(cache.get("mydb", blocking_check))
+
+        threads = [threading.Thread(target=get) for i in range(count)]
+        for t in threads:
+            t.start()
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            inflight = cache._inflight.get("mydb")
+            if inflight is not None and inflight.waiters == count - 1:
+                break
+            time.sleep(0.01)
+        release.set()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_get_coalesces_concurrent_checks(self):
+        cache = health.HealthCache(ttl=60)
+        calls = []
+
+        def check():
+            calls.append(1)
+            return True
+
+        results = self.concurrent_gets(cache, check, 8)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(8, len(results))
+        self.assertEqual(set([results[0]]), set(results))
+        self.assertTrue(results[0].up)
+
+    def test_get_hands_the_result_to_waiters_when_cleared(self):
+        cache = health.HealthCache(ttl=0)
+
+        def check():
+            # the cache is reset before the waiters read the result.
+            cache.clear()
+            return True
+
+        results = self.concurrent_gets(cache, check, 4)
+        self.assertEqual(4, len(results))
+        self.assertTrue(all(result.up for result in results))
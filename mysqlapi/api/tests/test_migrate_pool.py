@@ -0,0 +1,39 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from unittest import TestCase
+
+from mysqlapi.api.management.commands import migrate_pool
+
+
+class MigratePoolTestCase(TestCase):
+
+    def test_up_to_date(self):
+        sql = migrate_pool.statements(
+            set(["id", "name", "db_name", "provisioned_id"]),
+            set(["id", "host", "warm_db", "capacity", "memory_mb",
+                 "disk_mb", "used"]))
+        self.assertEqual([], sql)
+
+    def test_single_database_servers(self):
+        sql = migrate_pool.statements(set(["id", "name"]),
+                                      set(["id", "host", "instance_id"]),
+                                      ["instance_id_refs_id_1234"])
+        added = [s.split(" ADD COLUMN ")[1].split()[0] for s in sql[:7]]
+        self.assertEqual(["warm_db", "capacity", "memory_mb", "disk_mb",
+                          "used", "db_name", "provisioned_id"], added)
+        self.assertEqual(list(migrate_pool.BACKFILL), sql[7:9])
+        self.assertEqual(["ALTER TABLE api_provisionedinstance "
+                          "DROP FOREIGN KEY instance_id_refs_id_1234",
+                          "ALTER TABLE api_provisionedinstance "
+                          "DROP COLUMN instance_id"], sql[9:])
+
+    def test_backfills_servers_whose_columns_were_added_by_hand(self):
+        sql = migrate_pool.statements(
+            set(["id", "name", "db_name", "provisioned_id"]),
+            set(["id", "host", "instance_id", "warm_db", "capacity",
+                 "memory_mb", "disk_mb", "used"]))
+        self.assertEqual(list(migrate_pool.BACKFILL), sql[:2])
+        self.assertEqual(["ALTER TABLE api_provisionedinstance "
+                          "DROP COLUMN instance_id"], sql[2:])
@@ -6,6 +6,7 @@
 
 import hashlib
 import mock
+import MySQLdb
 
 from django.conf import settings
 from django.db.models import BooleanField, CharField, ForeignKey, IntegerField
@@ -30,6 +31,18 @@ class DatabaseManagerTestCase(TestCase):
         self.assertRegexpMatches(db.name, "^foo_bar.*$")
 
 
+class DatabaseManagerExecuteTestCase(TestCase):
+
+    def test_execute_discards_the_connection_on_operational_errors(self):
+        db = DatabaseManager("mydb", host="10.0.0.1")
+        db.conn = mock.Mock()
+        db.conn.cursor.return_value.execute.side_effect = \
+            MySQLdb.OperationalError(2013, "lost connection")
+        with self.assertRaises(MySQLdb.OperationalError):
+            db.create_database()
+        db.conn.discard.assert_called_once_with()
+
+
 class InstanceTestCase(TestCase):
 
     def setUp(self):
@@ -199,7 +212,7 @@ class InstanceTestCase(TestCase):
                                                 admin_password="")
         self.addCleanup(pi.delete)
         pi.alloc(instance)
-        self.addCleanup(pi.dealloc)
+        self.addCleanup(pi.dealloc, instance)
         pi.admin_user = "notroot"
         pi.admin_password = "12345"
         pi.save()
@@ -234,12 +247,20 @@ class InstanceTestCase(TestCase):
 
 class ProvisionedInstanceTestCase(TestCase):
 
-    def test_instance(self):
-        field = ProvisionedInstance._meta.get_field_by_name("instance")[0]
+    def setUp(self):
+        self.manager = mock.Mock()
+
+    def create(self, **kwargs):
+        pi = ProvisionedInstance.objects.create(**kwargs)
+        pi._manager = mock.Mock(return_value=self.manager)
+        return pi
+
+    def test_provisioned(self):
+        field = Instance._meta.get_field_by_name("provisioned")[0]
         self.assertIsInstance(field, ForeignKey)
-        self.assertEqual(Instance, field.related.parent_model)
+        self.assertEqual(ProvisionedInstance, field.related.parent_model)
         self.assertTrue(field.null)
-        self.assertTrue(field.unique)
+        self.assertFalse(field.unique)
 
     def test_host(self):
         field = ProvisionedInstance._meta.get_field_by_name("host")[0]
@@ -264,93 +285,196 @@ class ProvisionedInstanceTestCase(TestCase):
         self.assertEqual(255, field.max_length)
         self.assertTrue(field.blank)
 
+    def test_capacity(self):
+        field = ProvisionedInstance._meta.get_field_by_name("capacity")[0]
+        self.assertIsInstance(field, IntegerField)
+        self.assertEqual(1, field.default)
+
+    @override_settings(POOL_TENANT_MEMORY_MB=512, POOL_TENANT_DISK_MB=0)
+    def test_slots_are_limited_by_memory(self):
+        pi = ProvisionedInstance(capacity=10, memory_mb=2048, disk_mb=100)
+        self.assertEqual(4, pi.slots)
+        pi.used = 3
+        self.assertEqual(1, pi.free_slots)
+        pi.used = 5
+        self.assertEqual(0, pi.free_slots)
+
+    @override_settings(POOL_TENANT_MEMORY_MB=512, POOL_TENANT_DISK_MB=1024)
+    def test_slots_are_limited_by_disk(self):
+        pi = ProvisionedInstance(capacity=10, memory_mb=8192, disk_mb=2048)
+        self.assertEqual(2, pi.slots)
+        pi = ProvisionedInstance(capacity=10)
+        self.assertEqual(10, pi.slots)
+
     def test_manager(self):
-        pi = ProvisionedInstance(instance=Instance(name="mydb"),
-                                 host="10.10.10.10",
+        pi = ProvisionedInstance(host="10.10.10.10",
                                  port=3306,
                                  admin_user="root",
                                  admin_password="root")
         with mock.patch("mysqlapi.api.models.DatabaseManager") as dm:
-            pi._manager()
+            pi._manager("mydb")
             dm.assert_called_with(name="mydb", host="10.10.10.10", port=3306,
                                   user="root", password="root")
 
-    def test_manager_already_defined(self):
-        pi = ProvisionedInstance()
-        pi._db_manager = "something not real"
-        self.assertEqual("something not real", pi._manager())
-
     def test_alloc(self):
-        pi = ProvisionedInstance(host="localhost",
-                                 admin_user="root",
-                                 admin_password="")
-        pi.save()
-        self.addCleanup(pi.delete)
-        db_manager = mock.Mock()
-        pi._db_manager = db_manager
+        pi = self.create(host="localhost")
         instance = Instance(name="hibria")
         pi.alloc(instance)
-        self.addCleanup(instance.delete)
         self.assertIsNotNone(instance.pk)
         self.assertIsNone(instance.ec2_id)
         self.assertFalse(instance.shared)
         self.assertEqual("running", instance.state)
         self.assertEqual("localhost", instance.host)
         self.assertEqual("3306", instance.port)
-        self.assertEqual(instance, pi.instance)
-        db_manager.create_database.assert_called()
+        self.assertEqual(pi, Instance.objects.get().provisioned)
+        self.assertEqual(1, ProvisionedInstance.objects.get().used)
+        pi._manager.assert_called_with("hibria")
+        self.manager.create_database.assert_called_with()
+
+    def test_alloc_packs_databases_up_to_the_capacity(self):
+        pi = self.create(host="localhost", capacity=2)
+        pi.alloc(Instance(name="first"))
+        pi.alloc(Instance(name="second"))
+        with self.assertRaises(models.InstanceUnavailable):
+            pi.alloc(Instance(name="third"))
+        self.assertEqual(["first", "second"], sorted(
+            pi.tenants.values_list("name", flat=True)))
+        self.assertEqual(2, ProvisionedInstance.objects.get().used)
 
     def test_alloc_create_database_failure(self):
-        pi = ProvisionedInstance(host="localhost",
-                                 admin_user="root",
-                                 admin_password="")
-        pi.save()
-        self.addCleanup(pi.delete)
-        db_manager = mock.Mock()
-        db_manager.create_database.side_effect = TypeError("blow up")
-        pi._db_manager = db_manager
+        pi = self.create(host="localhost")
+        self.manager.create_database.side_effect = TypeError("blow up")
         instance = Instance(name="hibria")
         with self.assertRaises(DatabaseCreationError):
             pi.alloc(instance)
-        self.assertIsNone(instance.pk)
+        self.assertFalse(Instance.objects.exists())
+        self.assertEqual(0, ProvisionedInstance.objects.get().used)
 
-    def test_alloc_already_allocated(self):
-        pi = ProvisionedInstance(instance=Instance(name="mydb"),
-                                 host="10.10.10.10",
-                                 port=3306,
-                                 admin_user="root",
-                                 admin_password="root")
+    def test_alloc_full(self):
+        pi = ProvisionedInstance(host="10.10.10.10", used=1)
         with self.assertRaises(TypeError) as cm:
             pi.alloc(Instance(name="yourdb"))
         exc = cm.exception
         self.assertEqual("This instance is not available", exc.args[0])
 
+    def test_alloc_lost_race(self):
+        pi = self.create(host="localhost")
+        stale = ProvisionedInstance.objects.get(pk=pi.pk)
+        stale._manager = pi._manager
+        first = Instance(name="first")
+        pi.alloc(first)
+        second = Instance(name="second")
+        with self.assertRaises(models.InstanceUnavailable):
+            stale.alloc(second)
+        self.assertIsNone(second.pk)
+        self.assertFalse(Instance.objects.filter(name="second").exists())
+        self.assertEqual([first], list(pi.tenants.all()))
+
     def test_dealloc(self):
-        pi = ProvisionedInstance(host="localhost",
-                                 admin_user="root",
-                                 admin_password="")
-        pi.save()
-        self.addCleanup(pi.delete)
-        db_manager = mock.Mock()
-        pi._db_manager = db_manager
+        pi = self.create(host="localhost", capacity=2)
         instance = Instance(name="hibria")
         pi.alloc(instance)
-        self.addCleanup(instance.delete)
-        pi.dealloc()
-        self.assertIsNone(pi.instance)
+        pi.alloc(Instance(name="other"))
+        pi.dealloc(instance)
         self.assertEqual("stopped", instance.state)
-        db_manager.drop_database.assert_called()
+        self.assertIsNone(Instance.objects.get(name="hibria").provisioned)
+        self.assertEqual(["other"], [i.name for i in pi.tenants.all()])
+        self.assertEqual(1, ProvisionedInstance.objects.get().used)
+        pi._manager.assert_called_with("hibria")
+        self.manager.drop_database.assert_called_with()
 
     def test_dealloc_already_freed(self):
-        pi = ProvisionedInstance(host="10.10.10.10",
-                                 port=3306,
-                                 admin_user="root",
-                                 admin_password="root")
+        pi = self.create(host="10.10.10.10")
         with self.assertRaises(TypeError) as cm:
-            pi.dealloc()
+            pi.dealloc(Instance(name="mydb"))
         exc = cm.exception
         self.assertEqual("This instance is not allocated", exc.args[0])
 
+    def test_dealloc_instance_not_linked_to_its_server(self):
+        pi = self.create(host="10.10.10.10", port=3307)
+        self.create(host="10.10.10.10")
+        instance = Instance.objects.create(name="mydb", host="10.10.10.10",
+                                           port="3307", state="running")
+        self.assertEqual(pi, instance.legacy_provisioned())
+        pi.dealloc(instance)
+        self.assertIsNone(Instance.objects.get(name="mydb").provisioned)
+        self.manager.drop_database.assert_called_with()
+
+    def test_legacy_provisioned_without_server(self):
+        instance = Instance(name="mydb", host="10.10.10.10", port="3306")
+        self.assertIsNone(instance.legacy_provisioned())
+        self.assertIsNone(Instance(name="mydb").legacy_provisioned())
+
+
+class CreateFromPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.manager = mock.Mock()
+        patcher = mock.patch.object(ProvisionedInstance, "_manager",
+                                    return_value=self.manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_create_from_pool(self):
+        pi = ProvisionedInstance.objects.create(host="10.0.0.1")
+        instance = Instance(name="mydb")
+        models._create_from_pool(instance)
+        self.assertEqual("running", instance.state)
+        self.assertEqual("10.0.0.1", instance.host)
+        self.assertEqual([instance], list(pi.tenants.all()))
+
+    def test_create_from_pool_packs_the_fullest_server(self):
+        ProvisionedInstance.objects.create(host="10.0.0.1", capacity=4)
+        ProvisionedInstance.objects.create(host="10.0.0.2", capacity=4,
+                                           used=2)
+        ProvisionedInstance.objects.create(host="10.0.0.3", capacity=4,
+                                           used=4)
+        hosts = []
+        for i in range(3):
+            instance = Instance(name="mydb%d" % i)
+            models._create_from_pool(instance)
+            hosts.append(instance.host)
+        self.assertEqual(["10.0.0.2", "10.0.0.2", "10.0.0.1"], hosts)
+
+    def test_free_provisioned_instances(self):
+        ProvisionedInstance.objects.create(host="10.0.0.1", capacity=4)
+        ProvisionedInstance.objects.create(host="10.0.0.2", capacity=4,
+                                           used=1)
+        ProvisionedInstance.objects.create(host="10.0.0.3", capacity=4,
+                                           used=1, warm_db="warm_abc")
+        ProvisionedInstance.objects.create(host="10.0.0.4", used=1)
+        free = models.free_provisioned_instances()
+        self.assertEqual(["10.0.0.3", "10.0.0.2", "10.0.0.1"],
+                         [pi.host for pi in free])
+
+    def test_create_from_pool_moves_on_when_another_request_wins(self):
+        for i in range(2):
+            ProvisionedInstance.objects.create(host="10.0.0.%d" % i)
+        original = ProvisionedInstance.alloc
+
+        def alloc(pi, instance):
+            # another request fills the first candidate right before.
+            if not ProvisionedInstance.objects.filter(used=1).exists():
+                ProvisionedInstance.objects.filter(pk=pi.pk).update(used=1)
+            return original(pi, instance)
+
+        with mock.patch.object(ProvisionedInstance, "alloc", alloc):
+            instance = Instance(name="mydb")
+            models._create_from_pool(instance)
+        self.assertEqual("running", instance.state)
+        self.assertEqual([1, 1], list(ProvisionedInstance.objects.values_list(
+            "used", flat=True)))
+
+    @override_settings(POOL_ALLOC_ATTEMPTS=2)
+    def test_create_from_pool_none_left(self):
+        ProvisionedInstance.objects.create(host="10.0.0.1", used=1)
+        instance = Instance(name="mydb")
+        with self.assertRaises(DatabaseCreationError) as cm:
+            models._create_from_pool(instance)
+        self.assertEqual("No free instances available in the pool",
+                         cm.exception.args[1])
+        self.assertFalse(Instance.objects.filter(name="mydb").exists())
+
 
 class CanonicalizeTestCase(TestCase):
 
@@ -0,0 +1,190 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+import json
+
+import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from mysqlapi.api import models, pool
+from mysqlapi.api.models import (Instance, PoolAllocation,
+                                 ProvisionedInstance)
+from mysqlapi.api.tests import mocks
+from mysqlapi.api.views import pool_forecast, pool_hosts
+
+
+@override_settings(POOL_FORECAST_WINDOW=3600, POOL_LEAD_TIME=7200,
+                   POOL_MIN_FREE=1, POOL_MAX_PROVISION=10)
+class ForecastTestCase(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def add_free(self, count, warm=False):
+        for i in range(count):
+            ProvisionedInstance.objects.create(
+                host="10.0.0.%d" % i, warm_db="warm_%d" % i if warm else "")
+
+    def allocate(self, count, minutes_ago=10):
+        at = self.now - datetime.timedelta(minutes=minutes_ago)
+        for i in range(count):
+            PoolAllocation.objects.create(host="10.0.0.1")
+        PoolAllocation.objects.update(created_at=at)
+
+    def test_forecast_without_allocations(self):
+        self.add_free(2, warm=True)
+        f = pool.forecast(self.now)
+        self.assertEqual((2, 2, 0, 0.0), (f.free, f.warm, f.allocated, f.rate))
+        self.assertIsNone(f.hours_left)
+        self.assertEqual(1, f.threshold)
+        self.assertEqual(0, f.needed)
+
+    def test_forecast(self):
+        self.add_free(3)
+        self.allocate(4)
+        f = pool.forecast(self.now)
+        self.assertEqual(4.0, f.rate)
+        self.assertEqual(0.75, f.hours_left)
+        self.assertEqual(8, f.threshold)
+        self.assertEqual(5, f.needed)
+
+    def test_forecast_counts_the_room_left_on_each_server(self):
+        ProvisionedInstance.objects.create(host="10.0.0.1", capacity=4,
+                                           used=1, warm_db="warm_abc")
+        ProvisionedInstance.objects.create(host="10.0.0.2", capacity=2,
+                                           used=2)
+        f = pool.forecast(self.now)
+        self.assertEqual((3, 1), (f.free, f.warm))
+
+    @override_settings(POOL_HOST_CAPACITY=4)
+    def test_forecast_needed_servers(self):
+        self.allocate(5)
+        f = pool.forecast(self.now, pending=1)
+        self.assertEqual(6, f.needed)
+        self.assertEqual(2, f.servers)
+
+    @override_settings(POOL_HOST_CAPACITY=0)
+    def test_forecast_servers_hold_a_database_at_least(self):
+        self.allocate(5)
+        f = pool.forecast(self.now, pending=1)
+        self.assertEqual(9, f.needed)
+        self.assertEqual(9, f.servers)
+
+    def test_forecast_ignores_old_allocations(self):
+        self.allocate(4, minutes_ago=61)
+        f = pool.forecast(self.now)
+        self.assertEqual(0, f.allocated)
+        self.assertEqual(1, f.needed)
+
+    def test_forecast_counts_pending_instances(self):
+        self.allocate(4)
+        self.assertEqual(3, pool.forecast(self.now, pending=5).needed)
+
+    def test_controller_provisions_what_is_needed(self):
+        self.add_free(1)
+        self.allocate(2)
+        provisioner = mocks.FakeProvisioner()
+        controller = pool.PoolController(provisioner)
+        with mock.patch("mysqlapi.api.pool.warmer") as warmer:
+            f, added = controller.tick(self.now)
+        self.assertEqual([3], provisioner.requests)
+        self.assertEqual(3, len(added))
+        self.assertEqual(4, pool.forecast(self.now).free)
+        warmer.wake.assert_called_once_with()
+        f, added = controller.tick(self.now)
+        self.assertEqual(0, f.needed)
+        self.assertEqual([], added)
+
+    @override_settings(POOL_HOST_CAPACITY=4)
+    def test_controller_provisions_servers_of_the_host_capacity(self):
+        self.allocate(5)
+        provisioner = mocks.FakeProvisioner()
+        with mock.patch("mysqlapi.api.pool.warmer"):
+            pool.PoolController(provisioner).tick(self.now)
+        self.assertEqual([3], provisioner.requests)
+        self.assertEqual([4, 4, 4], list(
+            ProvisionedInstance.objects.values_list("capacity", flat=True)))
+
+    @override_settings(POOL_MAX_PROVISION=2)
+    def test_controller_caps_provisioning(self):
+        self.allocate(10)
+        provisioner = mocks.FakeProvisioner()
+        pool.PoolController(provisioner).tick(self.now)
+        self.assertEqual([2], provisioner.requests)
+
+    @override_settings(POOL_HOST_CAPACITY=0)
+    def test_controller_provisions_servers_of_one_database_at_least(self):
+        self.allocate(1)
+        with mock.patch("mysqlapi.api.pool.warmer"):
+            pool.PoolController(mocks.FakeProvisioner()).tick(self.now)
+        self.assertEqual([1, 1], list(
+            ProvisionedInstance.objects.values_list("capacity", flat=True)))
+
+    def test_prune(self):
+        self.allocate(2, minutes_ago=61)
+        PoolAllocation.objects.create(host="10.0.0.1")
+        pool.PoolController(mocks.FakeProvisioner()).prune(self.now)
+        self.assertEqual(1, PoolAllocation.objects.count())
+
+    def test_create_from_pool_records_the_allocation(self):
+        self.add_free(1, warm=True)
+        with mock.patch("mysqlapi.api.models.warmer"):
+            models._create_from_pool(Instance(name="mydb"))
+        self.assertEqual(["10.0.0.0"], [a.host for a in
+                                        PoolAllocation.objects.all()])
+
+    @override_settings(POOL_PROVISIONER="mysqlapi.api.tests.mocks."
+                                        "FakeProvisioner")
+    def test_get_provisioner(self):
+        self.assertIsInstance(pool.get_provisioner(), mocks.FakeProvisioner)
+        self.assertIsNone(pool.get_provisioner(""))
+
+    def test_provisioner_is_abstract(self):
+        with self.assertRaises(TypeError):
+            pool.get_provisioner("mysqlapi.api.pool.Provisioner")
+
+    @override_settings(POOL_PROVISIONER="")
+    def test_forecast_view(self):
+        self.add_free(3)
+        self.allocate(4)
+        request = RequestFactory().get("/pool/forecast")
+        response = pool_forecast(request)
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.content)
+        self.assertEqual(3, data["free"])
+        self.assertEqual(4.0, data["rate"])
+        self.assertEqual(5, data["needed"])
+
+    @override_settings(POOL_TENANT_MEMORY_MB=1024)
+    def test_hosts_view(self):
+        ProvisionedInstance.objects.create(host="10.0.0.2", capacity=10,
+                                           memory_mb=4096, used=3)
+        ProvisionedInstance.objects.create(host="10.0.0.1", capacity=2,
+                                           warm_db="warm_abc")
+        request = RequestFactory().get("/pool/hosts")
+        response = pool_hosts(request)
+        self.assertEqual(200, response.status_code)
+        expected = [{"host": "10.0.0.1", "port": 3306, "slots": 2, "used": 0,
+                     "free": 2, "utilization": 0.0, "warm": True},
+                    {"host": "10.0.0.2", "port": 3306, "slots": 4, "used": 3,
+                     "free": 1, "utilization": 0.75, "warm": False}]
+        self.assertEqual(expected, json.loads(response.content))
+
+    @override_settings(POOL_PROVISIONER="mysqlapi.api.tests.mocks."
+                                        "FakeProvisioner")
+    def test_control_pool_once(self):
+        with mock.patch("mysqlapi.api.pool.warmer"):
+            call_command("control_pool", once=True)
+        self.assertEqual(1, ProvisionedInstance.objects.count())
+
+    @override_settings(POOL_PROVISIONER="")
+    def test_control_pool_without_provisioner(self):
+        with self.assertRaises(CommandError):
+            call_command("control_pool", once=True)
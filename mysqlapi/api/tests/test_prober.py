@@ -0,0 +1,80 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from mysqlapi.api import health, prober
+from mysqlapi.api.models import (DatabaseManager, HealthStatus, Instance,
+                                 ProvisionedInstance)
+
+import mock
+
+
+@override_settings(SHARED_SERVER="10.0.0.1")
+class HealthProberTestCase(TestCase):
+
+    def setUp(self):
+        prober.set_models(Instance, ProvisionedInstance, DatabaseManager)
+        Instance.objects.create(name="shared1", state="running", shared=True)
+        Instance.objects.create(name="shared2", state="running", shared=True)
+        Instance.objects.create(name="dedicated", state="running",
+                                host="10.0.0.2")
+        Instance.objects.create(name="booting", state="pending",
+                                host="10.0.0.3")
+        self.pi = ProvisionedInstance.objects.create(host="10.0.0.4")
+        self.cache = health.HealthCache(ttl=60)
+
+    def test_targets_groups_instances_by_server(self):
+        keys = sorted(sorted(k) for _, k in prober.targets())
+        expected = [["dedicated"],
+                    [prober.provisioned_key(self.pi)],
+                    ["shared1", "shared2"]]
+        self.assertEqual(expected, keys)
+
+    def test_sweep_stores_the_result_of_every_instance(self):
+        with mock.patch("mysqlapi.api.models.DatabaseManager.is_up") as is_up:
+            is_up.side_effect = lambda: True
+            counts = prober.HealthProber(10, 2, self.cache).sweep()
+        self.assertEqual(3, is_up.call_count)
+        self.assertEqual(3, counts["up"])
+        for key in ("shared1", "shared2", "dedicated",
+                    prober.provisioned_key(self.pi)):
+            result = self.cache.peek(key)
+            self.assertTrue(result.up)
+            self.assertIsNotNone(result.latency)
+        self.assertIsNone(self.cache.peek("booting"))
+
+    def test_sweep_records_instances_that_are_down(self):
+        with mock.patch("mysqlapi.api.models.DatabaseManager.is_up") as is_up:
+            is_up.return_value = False
+            counts = prober.HealthProber(10, 2, self.cache).sweep()
+        self.assertEqual(3, counts["down"])
+        self.assertFalse(self.cache.peek("dedicated").up)
+
+    def test_sweep_forgets_instances_that_are_gone(self):
+        self.cache.set("removed", True)
+        with mock.patch("mysqlapi.api.models.DatabaseManager.is_up") as is_up:
+            is_up.return_value = True
+            prober.HealthProber(10, 2, self.cache).sweep()
+        self.assertIsNone(self.cache.peek("removed"))
+
+    def test_sweep_stores_the_results_in_the_database_by_default(self):
+        with mock.patch("mysqlapi.api.models.DatabaseManager.is_up") as is_up:
+            is_up.return_value = True
+            prober.HealthProber(10, 2).sweep()
+        self.assertTrue(health.shared.peek("dedicated").up)
+        self.assertEqual(4, HealthStatus.objects.count())
+
+
+class ProbeHealthCommandTestCase(TestCase):
+
+    def test_once(self):
+        Instance.objects.create(name="dedicated", state="running",
+                                host="10.0.0.2")
+        with mock.patch("mysqlapi.api.models.DatabaseManager.is_up") as is_up:
+            is_up.return_value = False
+            call_command("probe_health", once=True)
+        self.assertFalse(health.shared.peek("dedicated").up)
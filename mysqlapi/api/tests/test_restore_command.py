@@ -2,11 +2,130 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
-from unittest import TestCase
+import time
 
+from StringIO import StringIO
+
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from mysqlapi.api.backup import dump
+from mysqlapi.api.backup.manifest import Manifest
+from mysqlapi.api.backup.restore import RestoreError
+from mysqlapi.api.management.commands import s3
 from mysqlapi.api.management.commands.restore import Command
+from mysqlapi.api.models import Instance, ProvisionedInstance
+from mysqlapi.api.tests import mocks
+
+import mock
 
 
 class RestoreCommandTestCase(TestCase):
-    def test_restore(self):
-        Command().handle_noargs()
+
+    def setUp(self):
+        self.bucket = mocks.FakeBucket()
+        manifest = Manifest("abc123", "localhost:3306")
+        manifest.add(database="app1", kind="database",
+                     key="abc123/app1.sql", size=4)
+        s3.store_manifest(self.bucket, manifest)
+        patcher = mock.patch("mysqlapi.api.management.commands.s3.bucket")
+        patcher.start().return_value = self.bucket
+        self.addCleanup(patcher.stop)
+        m = "mysqlapi.api.management.commands.restore.Restorer"
+        patcher = mock.patch(m)
+        self.restorer = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.command = Command()
+        self.command.stdout = StringIO()
+
+    def test_restore_latest_backup(self):
+        result = self.command.handle_noargs()
+        self.assertEqual(u"Successfully restored!", result)
+        manifest = self.restorer.call_args[0][2]
+        self.assertEqual("abc123", manifest.id)
+        self.restorer.return_value.restore.assert_called_with(None)
+        server = self.restorer.call_args[0][0]
+        self.assertEqual("localhost:3306", dump.address(server))
+
+    def test_restore_selected_databases(self):
+        self.command.handle_noargs(backup="abc123", databases=["app1"])
+        self.restorer.return_value.restore.assert_called_with(["app1"])
+
+    def test_restore_unknown_backup(self):
+        with self.assertRaises(CommandError):
+            self.command.handle_noargs(backup="unknown")
+
+    def test_restore_with_threads(self):
+        self.command.handle_noargs(threads=4)
+        self.assertEqual(4, self.restorer.call_args[1]["threads"])
+
+    def test_restore_until(self):
+        self.command.handle_noargs(backup="abc123",
+                                   until="2015-06-01 12:30:00")
+        until = self.restorer.call_args[1]["until"]
+        self.assertEqual((2015, 6, 1, 12, 30, 0),
+                         time.localtime(until)[:6])
+
+    def test_restore_until_invalid_time(self):
+        with self.assertRaises(CommandError):
+            self.command.handle_noargs(until="yesterday")
+
+    def test_restore_errors(self):
+        self.restorer.return_value.restore.side_effect = RestoreError("gap")
+        with self.assertRaises(CommandError):
+            self.command.handle_noargs()
+
+    def test_restore_uses_the_catalog_to_find_the_backup(self):
+        m = "mysqlapi.api.backup.catalog.latest"
+        with mock.patch(m) as latest:
+            latest.return_value.backup_id = "abc123"
+            self.command.handle_noargs(databases=["app1"],
+                                       until="2015-06-01 12:30:00")
+        kwargs = latest.call_args[1]
+        self.assertEqual("app1", kwargs["database"])
+        self.assertEqual(2015, kwargs["before"].year)
+        manifest = self.restorer.call_args[0][2]
+        self.assertEqual("abc123", manifest.id)
+
+    def test_restore_until_without_backup_before(self):
+        m = "mysqlapi.api.backup.catalog.latest"
+        with mock.patch(m) as latest:
+            latest.return_value = None
+            with self.assertRaises(CommandError):
+                self.command.handle_noargs(until="2015-06-01 12:30:00")
+
+    def test_restore_latest_backup_of_a_server(self):
+        m = "mysqlapi.api.backup.catalog.latest"
+        with mock.patch(m) as latest:
+            latest.return_value.backup_id = "abc123"
+            self.command.handle_noargs(server="10.0.0.1:3306",
+                                       databases=["app1", "app2"])
+        kwargs = latest.call_args[1]
+        self.assertEqual("10.0.0.1:3306", kwargs["server"])
+        self.assertEqual(["app1", "app2"], kwargs["databases"])
+
+    def test_restore_server_without_backups(self):
+        with self.assertRaises(CommandError):
+            self.command.handle_noargs(server="10.0.0.1:3306")
+
+    def test_restore_into_the_server_of_the_backup(self):
+        pi = ProvisionedInstance.objects.create(host="10.0.0.1",
+                                                admin_user="admin",
+                                                admin_password="secret")
+        Instance.objects.create(name="app1", host="10.0.0.1",
+                                state="running", provisioned=pi)
+        manifest = Manifest("def456", "10.0.0.1:3306")
+        manifest.add(database="app1", kind="database",
+                     key="def456/app1.sql", size=4)
+        s3.store_manifest(self.bucket, manifest, last=False)
+        self.command.handle_noargs(backup="def456")
+        server = self.restorer.call_args[0][0]
+        self.assertEqual("10.0.0.1:3306", dump.address(server))
+        self.assertEqual("admin", server.username)
+        self.assertEqual("secret", server.password)
+
+    def test_restore_backup_of_an_unknown_server(self):
+        manifest = Manifest("def456", "10.0.0.9:3306")
+        s3.store_manifest(self.bucket, manifest, last=False)
+        with self.assertRaises(CommandError):
+            self.command.handle_noargs(backup="def456")
@@ -6,7 +6,9 @@ from unittest import TestCase
 from django.conf import settings
 from django.test.utils import override_settings
 
+from mysqlapi.api.backup.manifest import Manifest
 from mysqlapi.api.management.commands import s3
+from mysqlapi.api.tests import mocks
 
 import mock
 
@@ -20,6 +22,16 @@ class S3TestCase(TestCase):
             s3.connect()
             s3con.assert_called_with(access, secret)
 
+    @override_settings(S3_ACCESS_KEY="access", S3_SECRET_KEY="secret",
+                       S3_HOST="localhost", S3_PORT=9000, S3_SECURE=False)
+    def test_connection_to_a_custom_endpoint(self):
+        with mock.patch("boto.s3.connection.S3Connection") as s3con:
+            s3.connect()
+            _, kwargs = s3con.call_args
+        self.assertEqual("localhost", kwargs["host"])
+        self.assertEqual(9000, kwargs["port"])
+        self.assertFalse(kwargs["is_secure"])
+
     @override_settings(S3_BUCKET="bucket")
     def test_get_buckets_from_settings(self):
         bucket = settings.S3_BUCKET
@@ -40,34 +52,93 @@ class S3TestCase(TestCase):
             bucket_mock.return_value = bucket
             self.assertEqual("last_key", s3.last_key())
 
-    def test_store_data(self):
-        with mock.patch("mysqlapi.api.management.commands.s3.bucket"):
-            with mock.patch("boto.s3.key.Key") as Key:
-                key = Key.return_value
-                s3.store_data("data")
-                key.set_contents_from_string.assert_any_call("data")
-
-    def test_store_data_should_use_uuid_in_key_name(self):
-        with mock.patch("mysqlapi.api.management.commands.s3.bucket"):
-            with mock.patch("boto.s3.key.Key") as Key:
-                key = Key.return_value
-                with mock.patch("uuid.uuid4"):
-                    s3.store_data("data")
-                    key.set_contents_from_string.assert_called_with(Key().name)
-
-    def test_store_data_should_store_last_key(self):
-        with mock.patch("mysqlapi.api.management.commands.s3.bucket"):
-            with mock.patch("uuid.uuid4") as uuid4:
-                uuid4.return_value = mock.Mock(hex="uuid")
-                key = s3.store_data("data")
-        self.assertEqual("uuid", key.name)
-
-    def test_get_data(self):
-        m = "mysqlapi.api.management.commands.s3.bucket"
-        with mock.patch(m) as bucket_mock:
-            key = mock.Mock()
-            key.get_contents_as_string.return_value = "last_key"
-            bucket = mock.Mock()
-            bucket.get_key.return_value = key
-            bucket_mock.return_value = bucket
-            self.assertEqual("last_key", s3.get_data())
+    def test_read_stream(self):
+        bucket = mocks.FakeBucket()
+        bucket.new_key("backup").set_contents_from_string("abcde")
+        chunks = list(s3.read_stream(bucket, "backup", chunk_size=2))
+        self.assertEqual(["ab", "cd", "e"], chunks)
+
+    def test_read_stream_not_found(self):
+        with self.assertRaises(KeyError):
+            list(s3.read_stream(mocks.FakeBucket(), "backup"))
+
+
+class MultipartUploadTestCase(TestCase):
+
+    def setUp(self):
+        self.bucket = mocks.FakeBucket()
+
+    def test_upload_splits_the_stream_in_parts(self):
+        upload = s3.MultipartUpload(self.bucket, "backup", part_size=4,
+                                    concurrency=2)
+        upload.upload(iter(["ab", "cd", "ef", "gh", "i"]))
+        mp = self.bucket.uploads[0]
+        self.assertEqual({1: "abcd", 2: "efgh", 3: "i"}, mp.parts)
+        self.assertTrue(mp.completed)
+        self.assertEqual(9, upload.size)
+        self.assertEqual("abcdefghi",
+                         self.bucket.keys["backup"].get_contents_as_string())
+
+    def test_upload_of_an_empty_stream(self):
+        upload = s3.MultipartUpload(self.bucket, "backup", part_size=4,
+                                    concurrency=2)
+        upload.upload(iter([]))
+        self.assertEqual("", self.bucket.keys["backup"].data)
+
+    def test_upload_is_cancelled_when_the_stream_fails(self):
+        def chunks():
+            yield "abcd"
+            raise RuntimeError("mysqldump died")
+
+        upload = s3.MultipartUpload(self.bucket, "backup", part_size=4,
+                                    concurrency=2)
+        with self.assertRaises(RuntimeError):
+            upload.upload(chunks())
+        mp = self.bucket.uploads[0]
+        self.assertTrue(mp.cancelled)
+        self.assertFalse(mp.completed)
+
+    def test_upload_is_cancelled_when_a_part_fails(self):
+        upload = s3.MultipartUpload(self.bucket, "backup", part_size=2,
+                                    concurrency=1)
+        with mock.patch.object(mocks.FakeMultiPartUpload,
+                               "upload_part_from_file") as upload_part:
+            upload_part.side_effect = IOError("connection reset")
+            with self.assertRaises(IOError):
+                upload.upload(iter(["ab"] * 10))
+        self.assertTrue(self.bucket.uploads[0].cancelled)
+
+    @override_settings(S3_PART_SIZE=4, S3_UPLOAD_CONCURRENCY=2)
+    def test_upload_stream(self):
+        upload = s3.upload_stream(self.bucket, "backup", iter(["data"]))
+        self.assertEqual(4, upload.size)
+        self.assertEqual("data", self.bucket.keys["backup"].data)
+
+
+class ManifestStorageTestCase(TestCase):
+
+    def test_store_manifest_should_store_last_key(self):
+        bucket = mocks.FakeBucket()
+        manifest = Manifest("abc123", "localhost:3306")
+        s3.store_manifest(bucket, manifest)
+        self.assertEqual("abc123", bucket.keys["lastkey"].data)
+        self.assertEqual(manifest.to_json(),
+                         bucket.keys["abc123/manifest.json"].data)
+
+    def test_store_manifest_without_moving_the_last_key(self):
+        bucket = mocks.FakeBucket()
+        s3.store_manifest(bucket, Manifest("abc123", "localhost:3306"),
+                          last=False)
+        self.assertNotIn("lastkey", bucket.keys)
+        self.assertIn("abc123/manifest.json", bucket.keys)
+
+    def test_get_manifest(self):
+        bucket = mocks.FakeBucket()
+        manifest = Manifest("abc123", "localhost:3306")
+        manifest.add(database="mydb", key="abc123/mydb.sql", size=4)
+        s3.store_manifest(bucket, manifest)
+        stored = s3.get_manifest(bucket, "abc123")
+        self.assertEqual(manifest.entries, stored.entries)
+
+    def test_get_manifest_not_found(self):
+        self.assertIsNone(s3.get_manifest(mocks.FakeBucket(), "abc123"))
@@ -0,0 +1,126 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import mock
+from django.test import TestCase
+
+from mysqlapi.api import models, warmer
+from mysqlapi.api.models import Instance, ProvisionedInstance
+
+
+class WarmerTestCase(TestCase):
+
+    def setUp(self):
+        self.manager = mock.Mock()
+        warmer.set_models(ProvisionedInstance, self.manager)
+        self.pi = ProvisionedInstance.objects.create(host="10.0.0.1",
+                                                     admin_user="admin")
+
+    def test_warm(self):
+        name = warmer.warm(self.pi)
+        self.assertTrue(name.startswith("warm_"))
+        self.manager.assert_called_with(name, host="10.0.0.1", port=3306,
+                                        user="admin", password="")
+        self.manager.return_value.create_database.assert_called_with()
+        self.assertEqual(name, ProvisionedInstance.objects.get().warm_db)
+
+    def test_warm_filled_in_the_meantime(self):
+        ProvisionedInstance.objects.update(used=1)
+        self.assertIsNone(warmer.warm(self.pi))
+        self.manager.return_value.drop_database.assert_called_with()
+        self.assertEqual("", ProvisionedInstance.objects.get().warm_db)
+
+    def test_refill_warms_the_cold_instances_with_room_left(self):
+        ProvisionedInstance.objects.create(host="10.0.0.2",
+                                           warm_db="warm_ready")
+        ProvisionedInstance.objects.create(host="10.0.0.3", used=1)
+        w = warmer.PoolWarmer(60)
+        w.refill()
+        self.assertEqual({"warmed": 1, "failed": 0}, w.stats)
+        self.assertEqual(1, self.manager.call_count)
+        self.assertNotEqual("", ProvisionedInstance.objects.get(
+            pk=self.pi.pk).warm_db)
+
+    def test_refill_warms_servers_holding_databases(self):
+        ProvisionedInstance.objects.update(capacity=2, used=1)
+        warmer.PoolWarmer(60).refill()
+        self.assertNotEqual("", ProvisionedInstance.objects.get().warm_db)
+
+    def test_refill_counts_failures(self):
+        self.manager.return_value.create_database.side_effect = \
+            Exception("server is gone")
+        w = warmer.PoolWarmer(60)
+        with mock.patch("sys.stderr"):
+            w.refill()
+        self.assertEqual({"warmed": 0, "failed": 1}, w.stats)
+
+
+class WarmAllocTestCase(TestCase):
+
+    def setUp(self):
+        self.manager = mock.Mock()
+        patcher = mock.patch.object(ProvisionedInstance, "_manager",
+                                    return_value=self.manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_alloc_takes_the_warm_database(self):
+        pi = ProvisionedInstance.objects.create(host="10.0.0.1",
+                                                warm_db="warm_abc")
+        instance = Instance(name="mydb")
+        pi.alloc(instance)
+        self.assertFalse(self.manager.create_database.called)
+        instance = Instance.objects.get(name="mydb")
+        self.assertEqual("warm_abc", instance.database_name)
+        self.assertEqual("running", instance.state)
+        pi = ProvisionedInstance.objects.get()
+        self.assertEqual("", pi.warm_db)
+        self.assertEqual([instance], list(pi.tenants.all()))
+
+    def test_alloc_leaves_a_database_warmed_in_the_meantime(self):
+        pi = ProvisionedInstance.objects.create(host="10.0.0.1", capacity=2)
+        ProvisionedInstance.objects.update(warm_db="warm_abc")
+        pi.alloc(Instance(name="mydb"))
+        self.assertEqual("mydb", Instance.objects.get().database_name)
+        self.manager.create_database.assert_called_with()
+        pi = ProvisionedInstance.objects.get()
+        self.assertEqual("warm_abc", pi.warm_db)
+        self.assertEqual(1, pi.used)
+
+    def test_alloc_creates_a_database_when_the_warm_one_was_taken(self):
+        pi = ProvisionedInstance.objects.create(host="10.0.0.1", capacity=2,
+                                                warm_db="warm_abc")
+        stale = ProvisionedInstance.objects.get(pk=pi.pk)
+        pi.alloc(Instance(name="first"))
+        second = Instance(name="second")
+        stale.alloc(second)
+        self.assertEqual("running", second.state)
+        self.assertEqual("second", second.database_name)
+        self.manager.create_database.assert_called_once_with()
+        self.assertEqual(2, ProvisionedInstance.objects.get().used)
+
+    def test_alloc_fails_when_the_warm_database_was_the_last_slot(self):
+        pi = ProvisionedInstance.objects.create(host="10.0.0.1",
+                                                warm_db="warm_abc")
+        stale = ProvisionedInstance.objects.get(pk=pi.pk)
+        pi.alloc(Instance(name="first"))
+        with self.assertRaises(models.InstanceUnavailable):
+            stale.alloc(Instance(name="second"))
+        self.assertFalse(Instance.objects.filter(name="second").exists())
+
+    def test_db_manager_uses_the_database_name(self):
+        instance = Instance(name="mydb", db_name="warm_abc")
+        self.assertEqual("warm_abc", instance.db_manager().name)
+        self.assertEqual("mydb", Instance(name="mydb").database_name)
+
+    @mock.patch("mysqlapi.api.models.warmer")
+    def test_create_from_pool_prefers_warm_instances(self, w):
+        ProvisionedInstance.objects.create(host="10.0.0.1")
+        ProvisionedInstance.objects.create(host="10.0.0.2",
+                                           warm_db="warm_abc")
+        instance = Instance(name="mydb")
+        models._create_from_pool(instance)
+        self.assertEqual("10.0.0.2", instance.host)
+        self.assertEqual("warm_abc", instance.db_name)
+        w.wake.assert_called_once_with()
@@ -7,16 +7,16 @@
 import json
 import subprocess
 
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.generic.base import View
 
 import crane_ec2
 
+from mysqlapi.api import compression, health, pool
 from mysqlapi.api.decorators import basic_auth_required
 from mysqlapi.api.models import (create_database, DatabaseManager,
-                                 ProvisionedInstance, Instance,
-                                 canonicalize_db_name)
+                                 Instance, canonicalize_db_name)
 
 
 class BindApp(View):
@@ -38,7 +38,7 @@ class BindApp(View):
         config = {
             "MYSQL_HOST": db.public_host,
             "MYSQL_PORT": u"3306",
-            "MYSQL_DATABASE_NAME": instance.name,
+            "MYSQL_DATABASE_NAME": instance.database_name,
             "MYSQL_USER": username,
             "MYSQL_PASSWORD": password,
         }
@@ -104,8 +104,12 @@ class DropDatabase(View):
             db = instance.db_manager()
             db.drop_database()
         elif instance.ec2_id is None:
-            pi = ProvisionedInstance.objects.get(instance=instance)
-            pi.dealloc()
+            provisioned = instance.provisioned or \
+                instance.legacy_provisioned()
+            if provisioned is None:
+                instance.db_manager().drop_database()
+            else:
+                provisioned.dealloc(instance)
         elif self._client.unauthorize(instance) and \
                 self._client.terminate(instance):
             pass
@@ -120,11 +124,45 @@ class DropDatabase(View):
 @require_http_methods(["GET"])
 def export(request, name):
     host = request.GET.get("service_host", "localhost")
+    name = canonicalize_db_name(name)
+    try:
+        # databases taken from the warm pool aren't named after their
+        # instance.
+        name = Instance.objects.get(name=name).database_name
+    except Instance.DoesNotExist:
+        pass
     try:
         db = DatabaseManager(name, host)
-        return HttpResponse(db.export())
+        content = db.export_stream()
     except subprocess.CalledProcessError, e:
         return HttpResponse(e.output.split(":")[-1].strip(), status=500)
+    accept = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    encoding = compression.negotiate(accept)
+    if encoding:
+        codec = compression.compressor(encoding)
+        content = compression.CompressedStream(content, codec)
+    response = StreamingHttpResponse(content)
+    response["Vary"] = "Accept-Encoding"
+    if encoding:
+        response["Content-Encoding"] = encoding
+    return response
+
+
+@basic_auth_required
+@require_http_methods(["GET"])
+def pool_forecast(request):
+    provisioner = pool.get_provisioner()
+    pending = provisioner.pending() if provisioner else 0
+    forecast = pool.forecast(pending=pending)
+    return HttpResponse(json.dumps(forecast.to_dict()),
+                        content_type="application/json")
+
+
+@basic_auth_required
+@require_http_methods(["GET"])
+def pool_hosts(request):
+    return HttpResponse(json.dumps(pool.hosts()),
+                        content_type="application/json")
 
 
 class Healthcheck(View):
@@ -142,8 +180,11 @@ class Healthcheck(View):
             return HttpResponse("pending", status=202)
 
         # if it is up, we check again to see if the state still the same
+        result = health.check(instance)
         status = 500
-        if instance.is_up():
+        if result.up:
             status = 204
 
-        return HttpResponse(status=status)
+        response = HttpResponse(status=status)
+        response["Age"] = str(int(result.age()))
+        return response
@@ -0,0 +1,114 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import sys
+import threading
+import traceback
+import uuid
+
+from django.db import connection
+
+provisioned_class = None
+manager_class = None
+_warmer = None
+
+
+def set_models(provisioned_cls, manager_cls):
+    global provisioned_class, manager_class
+    provisioned_class = provisioned_cls
+    manager_class = manager_cls
+
+
+def warm(provisioned):
+    """
+    Creates a database on a provisioned instance with room left, for the
+    next instance allocated there. Returns its name, or None when the
+    instance filled up in the meantime.
+    """
+    name = "warm_%s" % uuid.uuid4().hex[:16]
+    db = manager_class(name, host=provisioned.host, port=provisioned.port,
+                       user=provisioned.admin_user,
+                       password=provisioned.admin_password)
+    db.create_database()
+    cold = provisioned_class.objects.filter(pk=provisioned.pk,
+                                            used__lt=provisioned.slots,
+                                            warm_db="")
+    if cold.update(warm_db=name):
+        provisioned.warm_db = name
+        return name
+    db.drop_database()
+    return None
+
+
+class PoolWarmer(threading.Thread):
+    """
+    Keeps a database ready on every provisioned instance with room left, so
+    allocating one doesn't wait for CREATE DATABASE. It refills the pool
+    every `interval` seconds, or right after an allocation.
+    """
+
+    def __init__(self, interval):
+        super(PoolWarmer, self).__init__()
+        self.interval = interval
+        self.daemon = True
+        self.stats = {"warmed": 0, "failed": 0}
+        self._stopped = threading.Event()
+        self._woken = threading.Event()
+
+    def refill(self):
+        cold = provisioned_class.objects.filter(warm_db="")
+        for provisioned in cold:
+            if self._stopped.is_set():
+                break
+            if not provisioned.free_slots:
+                continue
+            try:
+                if warm(provisioned):
+                    self.stats["warmed"] += 1
+            except Exception:
+                self.stats["failed"] += 1
+                sys.stderr.write("Failed to warm up %s:%s\n" %
+                                 (provisioned.host, provisioned.port))
+                traceback.print_exc(file=sys.stderr)
+
+    def wake(self):
+        self._woken.set()
+
+    def run(self):
+        try:
+            while not self._stopped.is_set():
+                self._woken.clear()
+                try:
+                    self.refill()
+                except Exception:
+                    sys.stderr.write("Failed to refill the pool\n")
+                    traceback.print_exc(file=sys.stderr)
+                self._woken.wait(self.interval)
+        finally:
+            connection.close()
+
+    def close(self):
+        self._stopped.set()
+        self._woken.set()
+
+    def stop(self):
+        self.close()
+        self.join()
+
+
+def start_warmer(interval):
+    global _warmer
+    _warmer = PoolWarmer(interval)
+    _warmer.start()
+    return _warmer
+
+
+def stop_warmer():
+    if _warmer:
+        _warmer.close()
+
+
+def wake():
+    if _warmer:
+        _warmer.wake()
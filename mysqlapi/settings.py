@@ -149,8 +149,56 @@ SHARED_SERVER_PUBLIC_HOST = os.environ.get(
 SHARED_USER = os.environ.get("MYSQLAPI_SHARED_USER", "root")
 SHARED_PASSWORD = os.environ.get("MYSQLAPI_SHARED_PASSWORD", "")
 
+DB_POOL_MAX_SIZE = int(os.environ.get("MYSQLAPI_DB_POOL_MAX_SIZE", 10))
+DB_POOL_IDLE_TIMEOUT = int(
+    os.environ.get("MYSQLAPI_DB_POOL_IDLE_TIMEOUT", 300))
+DB_POOL_WAIT_TIMEOUT = int(os.environ.get("MYSQLAPI_DB_POOL_WAIT_TIMEOUT", 10))
+DB_CONNECT_TIMEOUT = int(os.environ.get("MYSQLAPI_DB_CONNECT_TIMEOUT", 5))
+
 USE_POOL = os.environ.get("MYSQLAPI_USE_POOL", "False") in \
     ("True", "true", "1")
+# pool servers with room left a create request tries, fullest first, and
+# how many times it looks for them when other requests fill them first.
+POOL_ALLOC_CANDIDATES = int(
+    os.environ.get("MYSQLAPI_POOL_ALLOC_CANDIDATES", 10))
+POOL_ALLOC_ATTEMPTS = int(os.environ.get("MYSQLAPI_POOL_ALLOC_ATTEMPTS", 5))
+# databases a pool server holds: POOL_HOST_CAPACITY is the count given to
+# servers added by the pool controller, and servers with a known memory or
+# disk size hold at most that size divided by the per-database size (in
+# MB, 0 to ignore it).
+POOL_HOST_CAPACITY = int(os.environ.get("MYSQLAPI_POOL_HOST_CAPACITY", 1))
+POOL_TENANT_MEMORY_MB = int(
+    os.environ.get("MYSQLAPI_POOL_TENANT_MEMORY_MB", 0))
+POOL_TENANT_DISK_MB = int(os.environ.get("MYSQLAPI_POOL_TENANT_DISK_MB", 0))
+# keep a database ready on pool servers with room left, refilled every
+# POOL_WARM_INTERVAL seconds and after each allocation.
+POOL_WARM = os.environ.get("MYSQLAPI_POOL_WARM", "False") in \
+    ("True", "true", "1")
+POOL_WARM_INTERVAL = int(os.environ.get("MYSQLAPI_POOL_WARM_INTERVAL", 60))
+# the pool controller asks POOL_PROVISIONER (a dotted path to a
+# Provisioner subclass, none by default) for more instances when the free ones would run out,
+# at the allocation rate of the last POOL_FORECAST_WINDOW seconds, within
+# POOL_LEAD_TIME seconds, or drop below POOL_MIN_FREE.
+POOL_PROVISIONER = os.environ.get("MYSQLAPI_POOL_PROVISIONER", "")
+POOL_FORECAST_WINDOW = int(
+    os.environ.get("MYSQLAPI_POOL_FORECAST_WINDOW", 3600))
+POOL_LEAD_TIME = int(os.environ.get("MYSQLAPI_POOL_LEAD_TIME", 1800))
+POOL_MIN_FREE = int(os.environ.get("MYSQLAPI_POOL_MIN_FREE", 1))
+POOL_MAX_PROVISION = int(os.environ.get("MYSQLAPI_POOL_MAX_PROVISION", 10))
+POOL_CONTROLLER_INTERVAL = int(
+    os.environ.get("MYSQLAPI_POOL_CONTROLLER_INTERVAL", 60))
+
+HEALTHCHECK_CACHE_TTL = float(
+    os.environ.get("MYSQLAPI_HEALTHCHECK_CACHE_TTL", 5))
+# healthchecks are answered from the results of the probe_health process
+# (the "prober" process of the Procfile) while they are fresh. Turn it off
+# when no such process runs.
+HEALTH_PROBER = os.environ.get("MYSQLAPI_HEALTH_PROBER", "True") in \
+    ("True", "true", "1")
+HEALTH_PROBE_INTERVAL = int(os.environ.get("MYSQLAPI_HEALTH_PROBE_INTERVAL",
+                                           10))
+HEALTH_PROBE_CONCURRENCY = int(
+    os.environ.get("MYSQLAPI_HEALTH_PROBE_CONCURRENCY", 20))
 
 EC2_ENDPOINT = os.environ.get("MYSQLAPI_EC2_ENDPOINT")
 EC2_PORT = os.environ.get("MYSQLAPI_EC2_PORT")
@@ -160,10 +208,100 @@ EC2_SECRET_KEY = os.environ.get("MYSQLAPI_EC2_SECRET_KEY")
 EC2_AMI = os.environ.get("MYSQLAPI_EC2_AMI")
 EC2_KEY_NAME = os.environ.get("MYSQLAPI_EC2_KEY_NAME")
 EC2_POLL_INTERVAL = int(os.environ.get("MYSQLAPI_EC2_POLL_INTERVAL", 10))
+# number of threads creating the databases of new EC2 instances.
+CREATOR_WORKERS = int(os.environ.get("MYSQLAPI_CREATOR_WORKERS", 4))
+# instances that aren't running are polled again after EC2_POLL_INTERVAL
+# seconds, doubling up to CREATOR_MAX_BACKOFF, and are moved to the error
+# state after CREATOR_MAX_ATTEMPTS polls or CREATOR_DEADLINE seconds.
+CREATOR_MAX_BACKOFF = int(os.environ.get("MYSQLAPI_CREATOR_MAX_BACKOFF", 120))
+CREATOR_MAX_ATTEMPTS = int(os.environ.get("MYSQLAPI_CREATOR_MAX_ATTEMPTS", 60))
+CREATOR_DEADLINE = int(os.environ.get("MYSQLAPI_CREATOR_DEADLINE", 1800))
+# most instances described by a single EC2 call.
+CREATOR_POLL_BATCH = int(os.environ.get("MYSQLAPI_CREATOR_POLL_BATCH", 100))
+# seconds a process holds a provisioning job before other processes may
+# claim it again.
+CREATOR_LEASE = int(os.environ.get("MYSQLAPI_CREATOR_LEASE", 300))
 
 S3_ACCESS_KEY = os.environ.get("TSURU_S3_ACCESS_KEY_ID")
 S3_SECRET_KEY = os.environ.get("TSURU_S3_SECRET_KEY")
 S3_BUCKET = os.environ.get("TSURU_S3_BUCKET")
+# custom endpoint, e.g. a local S3 stand-in.
+S3_HOST = os.environ.get("MYSQLAPI_S3_HOST")
+S3_PORT = int(os.environ.get("MYSQLAPI_S3_PORT", 443))
+S3_SECURE = os.environ.get("MYSQLAPI_S3_SECURE", "True") in \
+    ("True", "true", "1")
+S3_PART_SIZE = int(os.environ.get("MYSQLAPI_S3_PART_SIZE", 8 * 1024 * 1024))
+S3_UPLOAD_CONCURRENCY = int(
+    os.environ.get("MYSQLAPI_S3_UPLOAD_CONCURRENCY", 4))
+
+BACKUP_HOST = os.environ.get("MYSQLAPI_BACKUP_HOST", "localhost")
+BACKUP_PORT = os.environ.get("MYSQLAPI_BACKUP_PORT", "3306")
+BACKUP_USER = os.environ.get("MYSQLAPI_BACKUP_USER", "root")
+BACKUP_PASSWORD = os.environ.get("MYSQLAPI_BACKUP_PASSWORD", "")
+BACKUP_WORKERS = int(os.environ.get("MYSQLAPI_BACKUP_WORKERS", 4))
+# databases larger than this many bytes are dumped in primary key chunks.
+BACKUP_CHUNK_THRESHOLD = int(
+    os.environ.get("MYSQLAPI_BACKUP_CHUNK_THRESHOLD", 1024 * 1024 * 1024))
+BACKUP_CHUNK_ROWS = int(os.environ.get("MYSQLAPI_BACKUP_CHUNK_ROWS", 500000))
+BACKUP_CHUNK_WORKERS = int(os.environ.get("MYSQLAPI_BACKUP_CHUNK_WORKERS", 4))
+BACKUP_RESTORE_THREADS = int(
+    os.environ.get("MYSQLAPI_BACKUP_RESTORE_THREADS", 1))
+# record binlog coordinates with each backup and ship the binary logs, so
+# restores can roll forward to a point in time.
+BACKUP_BINLOG = os.environ.get("MYSQLAPI_BACKUP_BINLOG", "False") in \
+    ("True", "true", "1")
+BACKUP_BINLOG_INTERVAL = int(
+    os.environ.get("MYSQLAPI_BACKUP_BINLOG_INTERVAL", 300))
+# store backups as content-defined chunks shared between backups.
+BACKUP_DEDUP = os.environ.get("MYSQLAPI_BACKUP_DEDUP", "False") in \
+    ("True", "true", "1")
+BACKUP_DEDUP_CHUNK_SIZE = int(
+    os.environ.get("MYSQLAPI_BACKUP_DEDUP_CHUNK_SIZE", 1024 * 1024))
+BACKUP_DEDUP_GC_GRACE = int(
+    os.environ.get("MYSQLAPI_BACKUP_DEDUP_GC_GRACE", 24 * 60 * 60))
+# codec ("gzip", "zstd", "lz4" or "none") used to compress backups, its
+# level (empty for the codec default) and the threads compressing blocks.
+BACKUP_CODEC = os.environ.get("MYSQLAPI_BACKUP_CODEC", "gzip")
+BACKUP_CODEC_LEVEL = os.environ.get("MYSQLAPI_BACKUP_CODEC_LEVEL")
+BACKUP_CODEC_THREADS = int(os.environ.get("MYSQLAPI_BACKUP_CODEC_THREADS", 4))
+# limits that keep backups from hurting live servers: a bytes/sec cap shared
+# by all dump streams, a cap on concurrent dumps, and the running threads or
+# replication lag (in seconds) past which dumps pause for
+# BACKUP_THROTTLE_PAUSE seconds. 0 disables each limit.
+BACKUP_RATE_LIMIT = int(os.environ.get("MYSQLAPI_BACKUP_RATE_LIMIT", 0))
+BACKUP_MAX_WORKERS = int(os.environ.get("MYSQLAPI_BACKUP_MAX_WORKERS", 0))
+BACKUP_MAX_THREADS_RUNNING = int(
+    os.environ.get("MYSQLAPI_BACKUP_MAX_THREADS_RUNNING", 0))
+BACKUP_MAX_REPLICATION_LAG = int(
+    os.environ.get("MYSQLAPI_BACKUP_MAX_REPLICATION_LAG", 0))
+BACKUP_THROTTLE_PAUSE = int(
+    os.environ.get("MYSQLAPI_BACKUP_THROTTLE_PAUSE", 5))
+# the scheduler backs every instance up once a day, at a fixed time of its
+# own (give or take BACKUP_JITTER seconds) in a window of BACKUP_WINDOW_HOURS
+# starting at BACKUP_WINDOW_START (UTC), with at most
+# BACKUP_SCHEDULER_CONCURRENCY backups at once, BACKUP_HOST_CONCURRENCY of
+# them on the same server.
+BACKUP_WINDOW_START = os.environ.get("MYSQLAPI_BACKUP_WINDOW_START", "00:00")
+BACKUP_WINDOW_HOURS = float(
+    os.environ.get("MYSQLAPI_BACKUP_WINDOW_HOURS", 6))
+BACKUP_JITTER = int(os.environ.get("MYSQLAPI_BACKUP_JITTER", 300))
+BACKUP_SCHEDULER_CONCURRENCY = int(
+    os.environ.get("MYSQLAPI_BACKUP_SCHEDULER_CONCURRENCY", 4))
+BACKUP_HOST_CONCURRENCY = int(
+    os.environ.get("MYSQLAPI_BACKUP_HOST_CONCURRENCY", 1))
+BACKUP_SCHEDULER_TICK = int(
+    os.environ.get("MYSQLAPI_BACKUP_SCHEDULER_TICK", 60))
+# how tables are fingerprinted to skip unchanged ones: "status" (from
+# information_schema), "checksum" (CHECKSUM TABLE, which reads every row) or
+# "none".
+BACKUP_FINGERPRINT = os.environ.get("MYSQLAPI_BACKUP_FINGERPRINT",
+                                    "status")
+# backups older than this many days are pruned, but the latest
+# BACKUP_RETENTION_KEEP backups of each server are always kept.
+BACKUP_RETENTION_DAYS = int(
+    os.environ.get("MYSQLAPI_BACKUP_RETENTION_DAYS", 30))
+BACKUP_RETENTION_KEEP = int(
+    os.environ.get("MYSQLAPI_BACKUP_RETENTION_KEEP", 7))
 
 SALT = os.environ.get("MYSQLAPI_SALT", "")
 
@@ -21,4 +21,8 @@ urlpatterns = patterns('',
                            'mysqlapi.api.views.export'),
                        url(r'^resources/(?P<name>[\w-]+)/status$',
                            basic_auth_required(Healthcheck.as_view())),
+                       url(r'^pool/forecast$',
+                           'mysqlapi.api.views.pool_forecast'),
+                       url(r'^pool/hosts$',
+                           'mysqlapi.api.views.pool_hosts'),
                        )
@@ -9,8 +9,9 @@ import signal
 
 import crane_ec2
 
-from mysqlapi.api import creator
-from mysqlapi.api.models import DatabaseManager, Instance
+from mysqlapi.api import creator, ec2, warmer
+from mysqlapi.api.models import (DatabaseManager, Instance,
+                                 ProvisionedInstance, ProvisioningJob)
 
 os.environ["DJANGO_SETTINGS_MODULE"] = "mysqlapi.settings"
 
@@ -21,15 +22,21 @@ def huphandler(signum, frame):
 
 def termhandler(signum, frame):
     creator.close_queue()
+    warmer.stop_warmer()
 
 
 def start():
+    from django.conf import settings
+
     client = crane_ec2.Client()
     signal.signal(signal.SIGHUP, huphandler)
     signal.signal(signal.SIGTERM, termhandler)
-    creator.set_model(Instance)
+    creator.set_model(Instance, ProvisioningJob)
     creator.build_queue()
-    creator.start_creator(DatabaseManager, client)
+    creator.start_creator(DatabaseManager, ec2.Client(client))
+    warmer.set_models(ProvisionedInstance, DatabaseManager)
+    if settings.USE_POOL and settings.POOL_WARM:
+        warmer.start_warmer(settings.POOL_WARM_INTERVAL)
 
 start()
 